@@ -0,0 +1,234 @@
+# admission_control.py
+"""Admission control in front of the generation pipeline.
+
+At most `max_concurrent` generations run at once. Requests beyond that wait in
+a queue ordered by start-time fair queuing: every user has a virtual finish
+time that grows by the cost of each request divided by the user's weight, and
+a request starts at the later of the current virtual time and its user's
+finish time. A user who sends many requests, or expensive ones, moves back in
+the queue behind users who have asked for less, instead of starving them.
+
+Waiters learn their queue position when they join and whenever it changes,
+at most once per `position_interval`.
+
+AdmissionLanes gives each kind of work its own controller and limit, so a
+queue of large video analyses or exports never delays a short text question.
+"""
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Optional, Dict, List, Callable, Awaitable
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class AdmissionRejected(Exception):
+    """The admission queue is full"""
+
+
+class _Waiter:
+    __slots__ = ("tag", "seq", "user_id", "future", "position", "changed")
+
+    def __init__(self, tag: float, seq: int, user_id: int, future: asyncio.Future):
+        self.tag = tag
+        self.seq = seq
+        self.user_id = user_id
+        self.future = future
+        self.position = 0
+        self.changed = asyncio.Event()
+
+    def __lt__(self, other: "_Waiter") -> bool:
+        return (self.tag, self.seq) < (other.tag, other.seq)
+
+
+class AdmissionController:
+    """Global generation concurrency limit with weighted fair queuing across users"""
+
+    def __init__(
+        self,
+        max_concurrent: int = 16,
+        max_queue: int = 1000,
+        position_interval: float = 1.0,
+        costs: Optional[Dict[str, float]] = None,
+        max_users: int = 10000,
+        name: str = "default"
+    ):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.position_interval = position_interval
+        self.costs = costs or {}
+        self.max_users = max_users
+        self.in_flight = 0
+        self._queue: List[_Waiter] = []  # Heap ordered by start tag, then arrival
+        self._finish: Dict[int, float] = OrderedDict()  # Virtual finish time per user
+        self._virtual_time = 0.0
+        self._seq = itertools.count()
+        self._refresh: Optional[asyncio.TimerHandle] = None
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._queue)
+
+    def _start_tag(self, user_id: int, share: float) -> float:
+        start = max(self._virtual_time, self._finish.get(user_id, 0.0))
+        self._finish[user_id] = start + share
+        self._finish.move_to_end(user_id)
+        if len(self._finish) > self.max_users:
+            self._finish.popitem(last=False)
+        return start
+
+    def _refund(self, user_id: int, share: float) -> None:
+        """Give back the share of a request that left the queue without running"""
+        if user_id in self._finish:
+            self._finish[user_id] = max(self._virtual_time, self._finish[user_id] - share)
+
+    @asynccontextmanager
+    async def admit(
+        self,
+        user_id: int,
+        content_type: str = "text",
+        weight: float = 1.0,
+        on_position: Optional[Callable[[int], Awaitable[None]]] = None,
+        cancel_token=None
+    ):
+        """Hold a generation slot for the block; yields False if `cancel_token` fired while queued
+
+        Raises AdmissionRejected when the queue is full.
+        """
+        immediate = self.in_flight < self.max_concurrent and not self._queue
+        if not immediate and len(self._queue) >= self.max_queue:
+            metrics.inc("admission_rejected_total", lane=self.name)
+            raise AdmissionRejected(f"Admission queue is full ({self.max_queue} waiting)")
+
+        share = self.costs.get(content_type, 1.0) / weight
+        tag = self._start_tag(user_id, share)
+        if immediate:
+            self._virtual_time = max(self._virtual_time, tag)
+            self.in_flight += 1
+            self._update_gauges()
+            admitted = True
+        else:
+            try:
+                admitted = await self._wait(tag, user_id, on_position, cancel_token)
+            except BaseException:
+                self._refund(user_id, share)
+                raise
+            if not admitted:
+                self._refund(user_id, share)
+
+        try:
+            yield admitted
+        finally:
+            if admitted:
+                self._release()
+
+    async def _wait(self, tag: float, user_id: int, on_position, cancel_token) -> bool:
+        waiter = _Waiter(tag, next(self._seq), user_id, asyncio.get_running_loop().create_future())
+        heapq.heappush(self._queue, waiter)
+        waiter.position = 1 + sum(1 for other in self._queue if other < waiter)
+        self._update_gauges()
+        self._schedule_refresh()
+        started = time.monotonic()
+
+        cancelled = asyncio.ensure_future(cancel_token.wait()) if cancel_token is not None else None
+        shown = None
+        try:
+            while not waiter.future.done():
+                if on_position is not None and waiter.position != shown:
+                    shown = waiter.position
+                    try:
+                        await on_position(shown)
+                    except Exception as e:
+                        logger.error(f"Error showing queue position: {str(e)}")
+                    continue
+                if cancelled is not None and cancelled.done():
+                    break
+
+                waiter.changed.clear()
+                changed = asyncio.ensure_future(waiter.changed.wait())
+                pending = [waiter.future, changed] + ([cancelled] if cancelled is not None else [])
+                try:
+                    await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                finally:
+                    changed.cancel()
+        except BaseException:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # Granted just as the caller went away; hand the slot on
+                self._release()
+            raise
+        finally:
+            if cancelled is not None:
+                cancelled.cancel()
+            if not waiter.future.done():
+                waiter.future.cancel()
+                self._queue.remove(waiter)
+                heapq.heapify(self._queue)
+                self._update_gauges()
+                self._schedule_refresh()
+
+        if waiter.future.cancelled():
+            return False
+        metrics.observe("admission_wait_seconds", time.monotonic() - started, lane=self.name)
+        return True
+
+    def _release(self) -> None:
+        self.in_flight -= 1
+        while self.in_flight < self.max_concurrent and self._queue:
+            waiter = heapq.heappop(self._queue)
+            self._virtual_time = max(self._virtual_time, waiter.tag)
+            self.in_flight += 1
+            waiter.future.set_result(True)
+        self._update_gauges()
+        self._schedule_refresh()
+
+    def _schedule_refresh(self) -> None:
+        if self._refresh is None and self._queue:
+            self._refresh = asyncio.get_running_loop().call_later(self.position_interval, self._refresh_positions)
+
+    def _refresh_positions(self) -> None:
+        """Tell waiters whose queue position changed"""
+        self._refresh = None
+        for position, waiter in enumerate(sorted(self._queue), 1):
+            if waiter.position != position:
+                waiter.position = position
+                waiter.changed.set()
+
+    def _update_gauges(self) -> None:
+        metrics.set_gauge("admission_in_flight", self.in_flight, lane=self.name)
+        metrics.set_gauge("admission_queue_depth", len(self._queue), lane=self.name)
+
+
+class AdmissionLanes:
+    """One admission controller per lane, each with its own concurrency limit"""
+
+    def __init__(
+        self,
+        lanes: Dict[str, int],
+        lane_of: Dict[str, str],
+        default_lane: str = "text",
+        **settings
+    ):
+        self.lanes = {
+            name: AdmissionController(max_concurrent=limit, name=name, **settings)
+            for name, limit in lanes.items()
+        }
+        self.lane_of = lane_of
+        self.default_lane = default_lane
+
+    def lane(self, content_type: str) -> AdmissionController:
+        return self.lanes[self.lane_of.get(content_type, self.default_lane)]
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(lane.queue_depth for lane in self.lanes.values())
+
+    def admit(self, user_id: int, content_type: str = "text", **kwargs):
+        """Admit a request in the lane of `content_type`; see AdmissionController.admit"""
+        return self.lane(content_type).admit(user_id, content_type, **kwargs)
@@ -0,0 +1,175 @@
+# api_key_pool.py
+from contextlib import contextmanager
+from typing import List, Optional, Dict, Iterator, Union, Callable, AsyncGenerator
+import logging
+import time
+
+from config import API_KEY_POOL
+from metrics import metrics
+from handlers.stream_events import EventStream, StreamEvent, USAGE
+
+logger = logging.getLogger(__name__)
+
+_AUTH_STATUSES = (401, 403)
+_QUOTA_STATUS = 402
+_RATE_LIMIT_STATUS = 429
+# A 429 caused by spent quota or credit rather than a short-lived rate limit;
+# the key stays unusable until the provider resets it
+_QUOTA_ERROR_MARKERS = (
+    "insufficient balance", "insufficient_quota", "exceeded your current quota",
+    "billing", "per day"
+)
+
+
+class NoAvailableKeyError(Exception):
+    """Raised when every key in a pool is quarantined"""
+
+    def __init__(self, provider: str, retry_after: float):
+        super().__init__(f"All {provider} API keys are temporarily unavailable")
+        self.retry_after = retry_after
+
+
+class ApiKey:
+    """A single API key with its load and usage counters"""
+
+    def __init__(self, key: str):
+        self.key = key
+        self.label = f"...{key[-4:]}" if key and len(key) > 4 else "key"
+        self.in_flight = 0
+        self.requests = 0
+        self.tokens = 0
+        self.errors = 0
+        self.remaining: Optional[int] = None
+        self.quarantined_until = 0.0
+        self.quarantine_reason: Optional[str] = None
+
+    @property
+    def available(self) -> bool:
+        return time.monotonic() >= self.quarantined_until
+
+    def stats(self) -> Dict:
+        return {
+            "in_flight": self.in_flight,
+            "requests": self.requests,
+            "tokens": self.tokens,
+            "errors": self.errors,
+            "remaining": self.remaining,
+            "quarantined": not self.available,
+            "quarantine_reason": self.quarantine_reason if not self.available else None
+        }
+
+
+class ApiKeyPool:
+    """Pool of API keys for one provider with load-aware selection and quarantine"""
+
+    def __init__(self, provider: str, keys: Union[str, List[str], None], settings: Optional[Dict] = None):
+        settings = settings if settings is not None else API_KEY_POOL
+        if isinstance(keys, str):
+            keys = [keys]
+        self.provider = provider
+        self.keys = [ApiKey(key) for key in (keys or []) if key]
+        self.strategy = settings["strategy"]
+        self.quota_cooldown = settings["quota_cooldown"]
+        self.auth_cooldown = settings["auth_cooldown"]
+        self.rate_limit_cooldown = settings["rate_limit_cooldown"]
+        self._next = 0
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def _select(self) -> ApiKey:
+        available = [key for key in self.keys if key.available]
+        if not available:
+            if not self.keys:
+                raise NoAvailableKeyError(self.provider, 0)
+            retry_after = min(key.quarantined_until for key in self.keys) - time.monotonic()
+            raise NoAvailableKeyError(self.provider, max(0.0, retry_after))
+
+        # Rotate the starting point so ties don't always land on the first key
+        self._next = (self._next + 1) % len(available)
+        available = available[self._next:] + available[:self._next]
+
+        if self.strategy == "remaining_quota":
+            return max(
+                available,
+                key=lambda k: (k.remaining if k.remaining is not None else float("inf"), -k.in_flight)
+            )
+        return min(available, key=lambda k: (k.in_flight, k.requests))
+
+    @contextmanager
+    def lease(self) -> Iterator[ApiKey]:
+        """Borrow the best available key for the duration of one request"""
+        key = self._select()
+        key.in_flight += 1
+        key.requests += 1
+        metrics.inc("api_key_requests_total", provider=self.provider, key=key.label)
+        try:
+            yield key
+        finally:
+            key.in_flight -= 1
+
+    def record_usage(self, key: ApiKey, tokens: int) -> None:
+        key.tokens += tokens
+        metrics.inc("api_key_tokens_total", tokens, provider=self.provider, key=key.label)
+
+    def update_remaining(self, key: ApiKey, remaining: Optional[str]) -> None:
+        """Store the remaining-requests figure reported by rate limit headers"""
+        try:
+            key.remaining = int(remaining) if remaining is not None else key.remaining
+        except (TypeError, ValueError):
+            pass
+
+    def report_error(
+        self,
+        key: ApiKey,
+        error: str,
+        retry_after: Optional[float] = None,
+        status: Optional[int] = None
+    ) -> None:
+        """Quarantine a key after rate limit, quota or authentication errors
+
+        The kind of error is decided by the HTTP status of the failed call, so
+        errors without one (network failures, bad input) never bench a key.
+        A transient rate limit only benches the key for its Retry-After, and never
+        the last usable key: the retry policy already waits out Retry-After, and
+        quarantining it would fail every other request in the meantime.
+        """
+        key.errors += 1
+        error = (error or "").lower()
+        if status in _AUTH_STATUSES:
+            cooldown, reason = self.auth_cooldown, "auth"
+        elif status == _QUOTA_STATUS or (
+            status == _RATE_LIMIT_STATUS and any(marker in error for marker in _QUOTA_ERROR_MARKERS)
+        ):
+            cooldown, reason = max(retry_after or 0, self.quota_cooldown), "quota"
+        elif status == _RATE_LIMIT_STATUS:
+            if not any(other.available for other in self.keys if other is not key):
+                return
+            cooldown, reason = retry_after or self.rate_limit_cooldown, "rate_limit"
+        else:
+            return
+        key.quarantined_until = time.monotonic() + cooldown
+        key.quarantine_reason = reason
+        metrics.inc("api_key_quarantined_total", provider=self.provider, key=key.label, reason=reason)
+        logger.warning(f"Quarantined {self.provider} key {key.label} for {cooldown:.1f}s ({reason})")
+
+    async def stream(
+        self,
+        events: EventStream,
+        generate: Callable[[ApiKey], AsyncGenerator[StreamEvent, None]]
+    ) -> AsyncGenerator[StreamEvent, None]:
+        """Run `generate` with a leased key, tracking usage and quarantining failing keys"""
+        try:
+            with self.lease() as key:
+                async for event in generate(key):
+                    if event.is_error:
+                        self.report_error(key, event.error, event.retry_after, event.status)
+                    elif event.kind == USAGE and event.usage:
+                        self.record_usage(key, sum(event.usage.values()))
+                    yield event
+        except NoAvailableKeyError as e:
+            logger.error(str(e))
+            yield events.error(str(e), retryable=True, retry_after=e.retry_after)
+
+    def stats(self) -> Dict[str, Dict]:
+        return {key.label: key.stats() for key in self.keys}
@@ -21,15 +21,18 @@ import os
 import asyncio
 from datetime import datetime
 import logging
-from PIL import Image
 import os
 import time
+import math
 import re
-from typing import List
+import json
+from typing import List, Tuple
 from config import (
     API_ID, API_HASH, BOT_TOKEN,
-    GEMINI_API_KEY, CLAUDE_API_KEY, DEEPSEEK_API_KEY,
-    MODELS, DEFAULT_PARAMS, PARAMETER_CONFIG
+    GEMINI_API_KEYS, CLAUDE_API_KEYS, DEEPSEEK_API_KEYS,
+    MODELS, DEFAULT_PARAMS, PARAMETER_CONFIG, UPDATE_TRACE, STREAMING_EDITS,
+    OUTBOUND_SCHEDULER, CHAT_LIST_PAGE_SIZE, ADMISSION_CONTROL, DEGRADATION,
+    MAX_CONCURRENT_DOWNLOADS, METRICS_LOG_INTERVAL
 )
 
 from tts_handler import GeminiTTS
@@ -38,7 +41,17 @@ from tts_handler import GeminiTTS
 from database import DatabaseManager
 from model_manager import ModelManager
 from keyboard_manager import KeyboardManager
+from callback_router import CallbackRouter
+from generation_registry import GenerationRegistry
+from admission_control import AdmissionLanes, AdmissionRejected
+from rate_limiter import UserRateLimiter
+from load_shedding import DegradationController, SLOW_EDITS
 from export_manager import ExportManager
+from update_trace import UpdateRecorder
+from message_renderer import StreamingRenderer
+from stream_presenter import EditThrottle, StreamPresenter
+from outbound_scheduler import OutboundScheduler
+from metrics import metrics
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -54,13 +67,13 @@ import os
 import asyncio
 from datetime import datetime
 import logging
-from PIL import Image
 import os
 import time
 import re
 from typing import List
 from pyrogram.errors import MessageTooLong
 from pyrogram.errors import BadRequest
+from collections import OrderedDict
 
 logger = logging.getLogger(__name__)
 
@@ -73,6 +86,10 @@ class MessageHandler:
         self.sent_chunks = {}
         self.chunk_buffers = {}  # Store buffers for each chunk
         self.temp_states = {}  # Store temporary states of messages
+        self.renderers = OrderedDict()  # Streaming renderer per message, least recently used first
+        self.max_renderers = 256
+        self.chunk_hashes = {}  # Per streamed message: sent message id -> hash of its text and markup
+        self.edit_throttle = EditThrottle(**STREAMING_EDITS)
 
     def format_content(self, text: str, content_type: str = "text") -> str:
         """Format content for better readability"""
@@ -245,94 +262,90 @@ class MessageHandler:
             # Fall back to escaping all HTML
             return html.escape(text)
 
-    async def edit_message_safely(self, message, text: str, reply_markup=None, content_type: str = "text", max_retries=3):
+    def message_key(self, message) -> str:
+        """Key for per-message state; message ids are only unique within a chat"""
+        return f"{message.chat.id}:{message.id}"
+
+    def render_chunks(self, message_id: str, text: str, content_type: str = "text") -> List[str]:
+        """Render text into message chunks, only processing what was added since the last call"""
+        renderer = self.renderers.get(message_id)
+        if renderer is None or renderer.content_type != content_type or not renderer.accepts(text):
+            renderer = StreamingRenderer(self.max_message_length, content_type)
+            self.renderers[message_id] = renderer
+            # A new text may follow edits made elsewhere, so what was sent is no longer known
+            self.chunk_hashes.pop(message_id, None)
+            if len(self.renderers) > self.max_renderers:
+                evicted_id, _ = self.renderers.popitem(last=False)
+                self.chunk_hashes.pop(evicted_id, None)
+        else:
+            self.renderers.move_to_end(message_id)
+        renderer.feed(text[renderer.source_length:])
+        return renderer.render()
+
+    def _chunk_hash(self, chunk: str, reply_markup=None) -> int:
+        """Hash of what a chunk message shows: its text and its keyboard"""
+        return hash((chunk, str(reply_markup) if reply_markup else None))
+
+    async def _edit_chunk(self, msg, chunk: str, reply_markup, hashes: Dict[int, int]) -> None:
+        """Edit one chunk message unless its text and markup are unchanged"""
+        digest = self._chunk_hash(chunk, reply_markup)
+        if hashes.get(msg.id) == digest:
+            return
+        try:
+            await msg.edit_text(chunk, reply_markup=reply_markup)
+            self.edit_throttle.record_edit(msg.chat.id)
+        except MessageNotModified:
+            pass
+        hashes[msg.id] = digest
+
+    def stream_to(self, message, reply_markup=None, content_type: str = "text") -> StreamPresenter:
+        """Presenter that streams an answer into `message` at the chat's edit pace"""
+        return StreamPresenter(self, message, reply_markup, content_type)
+
+    async def edit_message_safely(self, message, text: str, reply_markup=None, content_type: str = "text"):
         """Safely edit a message with proper error handling and formatting"""
         try:
-            message_id = str(message.id)
-            formatted_text = self.format_content(text, content_type)
-            
-            # Clean and validate HTML
-            formatted_text = self._clean_and_validate_html(formatted_text)
-            
-            # Check if we need to split the message
-            if len(formatted_text) > self.max_message_length:
-                chunks = self._split_message(formatted_text)
-                
-                # Store the state
+            message_id = self.message_key(message)
+            chunks = self.render_chunks(message_id, text, content_type)
+            hashes = self.chunk_hashes.setdefault(message_id, {})
+            sent_messages = self.sent_chunks.get(message_id, [message])
+
+            # Drop messages left over from a longer previous text
+            while len(sent_messages) > len(chunks):
+                msg_to_delete = sent_messages.pop()
+                hashes.pop(msg_to_delete.id, None)
+                try:
+                    await msg_to_delete.delete()
+                except Exception as e:
+                    logger.error(f"Error deleting excess message: {str(e)}")
+
+            # Edit the chunks whose text or markup changed
+            last = len(chunks) - 1
+            for i, msg in enumerate(sent_messages):
+                await self._edit_chunk(msg, chunks[i], reply_markup if i == last else None, hashes)
+
+            # Send messages for new chunks
+            for i in range(len(sent_messages), len(chunks)):
+                markup = reply_markup if i == last else None
+                try:
+                    sent_msg = await message.reply_text(chunks[i], reply_markup=markup)
+                except Exception as e:
+                    logger.error(f"Error sending message chunk: {str(e)}")
+                    break
+                hashes[sent_msg.id] = self._chunk_hash(chunks[i], markup)
+                self.edit_throttle.record_edit(message.chat.id)
+                sent_messages.append(sent_msg)
+
+            if len(sent_messages) > 1:
+                self.sent_chunks[message_id] = sent_messages
                 self._store_message_state(message_id, chunks, reply_markup)
-                
-                # If we already have chunk messages
-                if message_id in self.sent_chunks:
-                    existing_messages = self.sent_chunks[message_id]
-                    
-                    # If we need more messages
-                    while len(existing_messages) < len(chunks):
-                        chunk_msg = await message.reply_text("")
-                        existing_messages.append(chunk_msg)
-                    
-                    # If we have too many messages
-                    while len(existing_messages) > len(chunks):
-                        msg_to_delete = existing_messages.pop()
-                        try:
-                            await msg_to_delete.delete()
-                        except Exception as e:
-                            logger.error(f"Error deleting excess message: {str(e)}")
-                    
-                    # Update all chunks
-                    for i, (chunk, msg) in enumerate(zip(chunks, existing_messages)):
-                        try:
-                            await msg.edit_text(
-                                chunk,
-                                reply_markup=reply_markup if i == len(chunks)-1 else None
-                            )
-                        except MessageNotModified:
-                            continue
-                else:
-                    # First time sending chunks
-                    sent_messages = []
-                    
-                    # Edit first message
-                    try:
-                        await message.edit_text(
-                            chunks[0],
-                            reply_markup=None
-                        )
-                        sent_messages.append(message)
-                    except Exception as e:
-                       logger.error(f"Error editing first message: {str(e)}")
-                       return
-                    
-                    # Send remaining chunks
-                    for i, chunk in enumerate(chunks[1:]):
-                        try:
-                           sent_msg = await message.reply_text(chunk)
-                           sent_messages.append(sent_msg)
-                        except Exception as e:
-                            logger.error(f"Error sending message chunk: {str(e)}")
-                            continue
-                        await asyncio.sleep(0.1)  # Add a delay between sending chunks
-
-                    # Add markup to last message
-                    if reply_markup:
-                        try:
-                            await sent_messages[-1].edit_reply_markup(reply_markup)
-                        except Exception as e:
-                            logger.error(f"Error adding reply markup: {str(e)}")
-                    
-                    self.sent_chunks[message_id] = sent_messages
             else:
-                # For normal length messages
-                await message.edit_text(
-                    formatted_text,
-                    reply_markup=reply_markup
-                )
+                self.sent_chunks.pop(message_id, None)
         
         except FloodWait as e:
-            await asyncio.sleep(e.value)
-            if max_retries > 0:
-                return await self.edit_message_safely(
-                    message, text, reply_markup, content_type, max_retries - 1
-                )
+            # Shorter waits are retried by the outbound scheduler, which also tells the
+            # edit throttle through its flood listeners; a later edit carries the text
+            logger.warning(f"Dropping edit of message {message.id} after FloodWait of {e.value}s")
         except MessageNotModified:
             pass
         except MessageTooLong:
@@ -341,8 +354,9 @@ class MessageHandler:
              # delete old messages if exists
              await self.delete_message_chunks(message_id)
 
-             # Split the message and send it again
-             chunks = self._split_message(formatted_text)
+             # Render the message again from scratch and send it in chunks
+             self.renderers.pop(message_id, None)
+             chunks = self.render_chunks(message_id, text, content_type)
 
              # Store the state
              self._store_message_state(message_id, chunks, reply_markup)
@@ -595,10 +609,15 @@ class MessageHandler:
         return clean_text.strip()
 
 class AIBot:
-    def __init__(self):
+    def __init__(
+        self,
+        client: Optional[Client] = None,
+        db_path: str = "ai_chat.db",
+        model_manager: Optional[ModelManager] = None
+    ):
         """Initialize bot with necessary configurations"""
-        # Initialize Pyrogram client
-        self.app = Client(
+        # Initialize Pyrogram client (load tests pass a fake one)
+        self.app = client or Client(
             "ai_bot",
             api_id=API_ID,
             api_hash=API_HASH,
@@ -606,11 +625,11 @@ class AIBot:
         )
         
         # Initialize managers
-        self.db = DatabaseManager("ai_chat.db")
-        self.model_manager = ModelManager(
-            gemini_api_key=GEMINI_API_KEY,
-            claude_api_key=CLAUDE_API_KEY,
-            deepseek_api_key=DEEPSEEK_API_KEY
+        self.db = DatabaseManager(db_path)
+        self.model_manager = model_manager or ModelManager(
+            gemini_api_key=GEMINI_API_KEYS,
+            claude_api_key=CLAUDE_API_KEYS,
+            deepseek_api_key=DEEPSEEK_API_KEYS
         )
         self.keyboard_manager = KeyboardManager()
         self.export_manager = ExportManager()
@@ -627,24 +646,65 @@ class AIBot:
         # Create temp directory if it doesn't exist
         os.makedirs("temp", exist_ok=True)
 
+        # Optional anonymized trace of incoming updates
+        self.trace_recorder = None
+        if UPDATE_TRACE["enabled"]:
+            self.trace_recorder = UpdateRecorder(UPDATE_TRACE["path"], UPDATE_TRACE["max_events"])
+
+        # In-flight generations, so a new message or /cancel can stop the previous one
+        self.generations = GenerationRegistry()
+        # Generation and export limits per lane, with fair queuing across users
+        self.admission = AdmissionLanes(**ADMISSION_CONTROL)
+        # Media handlers run as their own tasks, so bound how many download at once
+        self.download_slots = asyncio.Semaphore(MAX_CONCURRENT_DOWNLOADS)
+
+        # Per-user update budgets, checked before any work is done
+        self.user_limiter = UserRateLimiter()
+
+        # Callback data routes
+        self.callback_router = CallbackRouter()
+        self.callback_router.use(self._rate_limit_callback)
+        self._register_callback_routes()
+
         # Register handlers
         self._register_handlers()
 
         self.message_handler = MessageHandler()
 
+        # Pace every outbound request; FloodWaits also slow down streamed edits
+        self.outbound = OutboundScheduler(**OUTBOUND_SCHEDULER)
+        self.outbound.install(self.app)
+        self.outbound.flood_listeners.append(self.message_handler.edit_throttle.record_flood_wait)
+
+        # Cheaper behaviour while queues or loop lag build up (started in run())
+        self.degradation = DegradationController(lambda: self.admission.queue_depth)
+        self.degradation.listeners.append(self._on_degradation_change)
+
         self.tts_handler = GeminiTTS()
 
     def _register_handlers(self):
         """Register all message and callback handlers"""
         
+        # Trace recorders run in an earlier group so they see every update
+        if self.trace_recorder:
+            @self.app.on_message(group=-1)
+            async def trace_message(client, message):
+                self.trace_recorder.record_message(message)
+
+            @self.app.on_callback_query(group=-1)
+            async def trace_callback(client, callback_query):
+                self.trace_recorder.record_callback(callback_query)
+
         # Command handlers
         @self.app.on_message(filters.command(["start", "help"]))
         async def start_command(client, message):
-            await self.handle_start(message)
+            if await self._check_rate_limit(message, "message"):
+                await self.handle_start(message)
 
         @self.app.on_message(filters.command("settings"))
         async def settings_command(client, message):
-            await self.handle_settings(message)
+            if await self._check_rate_limit(message, "message"):
+                await self.handle_settings(message)
 
         @self.app.on_message(filters.command("cancel"))
         async def cancel_command(client, message):
@@ -653,25 +713,68 @@ class AIBot:
         # Message handlers
         @self.app.on_message(filters.private & ~filters.command("*"))
         async def message_handler(client, message):
+            if not await self._check_rate_limit(message, "message" if message.text else "media"):
+                return
+            if not message.text and self.degradation.reject_media:
+                await message.reply_text(
+                    "⚠️ The bot is under heavy load and can't take files right now. "
+                    "Text questions still work; please send the file again in a few minutes."
+                )
+                return
             if message.text:
                 if message.from_user.id in self.rename_states:
                     await self.handle_rename_input(message)
-                else:
-                    await self.handle_text_message(message)
+                    return
+                handler = self.handle_text_message
             elif message.photo:
-                await self.handle_photo_message(message)
+                handler = self.handle_photo_message
             elif message.video:
-                await self.handle_video_message(message)
+                handler = self.handle_video_message
             elif message.audio or message.voice:
-                await self.handle_audio_message(message)
+                handler = self.handle_audio_message
             elif message.document:
-                await self.handle_document_message(message)
+                handler = self.handle_document_message
+            else:
+                return
+            self.generations.spawn(message.from_user.id, handler(message))
 
         # Callback query handler
         @self.app.on_callback_query()
         async def callback_handler(client, callback_query):
             await self.handle_callback(callback_query)
 
+    async def _check_rate_limit(self, message: Message, kind: str) -> bool:
+        """Whether the user may send this update now; sends a cool-down notice otherwise"""
+        user_id = message.from_user.id
+        retry_after = self.user_limiter.check(user_id, kind)
+        if not retry_after:
+            return True
+        logger.info(f"Rate limited {kind} from user {user_id}, retry in {retry_after:.1f}s")
+        if self.user_limiter.should_notify(user_id):
+            await message.reply_text(
+                f"⏳ You're sending messages too quickly. Please wait {math.ceil(retry_after)}s and try again."
+            )
+        return False
+
+    def _detached(self, handler):
+        """Wrap a long-running callback route so it runs outside the update worker"""
+        async def spawn(callback_query: CallbackQuery):
+            self.generations.spawn(callback_query.from_user.id, handler(callback_query))
+        return spawn
+
+    def _on_degradation_change(self, previous: int, level: int):
+        """Stretch streamed edit intervals in slow_edits mode and restore them after"""
+        factor = DEGRADATION["edit_interval_factor"] if level >= SLOW_EDITS else 1.0
+        self.message_handler.edit_throttle.min_interval = STREAMING_EDITS["min_interval"] * factor
+
+    async def _rate_limit_callback(self, callback_query: CallbackQuery, route, call_next):
+        """Callback router middleware applying the per-user callback budget"""
+        retry_after = self.user_limiter.check(callback_query.from_user.id, "callback")
+        if retry_after:
+            await callback_query.answer(f"⏳ Too many taps. Please wait {math.ceil(retry_after)}s.")
+            return
+        return await call_next()
+
     async def handle_start(self, message: Message):
         """Handle /start command"""
         user_id = message.from_user.id
@@ -703,93 +806,66 @@ class AIBot:
             reply_markup=self.keyboard_manager.get_model_selection_keyboard()
         )
 
-    async def handle_callback(self, callback_query: CallbackQuery):
-            """Main callback query handler"""
-            try:
-                data = callback_query.data
-                user_id = callback_query.from_user.id
-
-                logger.info(f"Received callback data: {data} from user {user_id}")
-    
-                # Check if it's a parameter adjustment callback
-                if any(data.startswith(prefix) for prefix in ["adjust_", "inc_", "dec_"]) \
-                or data in ["settings:advanced", "settings_help", "back_to_settings"]:
-                    await self.handle_settings_callback(callback_query)
-                    return
-
-                # Model selection handlers
-                if data.startswith("select_model:"):
-                    await self.handle_model_selection(callback_query)
-
-                elif data.startswith("select_version:"):
-                    await self.handle_version_selection(callback_query)
-
-                # Chat management handlers
-                elif data in ["new_chat", "select_chat"]:
-                    await self.handle_chat_management(callback_query)
-
-                elif data.startswith("select_chat:"):
-                    await self.handle_chat_selection(callback_query)
-
-                elif data.startswith("manage_chat:"):
-                    await self.handle_chat_management_options(callback_query)
-
-                elif data.startswith("rename_chat:"):
-                    await self.handle_rename_chat(callback_query)
-
-                elif data.startswith("delete_chat:"):
-                    await self.handle_delete_chat(callback_query)
-
-                elif data.startswith("confirm_delete:"):
-                    await self.handle_confirm_delete_chat(callback_query)
-
-                elif data.startswith("cancel_delete:"):
-                    await self.handle_cancel_delete_chat(callback_query)
-
-                # Model settings handlers
-                elif data == "model_settings":
-                    await self.handle_model_settings(callback_query)
-
-                elif data == "change_model":
-                    await self.handle_change_model(callback_query)
-
-                # Navigation handlers
-                elif data == "back_to_models":
-                    await self.handle_back_to_models(callback_query)
-
-                elif data == "back_to_options":
-                    await self.handle_back_to_options(callback_query)
-
-                elif data == "back_to_message":
-                    await self.handle_back_to_message(callback_query)
-
-                elif data == "back_to_chats":
-                    await self.handle_back_to_chats(callback_query)
+    def _register_callback_routes(self):
+        """Register callback data routes"""
+        router = self.callback_router
+
+        # Parameter adjustment and settings
+        for prefix in ("adjust_", "inc_", "dec_"):
+            router.prefix(prefix, self.handle_settings_callback)
+        for data in ("settings:advanced", "settings_help", "back_to_settings"):
+            router.exact(data, self.handle_settings_callback)
+
+        # Model selection handlers
+        router.prefix("select_model:", self.handle_model_selection)
+        router.prefix("select_version:", self.handle_version_selection)
+
+        # Chat management handlers
+        router.exact("new_chat", self.handle_chat_management)
+        router.exact("select_chat", self.handle_chat_management)
+        router.prefix("select_chat:", self.handle_chat_selection)
+        router.prefix("manage_chat:", self.handle_chat_management_options)
+        router.prefix("rename_chat:", self.handle_rename_chat)
+        router.prefix("delete_chat:", self.handle_delete_chat)
+        router.prefix("confirm_delete:", self.handle_confirm_delete_chat)
+        router.prefix("cancel_delete:", self.handle_cancel_delete_chat)
+        router.prefix("chats_page:", self.handle_chat_page)
+
+        # Model settings handlers
+        router.exact("model_settings", self.handle_model_settings)
+        router.exact("change_model", self.handle_change_model)
+
+        # Navigation handlers
+        router.exact("back_to_models", self.handle_back_to_models)
+        router.exact("back_to_options", self.handle_back_to_options)
+        router.exact("back_to_message", self.handle_back_to_message)
+        router.exact("back_to_chats", self.handle_back_to_chats)
+
+        # Export handlers
+        router.prefix("export_chat:", self.handle_export_chat)
+        router.prefix("export_format:", self._detached(self.handle_export_format))
+
+        # Regeneration and language handlers
+        router.prefix("regenerate:", self._detached(self.handle_regeneration))
+        router.prefix("change_lang:", self.handle_change_lang)
+        router.prefix("select_lang:", self.handle_select_lang)
 
-                elif data.startswith("export_chat:"):
-                    await self.handle_export_chat(callback_query)
-
-                elif data.startswith("export_format:"):
-                    await self.handle_export_format(callback_query)
-
-                # Regeneration handler
-                elif data.startswith("regenerate:"):
-                    await self.handle_regeneration(callback_query)
-                elif data.startswith("change_lang:"):
-                    await self.handle_change_lang(callback_query)
-                elif data.startswith("select_lang:"):
-                    await self.handle_select_lang(callback_query)
+    async def handle_callback(self, callback_query: CallbackQuery):
+        """Main callback query handler"""
+        try:
+            data = callback_query.data
+            logger.debug(f"Received callback data: {data} from user {callback_query.from_user.id}")
 
-                else:
-                    logger.warning(f"Unhandled callback data: {data}")
-                    await callback_query.answer("Unknown callback")
+            if not await self.callback_router.dispatch(callback_query):
+                logger.warning(f"Unhandled callback data: {data}")
+                await callback_query.answer("Unknown callback")
 
-            except Exception as e:
-                logger.error(f"Error in callback handler: {str(e)}", exc_info=True)
-                await callback_query.answer(
-                    "❌ An error occurred. Please try again.",
-                    show_alert=True
-                )
+        except Exception as e:
+            logger.error(f"Error in callback handler: {str(e)}", exc_info=True)
+            await callback_query.answer(
+                "❌ An error occurred. Please try again.",
+                show_alert=True
+            )
 
     async def handle_settings_help(self, callback_query: CallbackQuery):
         """Handle settings help button"""
@@ -856,15 +932,47 @@ class AIBot:
             reply_markup=self.keyboard_manager.get_chat_management_keyboard(chat_id)
         )
 
+    def get_chat_list_page(self, user_id: int, older_than: Optional[int] = None,
+                           newer_than: Optional[int] = None):
+        """Get one page of the user's chats and its keyboard"""
+        chats, has_newer, has_older = self.db.get_user_chats_page(
+            user_id, CHAT_LIST_PAGE_SIZE, older_than=older_than, newer_than=newer_than
+        )
+        return chats, self.keyboard_manager.get_chat_list_keyboard(chats, has_newer, has_older)
+
+    async def handle_chat_page(self, callback_query: CallbackQuery):
+        """Handle chat list page navigation"""
+        _, direction, cursor = callback_query.data.split(":")
+        user_id = callback_query.from_user.id
+
+        if direction == "older":
+            chats, keyboard = self.get_chat_list_page(user_id, older_than=int(cursor))
+        else:
+            chats, keyboard = self.get_chat_list_page(user_id, newer_than=int(cursor))
+        if not chats:
+            # The chats on that page were deleted meanwhile
+            chats, keyboard = self.get_chat_list_page(user_id)
+
+        if chats:
+            await callback_query.message.edit_text(
+                "Select a chat to continue:",
+                reply_markup=keyboard
+            )
+        else:
+            await callback_query.message.edit_text(
+                "You don't have any chats yet.",
+                reply_markup=self.keyboard_manager.get_chat_options_keyboard()
+            )
+
     async def handle_back_to_chats(self, callback_query: CallbackQuery):
         """Handle back to chats button"""
         user_id = callback_query.from_user.id
-        chats = self.db.get_user_chats(user_id)
+        chats, keyboard = self.get_chat_list_page(user_id)
         
         if chats:
             await callback_query.message.edit_text(
                 "Select a chat to continue:",
-                reply_markup=self.keyboard_manager.get_chat_list_keyboard(chats)
+                reply_markup=keyboard
             )
         else:
             await callback_query.message.edit_text(
@@ -942,7 +1050,7 @@ class AIBot:
         
         
         elif data == "select_chat":
-            chats = self.db.get_user_chats(user_id)
+            chats, keyboard = self.get_chat_list_page(user_id)
             if not chats:
                 await callback_query.answer(
                     "You don't have any previous chats. Start a new one!",
@@ -952,7 +1060,7 @@ class AIBot:
                      
             await callback_query.message.edit_text(
                 "Select a chat to continue:",
-                reply_markup=self.keyboard_manager.get_chat_list_keyboard(chats)
+                reply_markup=keyboard
             )
 
     async def handle_change_lang(self, callback_query: CallbackQuery):
@@ -1057,10 +1165,10 @@ class AIBot:
             del self.rename_states[user_id]
             
             # Show updated chat list
-            chats = self.db.get_user_chats(user_id)
+            chats, keyboard = self.get_chat_list_page(user_id)
             await message.reply_text(
                 "✅ Chat renamed successfully!",
-                reply_markup=self.keyboard_manager.get_chat_list_keyboard(chats)
+                reply_markup=keyboard
             )
         else:
             await message.reply_text(
@@ -1088,11 +1196,11 @@ class AIBot:
                 self.active_chats.pop(user_id)
             
             # Show updated chat list
-            chats = self.db.get_user_chats(user_id)
+            chats, keyboard = self.get_chat_list_page(user_id)
             if chats:
                 await callback_query.message.edit_text(
                     "Chat deleted successfully!",
-                    reply_markup=self.keyboard_manager.get_chat_list_keyboard(chats)
+                    reply_markup=keyboard
                 )
             else:
                 await callback_query.message.edit_text(
@@ -1144,7 +1252,7 @@ class AIBot:
     async def handle_back_to_options(self, callback_query: CallbackQuery):
         """Handle back to options button"""
         message = callback_query.message
-        message_id = str(message.id)
+        message_id = self.message_handler.message_key(message)
         
         try:
             # If this is a multi-message response
@@ -1205,25 +1313,21 @@ class AIBot:
                 })
 
             # Process with model
-            response_text = ""
-            async for chunk in self.model_manager.process_content(
+            response_text, stopped, failed = await self._stream_answer(
+                user_id,
+                status_message,
+                self.keyboard_manager.get_message_actions_keyboard(status_message.id),
                 model_name=model,
                 model_version=version,
                 content=message.text,
                 content_type="text",
                 chat_history=formatted_history,  # Add chat history
                 **params
-            ):
-                response_text += chunk
-                try:
-                    await status_message.edit_text(
-                        response_text,
-                        reply_markup=self.keyboard_manager.get_message_actions_keyboard(
-                            status_message.id
-                        )
-                    )
-                except MessageNotModified:
-                    continue
+            )
+
+            if not response_text:
+                # Failed, refused, or stopped before any output; there is no exchange to keep
+                return
 
             # Save messages to database
             self.db.add_message(
@@ -1247,45 +1351,9 @@ class AIBot:
             if chat_info:
                lang_code = chat_info.get('lang_code', 'en-US')
 
-            # Check message length before sending
-            if len(response_text) > self.message_handler.max_message_length:
-                chunks = self.message_handler.split_message(response_text)
-
-                #Send message in chunks
-                sent_messages = []
-                #Edit first message
-                await status_message.edit_text(
-                    chunks[0],
-                    reply_markup=None
-                )
-                sent_messages.append(status_message)
-
-                # Send remaining chunks
-                for chunk in chunks[1:]:
-                    sent_msg = await message.reply_text(chunk)
-                    sent_messages.append(sent_msg)
-
-                # Add markup to last message
-                try:
-                    await sent_messages[-1].edit_reply_markup(
-                        self.keyboard_manager.get_message_actions_keyboard(
-                            status_message.id
-                        )
-                    )
-                except Exception as e:
-                    logger.error(f"Error adding reply markup: {str(e)}")
-                    
-                self.message_handler.sent_chunks[str(status_message.id)] = sent_messages
-            else:
-                await self.message_handler.edit_message_safely(
-                    status_message,
-                    response_text,
-                    reply_markup=self.keyboard_manager.get_message_actions_keyboard(
-                        status_message.id
-                    )
-                )
             # Send voice message
-            await self._send_voice_message(status_message, response_text, lang_code)
+            if not stopped:
+                await self._send_voice_message(status_message, response_text, lang_code)
 
         except Exception as e:
             logger.error(f"Error processing text message: {str(e)}")
@@ -1297,8 +1365,86 @@ class AIBot:
             await status_message.edit_text(f"❌ Error: {error_message}")
     
 
+    async def _stream_answer(
+        self,
+        user_id: int,
+        target: Message,
+        reply_markup: InlineKeyboardMarkup,
+        display_type: str = "text",
+        **request
+    ) -> Tuple[str, bool, bool]:
+        """Stream a model answer into `target`; returns (answer text, stopped, failed)
+
+        Starting a generation stops the user's previous one, and /cancel stops it too.
+        A stopped answer keeps the text received so far. Errors are shown in `target`
+        but never returned as answer text: a failed or refused request returns an
+        empty answer. While all generation slots are busy, `target` shows the
+        user's place in the queue.
+        """
+        async def show_position(position: int):
+            await self._show_queue_position(target, position)
+
+        chosen_version = request.get("model_version")
+        self.degradation.adjust_request(request)
+        downgraded = request.get("model_version") != chosen_version
+
+        failed = False
+        with self.generations.track(user_id) as cancel_token:
+            try:
+                async with self.message_handler.stream_to(
+                    target,
+                    reply_markup=reply_markup,
+                    content_type=display_type
+                ) as presenter:
+                    # The slot is released before the presenter flushes the final text
+                    async with self.admission.admit(
+                        user_id,
+                        request.get("content_type", "text"),
+                        on_position=show_position,
+                        cancel_token=cancel_token
+                    ) as admitted:
+                        if admitted:
+                            async for event in self.model_manager.process_content(
+                                cancel_token=cancel_token, **request
+                            ):
+                                if event.is_delta:
+                                    presenter.push(event.text)
+                                elif event.is_error:
+                                    failed = True
+                                    presenter.push(f"\n\n{event.text}" if presenter.text else event.text)
+                    response_text = "" if failed else presenter.text
+                    if downgraded and response_text:
+                        # Shown only; the saved answer stays the model's own text
+                        presenter.push(
+                            f"\n\n⚡ Answered by {request['model_version']} instead of "
+                            f"{chosen_version} while the bot is under heavy load."
+                        )
+                    if cancel_token.cancelled:
+                        presenter.push("\n\n⏹️ Stopped" if presenter.text else "⏹️ Stopped")
+            except AdmissionRejected as e:
+                logger.warning(f"Refusing generation for user {user_id}: {str(e)}")
+                await self.message_handler.edit_message_safely(
+                    target, "⚠️ The bot is very busy right now. Please try again in a minute."
+                )
+                return "", False, True
+        return response_text, cancel_token.cancelled, failed
+
+    async def _download(self, message: Message, file_path: str):
+        """Download a message's attachment once a download slot is free"""
+        async with self.download_slots:
+            await message.download(file_name=file_path)
+
+    async def _show_queue_position(self, message: Message, position: int):
+        """Show a queued request's place in its lane"""
+        await self.message_handler.edit_message_safely(
+            message, f"⏳ Waiting for a free slot... You are number {position} in the queue."
+        )
+
     async def _send_voice_message(self, message: Message, text: str, lang_code: str, delete_previous:bool = False):
         """Convert text to speech and send it as voice message"""
+        if self.degradation.skip_voice:
+            logger.info("Skipping voice message while degraded")
+            return
         try:
             status_message = await message.reply_text("🎤 Generating voice message...", reply_to_message_id=message.id)
             
@@ -1382,7 +1528,7 @@ class AIBot:
                     "temp",
                     f"{user_id}_{message.id}_photo.jpg"
                 )
-                await message.download(file_name=photo_path)
+                await self._download(message, photo_path)
 
                 # Store file path for regeneration
                 self.temp_files[str(message.id)] = {
@@ -1400,10 +1546,10 @@ class AIBot:
                         "content_type": msg.get("content_type", "text")
                     })
 
-                response_text = ""
-                buffer = ""
-
-                async for chunk in self.model_manager.process_content(
+                response_text, stopped, failed = await self._stream_answer(
+                    user_id,
+                    status_message,
+                    self.keyboard_manager.get_message_actions_keyboard(status_message.id),
                     model_name=model,
                     model_version=version,
                     content=message.caption or "Analyze this image",
@@ -1411,31 +1557,11 @@ class AIBot:
                     file_path=photo_path,
                     chat_history=formatted_history,
                     **params
-                ):
-                    response_text += chunk
-                    buffer += chunk
-
-                    # Update message periodically to avoid flood limits
-                    if len(buffer) >= 100:
-                        await self.message_handler.edit_message_safely(
-                            status_message,
-                            response_text,
-                            reply_markup=self.keyboard_manager.get_message_actions_keyboard(
-                                status_message.id
-                            )
-                        )
-                        buffer = ""
-                        await asyncio.sleep(0.1)
-
-                # Final update
-                if response_text:
-                    await self.message_handler.edit_message_safely(
-                        status_message,
-                        response_text,
-                        reply_markup=self.keyboard_manager.get_message_actions_keyboard(
-                            status_message.id
-                        )
-                    )
+                )
+
+                if not response_text:
+                    # Failed, refused, or stopped before any output; there is no exchange to keep
+                    return
 
                 # Save to database
                 self.db.add_message(
@@ -1462,7 +1588,8 @@ class AIBot:
                     lang_code = chat_info.get('lang_code', 'en-US')
 
                  # Send voice message
-                await self._send_voice_message(status_message, response_text, lang_code)
+                if not stopped:
+                    await self._send_voice_message(status_message, response_text, lang_code)
 
             except Exception as e:
                 logger.error(f"Error processing photo: {str(e)}")
@@ -1499,7 +1626,7 @@ class AIBot:
                     "temp",
                     f"{user_id}_{message.id}_video.mp4"
                 )
-                await message.download(file_name=video_path)
+                await self._download(message, video_path)
 
                 # Store file path for regeneration
                 self.temp_files[str(message.id)] = {
@@ -1517,10 +1644,10 @@ class AIBot:
                         "content_type": msg.get("content_type", "text")
                     })
 
-                response_text = ""
-                buffer = ""
-
-                async for chunk in self.model_manager.process_content(
+                response_text, stopped, failed = await self._stream_answer(
+                    user_id,
+                    status_message,
+                    self.keyboard_manager.get_message_actions_keyboard(status_message.id),
                     model_name=model,
                     model_version=version,
                     content=message.caption or "Analyze this video",
@@ -1528,30 +1655,11 @@ class AIBot:
                     file_path=video_path,
                     chat_history=formatted_history,
                     **params
-                ):
-                    response_text += chunk
-                    buffer += chunk
-
-                    if len(buffer) >= 100:
-                        await self.message_handler.edit_message_safely(
-                            status_message,
-                            response_text,
-                            reply_markup=self.keyboard_manager.get_message_actions_keyboard(
-                                status_message.id
-                            )
-                        )
-                        buffer = ""
-                        await asyncio.sleep(0.1)
-
-                # Final update
-                if response_text:
-                    await self.message_handler.edit_message_safely(
-                        status_message,
-                        response_text,
-                        reply_markup=self.keyboard_manager.get_message_actions_keyboard(
-                            status_message.id
-                        )
-                    )
+                )
+
+                if not response_text:
+                    # Failed, refused, or stopped before any output; there is no exchange to keep
+                    return
 
                 # Save to database
                 self.db.add_message(
@@ -1577,7 +1685,8 @@ class AIBot:
                     lang_code = chat_info.get('lang_code', 'en-US')
 
                  # Send voice message
-                await self._send_voice_message(status_message, response_text, lang_code)
+                if not stopped:
+                    await self._send_voice_message(status_message, response_text, lang_code)
             except Exception as e:
                 logger.error(f"Error processing video: {str(e)}")
                 await status_message.edit_text(
@@ -1614,7 +1723,7 @@ class AIBot:
                     "temp",
                     f"{user_id}_{message.id}_audio{file_ext}"
                 )
-                await message.download(file_name=audio_path)
+                await self._download(message, audio_path)
 
                 # Store file path for regeneration
                 self.temp_files[str(message.id)] = {
@@ -1632,10 +1741,10 @@ class AIBot:
                         "content_type": msg.get("content_type", "text")
                     })
 
-                response_text = ""
-                buffer = ""
-
-                async for chunk in self.model_manager.process_content(
+                response_text, stopped, failed = await self._stream_answer(
+                    user_id,
+                    status_message,
+                    self.keyboard_manager.get_message_actions_keyboard(status_message.id),
                     model_name=model,
                     model_version=version,
                     content=message.caption or "Analyze this audio",
@@ -1643,30 +1752,11 @@ class AIBot:
                     file_path=audio_path,
                     chat_history=formatted_history,
                     **params
-                ):
-                    response_text += chunk
-                    buffer += chunk
-
-                    if len(buffer) >= 100:
-                        await self.message_handler.edit_message_safely(
-                            status_message,
-                            response_text,
-                            reply_markup=self.keyboard_manager.get_message_actions_keyboard(
-                                status_message.id
-                            )
-                        )
-                        buffer = ""
-                        await asyncio.sleep(0.1)
-
-                # Final update
-                if response_text:
-                    await self.message_handler.edit_message_safely(
-                        status_message,
-                        response_text,
-                        reply_markup=self.keyboard_manager.get_message_actions_keyboard(
-                            status_message.id
-                        )
-                    )
+                )
+
+                if not response_text:
+                    # Failed, refused, or stopped before any output; there is no exchange to keep
+                    return
 
                 # Save to database
                 self.db.add_message(
@@ -1692,7 +1782,8 @@ class AIBot:
                    lang_code = chat_info.get('lang_code', 'en-US')
 
                  # Send voice message
-                await self._send_voice_message(status_message, response_text, lang_code)
+                if not stopped:
+                    await self._send_voice_message(status_message, response_text, lang_code)
 
             except Exception as e:
                 logger.error(f"Error processing audio: {str(e)}")
@@ -1730,7 +1821,7 @@ class AIBot:
                 "temp",
                 f"{user_id}_{message.id}_{message.document.file_name}"
             )
-            await message.download(file_name=doc_path)
+            await self._download(message, doc_path)
 
             # Store file path for regeneration
             self.temp_files[str(message.id)] = {
@@ -1748,10 +1839,10 @@ class AIBot:
                     "content_type": msg.get("content_type", "text")
                 })
 
-            response_text = ""
-            buffer = ""
-
-            async for chunk in self.model_manager.process_content(
+            response_text, stopped, failed = await self._stream_answer(
+                user_id,
+                status_message,
+                self.keyboard_manager.get_message_actions_keyboard(status_message.id),
                 model_name=model,
                 model_version=version,
                 content=message.caption or f"Analyze this document: {message.document.file_name}",
@@ -1759,31 +1850,11 @@ class AIBot:
                 file_path=doc_path,
                 chat_history=formatted_history,
                 **params
-            ):
-                response_text += chunk
-                buffer += chunk
-
-                # Update message periodically to avoid flood limits
-                if len(buffer) >= 100:
-                    await self.message_handler.edit_message_safely(
-                        status_message,
-                        response_text,
-                        reply_markup=self.keyboard_manager.get_message_actions_keyboard(
-                            status_message.id
-                        )
-                    )
-                    buffer = ""
-                    await asyncio.sleep(0.1)
+            )
 
-            # Final update
-            if response_text:
-                await self.message_handler.edit_message_safely(
-                    status_message,
-                    response_text,
-                    reply_markup=self.keyboard_manager.get_message_actions_keyboard(
-                        status_message.id
-                    )
-                )
+            if not response_text:
+                # Failed, refused, or stopped before any output; there is no exchange to keep
+                return
 
             # Save to database
             self.db.add_message(
@@ -1809,7 +1880,8 @@ class AIBot:
                 lang_code = chat_info.get('lang_code', 'en-US')
 
              # Send voice message
-            await self._send_voice_message(status_message, response_text, lang_code)
+            if not stopped:
+                await self._send_voice_message(status_message, response_text, lang_code)
 
 
         except Exception as e:
@@ -1903,7 +1975,9 @@ class AIBot:
                     content = f"Analyze this {content_type}"
 
             # Delete any existing chunk messages
-            await self.message_handler.delete_message_chunks(str(message_id))
+            await self.message_handler.delete_message_chunks(
+                self.message_handler.message_key(callback_query.message)
+            )
 
             # Process with model
             await callback_query.message.edit_text(
@@ -1920,44 +1994,22 @@ class AIBot:
                         "content_type": msg.get("content_type", "text")
                     })
 
-            response_text = ""
-            buffer = ""
-
-            async for chunk in self.model_manager.process_content(
+            response_text, stopped, failed = await self._stream_answer(
+                user_id,
+                callback_query.message,
+                self.keyboard_manager.get_message_actions_keyboard(callback_query.message.id),
+                display_type=content_type,
                 model_name=model,
                 model_version=version,
                 content=content,
                 content_type=content_type,
                 file_path=file_path,
                 chat_history=chat_history,
+                use_cache=False,  # Regeneration always asks for a fresh sample
                 **params
-            ):
-                response_text += chunk
-                buffer += chunk
-
-                if len(buffer) >= 100:
-                    await self.message_handler.edit_message_safely(
-                        callback_query.message,
-                        response_text,
-                        reply_markup=self.keyboard_manager.get_message_actions_keyboard(
-                            callback_query.message.id
-                        ),
-                        content_type=content_type  # Pass the content type
-                    )
-                    buffer = ""
-                    await asyncio.sleep(0.1)
+            )
 
-            # Final update
             if response_text:
-                await self.message_handler.edit_message_safely(
-                    callback_query.message,
-                    response_text,
-                    reply_markup=self.keyboard_manager.get_message_actions_keyboard(
-                        callback_query.message.id
-                    ),
-                    content_type=content_type  # Pass the content type
-                )
-
                 # Add new message to database
                 self.db.add_message(
                     chat_id=chat_id,
@@ -1974,8 +2026,9 @@ class AIBot:
                   lang_code = chat_info.get('lang_code', 'en-US')
 
                  # Send voice message, and delete previous voice messages if exist
-                await self._send_voice_message(callback_query.message, response_text, lang_code, delete_previous=True)
-            else:
+                if not stopped:
+                    await self._send_voice_message(callback_query.message, response_text, lang_code, delete_previous=True)
+            elif not stopped and not failed:
                 await callback_query.message.edit_text(
                     "❌ Failed to generate response. Please try again.",
                     reply_markup=self.keyboard_manager.get_message_actions_keyboard(
@@ -2205,7 +2258,9 @@ class AIBot:
                 if stored_content:
                     if stored_content.get('chunks', []):
                         logger.info("Restoring multi-part message")
-                        await self.message_handler.restore_messages(str(message.id), message)
+                        await self.message_handler.restore_messages(
+                            self.message_handler.message_key(message), message
+                        )
                     else:
                         logger.info("Restoring single message")
                         await message.edit_text(
@@ -2274,6 +2329,8 @@ class AIBot:
         
         if user_id in self.rename_states:
             del self.rename_states[user_id]
+
+        self.generations.cancel(user_id)
         
         await message.reply_text(
             "❌ Current operation cancelled. You can:\n"
@@ -2333,13 +2390,19 @@ class AIBot:
             chat_info = self.db.get_chat_info(chat_id)
             chat_title = chat_info["title"].replace(" ", "_")
             
-            # Export chat
-            exported_file = await self.export_manager.export_chat(
-                chat_id=chat_id,
-                messages=messages,
-                format_type=format_type,
-                chat_title=chat_title
-            )
+            # Export chat; exports run in their own lane so they never delay answers
+            async def show_position(position: int):
+                await self._show_queue_position(callback_query.message, position)
+
+            async with self.admission.admit(
+                callback_query.from_user.id, "export", on_position=show_position
+            ):
+                exported_file = await self.export_manager.export_chat(
+                    chat_id=chat_id,
+                    messages=messages,
+                    format_type=format_type,
+                    chat_title=chat_title
+                )
             
             # Send file
             with open(exported_file, 'rb') as f:
@@ -2420,6 +2483,21 @@ class AIBot:
             self.cleanup_old_files()
             await asyncio.sleep(1800)  # Run every 30 minutes
 
+    def metrics_report(self) -> Dict[str, Any]:
+        """Snapshot of every metric plus per-key API usage"""
+        report = metrics.snapshot()
+        report["api_keys"] = self.model_manager.get_key_usage()
+        return report
+
+    async def report_metrics(self):
+        """Log the metrics report every METRICS_LOG_INTERVAL seconds"""
+        while True:
+            await asyncio.sleep(METRICS_LOG_INTERVAL)
+            try:
+                logger.info(f"Metrics: {json.dumps(self.metrics_report(), sort_keys=True, default=str)}")
+            except Exception as e:
+                logger.error(f"Error reporting metrics: {str(e)}")
+
 
     def run(self):
         """Run the bot"""
@@ -2427,9 +2505,22 @@ class AIBot:
         try:
             # Start cleanup task
             self.app.loop.create_task(self.periodic_cleanup())
+
+            # Import provider SDKs in the background once the bot is online
+            self.app.loop.create_task(self.model_manager.warm_up())
+
+            # Watch queue depth and loop lag for load shedding
+            self.app.loop.create_task(self.degradation.run())
+
+            # Queue waits, latencies, cache hit ratios, degradation and key usage
+            if METRICS_LOG_INTERVAL:
+                self.app.loop.create_task(self.report_metrics())
             
             # Run the bot
             self.app.run()
         except Exception as e:
             logger.error(f"❌ Error running bot: {str(e)}")
-            raise
\ No newline at end of file
+            raise
+        finally:
+            if self.trace_recorder:
+                self.trace_recorder.close()
\ No newline at end of file
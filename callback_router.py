@@ -0,0 +1,85 @@
+# callback_router.py
+"""Table-driven dispatch of callback queries.
+
+Routes are registered once, either for an exact callback data string or for a
+prefix. Exact routes are found with a dict lookup; prefix routes live in a
+character trie, so matching costs one walk over the callback data no matter how
+many routes exist, and the longest registered prefix wins. Middleware wraps
+every dispatch (e.g. auth or rate limits) and the time spent in each route is
+recorded as a histogram.
+"""
+from typing import Optional, Dict, List, Callable, Awaitable, Any
+import logging
+import time
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+Handler = Callable[[Any], Awaitable[Any]]
+# middleware(callback_query, route, call_next); call_next() runs the rest of the chain
+Middleware = Callable[[Any, "Route", Callable[[], Awaitable[Any]]], Awaitable[Any]]
+
+_END = ""  # Trie key holding the route of the prefix ending at a node
+
+
+class Route:
+    __slots__ = ("name", "handler")
+
+    def __init__(self, name: str, handler: Handler):
+        self.name = name
+        self.handler = handler
+
+
+class CallbackRouter:
+    """Dispatch callback data to handlers by exact match or longest prefix"""
+
+    def __init__(self):
+        self._exact: Dict[str, Route] = {}
+        self._trie: Dict[str, Any] = {}
+        self.middleware: List[Middleware] = []
+
+    def exact(self, data: str, handler: Handler, name: Optional[str] = None) -> None:
+        self._exact[data] = Route(name or data, handler)
+
+    def prefix(self, prefix: str, handler: Handler, name: Optional[str] = None) -> None:
+        node = self._trie
+        for char in prefix:
+            node = node.setdefault(char, {})
+        node[_END] = Route(name or prefix, handler)
+
+    def use(self, middleware: Middleware) -> None:
+        """Run `middleware` around every dispatched route, in registration order"""
+        self.middleware.append(middleware)
+
+    def match(self, data: str) -> Optional[Route]:
+        route = self._exact.get(data)
+        if route is not None:
+            return route
+        node = self._trie
+        for char in data:
+            node = node.get(char)
+            if node is None:
+                break
+            route = node.get(_END, route)
+        return route
+
+    async def dispatch(self, callback_query) -> bool:
+        """Run the matching route; returns False when no route matches"""
+        route = self.match(callback_query.data or "")
+        if route is None:
+            return False
+
+        start = time.perf_counter()
+        try:
+            await self._call(0, callback_query, route)
+        finally:
+            metrics.observe("callback_latency_seconds", time.perf_counter() - start, route=route.name)
+        return True
+
+    async def _call(self, index: int, callback_query, route: Route):
+        if index == len(self.middleware):
+            return await route.handler(callback_query)
+        return await self.middleware[index](
+            callback_query, route, lambda: self._call(index + 1, callback_query, route)
+        )
@@ -0,0 +1,90 @@
+# circuit_breaker.py
+from typing import Dict, Optional
+import logging
+import time
+
+from config import CIRCUIT_BREAKER
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker with a half-open probe phase"""
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = 5,
+        recovery_timeout: float = 30.0,
+        half_open_max_calls: int = 1
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._half_open_calls = 0
+
+    def _set_state(self, state: str) -> None:
+        if state != self.state:
+            logger.warning(f"Circuit {self.name}: {self.state} -> {state}")
+            metrics.inc("circuit_transitions_total", breaker=self.name, state=state)
+        self.state = state
+        metrics.set_gauge("circuit_state", _STATE_VALUES[state], breaker=self.name)
+
+    def allow(self) -> bool:
+        """Return True if a call may be sent; reserves a probe slot when half-open"""
+        if self.state == OPEN:
+            if time.monotonic() - self.opened_at < self.recovery_timeout:
+                return False
+            self._set_state(HALF_OPEN)
+            self._half_open_calls = 0
+        if self.state == HALF_OPEN:
+            if self._half_open_calls >= self.half_open_max_calls:
+                return False
+            self._half_open_calls += 1
+        return True
+
+    @property
+    def is_open(self) -> bool:
+        return self.state == OPEN and time.monotonic() - self.opened_at < self.recovery_timeout
+
+    def record_success(self) -> None:
+        self.failures = 0
+        if self.state == HALF_OPEN:
+            self._half_open_calls = max(0, self._half_open_calls - 1)
+        self._set_state(CLOSED)
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            self._half_open_calls = 0
+            self.opened_at = time.monotonic()
+            self._set_state(OPEN)
+
+    def record_cancelled(self) -> None:
+        """Release a probe slot for a call abandoned before it completed"""
+        if self.state == HALF_OPEN:
+            self._half_open_calls = max(0, self._half_open_calls - 1)
+
+
+class CircuitBreakerRegistry:
+    """Lazily created breakers, one per provider/version pair"""
+
+    def __init__(self, settings: Optional[Dict] = None):
+        self.settings = settings if settings is not None else CIRCUIT_BREAKER
+        self._breakers: Dict[str, CircuitBreaker] = {}
+
+    def get(self, provider: str, model_version: str) -> CircuitBreaker:
+        name = f"{provider}:{model_version}"
+        if name not in self._breakers:
+            self._breakers[name] = CircuitBreaker(name, **self.settings)
+        return self._breakers[name]
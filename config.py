@@ -14,6 +14,35 @@ GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 CLAUDE_API_KEY = os.getenv("CLAUDE_API_KEY")
 DEEPSEEK_API_KEY = os.getenv("DEEPSEEK_API_KEY")
 
+
+def _parse_key_pool(pool_var: str, single_key: str) -> list:
+    """Read a comma-separated key pool, falling back to the single key"""
+    keys = [key.strip() for key in os.getenv(pool_var, "").split(",") if key.strip()]
+    if single_key and single_key not in keys:
+        keys.insert(0, single_key)
+    return keys
+
+# AI Model API Key Pools (comma-separated, e.g. GEMINI_API_KEYS=key1,key2)
+GEMINI_API_KEYS = _parse_key_pool("GEMINI_API_KEYS", GEMINI_API_KEY)
+CLAUDE_API_KEYS = _parse_key_pool("CLAUDE_API_KEYS", CLAUDE_API_KEY)
+DEEPSEEK_API_KEYS = _parse_key_pool("DEEPSEEK_API_KEYS", DEEPSEEK_API_KEY)
+
+# Key selection: "least_loaded" or "remaining_quota"
+# rate_limit_cooldown applies to 429s without a Retry-After header
+API_KEY_POOL = {
+    "strategy": os.getenv("API_KEY_STRATEGY", "least_loaded"),
+    "rate_limit_cooldown": float(os.getenv("API_KEY_RATE_LIMIT_COOLDOWN", 5)),
+    "quota_cooldown": float(os.getenv("API_KEY_QUOTA_COOLDOWN", 60)),
+    "auth_cooldown": float(os.getenv("API_KEY_AUTH_COOLDOWN", 3600))
+}
+
+# Provider base URL overrides, e.g. to point every handler at mock_provider.py
+PROVIDER_BASE_URLS = {
+    "gemini": os.getenv("GEMINI_BASE_URL"),
+    "claude": os.getenv("CLAUDE_BASE_URL"),
+    "deepseek": os.getenv("DEEPSEEK_BASE_URL", "https://api.deepseek.com/v1")
+}
+
 # Gemini TTS Cookies
 GEMINI_TTS_SID = os.getenv("GEMINI_TTS_SID")
 GEMINI_TTS_PSID = os.getenv("GEMINI_TTS_PSID")
@@ -130,6 +159,218 @@ DEFAULT_PARAMS = {
     "max_tokens": 2048
 }
 
+# Provider Throughput Limits
+# Requests beyond these limits wait in a local queue instead of failing upstream;
+# text_reserved slots of max_concurrency are only used by text requests
+PROVIDER_LIMITS = {
+    "gemini": {
+        "max_concurrency": int(os.getenv("GEMINI_MAX_CONCURRENCY", 8)),
+        "text_reserved": int(os.getenv("GEMINI_TEXT_RESERVED", 3)),
+        "model_concurrency": {
+            "gemini-1.5-pro-002": 2
+        },
+        "requests_per_minute": int(os.getenv("GEMINI_RPM", 60)),
+        "tokens_per_minute": int(os.getenv("GEMINI_TPM", 1000000))
+    },
+    "claude": {
+        "max_concurrency": int(os.getenv("CLAUDE_MAX_CONCURRENCY", 4)),
+        "text_reserved": int(os.getenv("CLAUDE_TEXT_RESERVED", 1)),
+        "model_concurrency": {},
+        "requests_per_minute": int(os.getenv("CLAUDE_RPM", 50)),
+        "tokens_per_minute": int(os.getenv("CLAUDE_TPM", 40000))
+    },
+    "deepseek": {
+        "max_concurrency": int(os.getenv("DEEPSEEK_MAX_CONCURRENCY", 4)),
+        "model_concurrency": {},
+        "requests_per_minute": int(os.getenv("DEEPSEEK_RPM", 60)),
+        "tokens_per_minute": int(os.getenv("DEEPSEEK_TPM", 100000))
+    }
+}
+
+# Circuit Breaker Settings (applied per provider/version)
+CIRCUIT_BREAKER = {
+    "failure_threshold": int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", 5)),
+    "recovery_timeout": float(os.getenv("CIRCUIT_RECOVERY_TIMEOUT", 30)),
+    "half_open_max_calls": 1
+}
+
+# Retry Policy (shared by all providers)
+# retryable_errors lists lowercase fragments of transient errors per provider
+RETRY_POLICY = {
+    "max_attempts": int(os.getenv("RETRY_MAX_ATTEMPTS", 3)),
+    "base_delay": float(os.getenv("RETRY_BASE_DELAY", 1.0)),
+    "max_delay": float(os.getenv("RETRY_MAX_DELAY", 20.0)),
+    "deadline_seconds": float(os.getenv("RETRY_DEADLINE", 60.0)),
+    "retryable_errors": {
+        "gemini": (
+            "429", "500", "503", "504", "overloaded", "resource exhausted",
+            "resource_exhausted", "unavailable", "deadline exceeded", "internal error"
+        ),
+        "claude": (
+            "429", "500", "502", "503", "504", "529", "overloaded",
+            "rate limit", "timeout", "timed out", "connection"
+        ),
+        "deepseek": (
+            "429", "500", "502", "503", "504", "overloaded", "server busy",
+            "rate limit", "timeout", "timed out", "connection"
+        ),
+        "default": ("429", "500", "502", "503", "504", "overloaded", "timeout", "connection")
+    }
+}
+
+# Exact-match Response Cache
+RESPONSE_CACHE = {
+    "enabled": os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() == "true",
+    "max_entries": int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", 1000)),
+    "ttl_seconds": float(os.getenv("RESPONSE_CACHE_TTL", 600))
+}
+
+# Share one upstream call between concurrent identical requests
+REQUEST_COALESCING_ENABLED = os.getenv("REQUEST_COALESCING_ENABLED", "true").lower() == "true"
+
+# Semantic Answer Cache (optional, requires numpy)
+# Reuses answers to near-duplicate first-turn text prompts for the same model version
+SEMANTIC_CACHE = {
+    "enabled": os.getenv("SEMANTIC_CACHE_ENABLED", "false").lower() == "true",
+    "threshold": float(os.getenv("SEMANTIC_CACHE_THRESHOLD", 0.92)),
+    "max_entries": int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", 2000)),
+    "n_features": int(os.getenv("SEMANTIC_CACHE_FEATURES", 2048)),
+    "max_prompt_chars": int(os.getenv("SEMANTIC_CACHE_MAX_PROMPT", 500))
+}
+
+# Failover Policy (opt-in)
+# fallbacks map a model version to the (provider, version) used when it is unhealthy;
+# hedge_after_seconds starts a duplicate request on the fallback if no token arrives in time
+FAILOVER_POLICY = {
+    "enabled": os.getenv("FAILOVER_ENABLED", "false").lower() == "true",
+    "fallbacks": {
+        "gemini-1.5-pro-002": ("gemini", "gemini-1.5-flash-002"),
+        "gemini-2.0-flash-exp": ("gemini", "gemini-1.5-flash-002"),
+        "claude-3.5-sonnet": ("claude", "claude-3.5-haiku")
+    },
+    "hedge_after_seconds": float(os.getenv("FAILOVER_HEDGE_AFTER", 0)) or None
+}
+
+# Local mock provider used for load tests (see mock_provider.py)
+# Fault rates are probabilities per request; stalls pause a stream mid-way
+MOCK_PROVIDER = {
+    "host": os.getenv("MOCK_PROVIDER_HOST", "127.0.0.1"),
+    "port": int(os.getenv("MOCK_PROVIDER_PORT", 8089)),
+    "ttft_seconds": float(os.getenv("MOCK_PROVIDER_TTFT", 0.5)),
+    "tokens_per_second": float(os.getenv("MOCK_PROVIDER_TOKEN_RATE", 40)),
+    "response_tokens": int(os.getenv("MOCK_PROVIDER_RESPONSE_TOKENS", 300)),
+    "chunk_tokens": int(os.getenv("MOCK_PROVIDER_CHUNK_TOKENS", 4)),
+    "rate_limit_rate": float(os.getenv("MOCK_PROVIDER_429_RATE", 0)),
+    "overload_rate": float(os.getenv("MOCK_PROVIDER_503_RATE", 0)),
+    "retry_after": float(os.getenv("MOCK_PROVIDER_RETRY_AFTER", 1)),
+    "stall_rate": float(os.getenv("MOCK_PROVIDER_STALL_RATE", 0)),
+    "stall_seconds": float(os.getenv("MOCK_PROVIDER_STALL_SECONDS", 10)),
+    "seed": os.getenv("MOCK_PROVIDER_SEED")
+}
+
+# Opt-in recording of anonymized update traces for load_test.py --replay
+UPDATE_TRACE = {
+    "enabled": os.getenv("UPDATE_TRACE_ENABLED", "false").lower() == "true",
+    "path": os.getenv("UPDATE_TRACE_PATH", "traces/updates.jsonl.gz"),
+    "max_events": int(os.getenv("UPDATE_TRACE_MAX_EVENTS", 1000000))
+}
+
+# Pacing of streamed message edits per chat
+# The interval grows by `backoff` on FloodWait and shrinks by `recovery` after each successful edit
+STREAMING_EDITS = {
+    "min_interval": float(os.getenv("STREAM_EDIT_MIN_INTERVAL", 1.0)),
+    "max_interval": float(os.getenv("STREAM_EDIT_MAX_INTERVAL", 10.0)),
+    "backoff": float(os.getenv("STREAM_EDIT_BACKOFF", 2.0)),
+    "recovery": float(os.getenv("STREAM_EDIT_RECOVERY", 0.9))
+}
+
+# Outbound Telegram request budgets (see outbound_scheduler.py)
+# The per-chat rate sits above the streaming edit pace so replies aren't stuck behind edits
+# FloodWaits longer than max_flood_wait are passed on to the caller instead of retried
+OUTBOUND_SCHEDULER = {
+    "global_per_second": float(os.getenv("OUTBOUND_GLOBAL_PER_SECOND", 30)),
+    "global_burst": float(os.getenv("OUTBOUND_GLOBAL_BURST", 30)),
+    "chat_per_second": float(os.getenv("OUTBOUND_CHAT_PER_SECOND", 1.5)),
+    "chat_burst": float(os.getenv("OUTBOUND_CHAT_BURST", 5)),
+    "max_flood_wait": float(os.getenv("OUTBOUND_MAX_FLOOD_WAIT", 60))
+}
+
+# Per-user rate limits, checked before an update is handled
+# capacity is the allowed burst, per_minute the sustained rate; kinds are message, media and callback
+USER_RATE_LIMITS = {
+    "enabled": os.getenv("USER_RATE_LIMITS_ENABLED", "true").lower() == "true",
+    "limits": {
+        "message": {
+            "capacity": float(os.getenv("USER_MESSAGE_BURST", 10)),
+            "per_minute": float(os.getenv("USER_MESSAGES_PER_MINUTE", 20))
+        },
+        "media": {
+            "capacity": float(os.getenv("USER_MEDIA_BURST", 3)),
+            "per_minute": float(os.getenv("USER_MEDIA_PER_MINUTE", 5))
+        },
+        "callback": {
+            "capacity": float(os.getenv("USER_CALLBACK_BURST", 20)),
+            "per_minute": float(os.getenv("USER_CALLBACKS_PER_MINUTE", 60))
+        }
+    },
+    "max_users": int(os.getenv("USER_RATE_LIMITS_MAX_USERS", 10000)),
+    # Seconds between two cool-down notices to the same user
+    "notice_interval": float(os.getenv("USER_RATE_LIMIT_NOTICE_INTERVAL", 10))
+}
+
+# Admission control in front of model generations and exports (see admission_control.py)
+# Every lane has its own concurrency limit, so heavy media jobs can't hold up text answers;
+# costs weigh each content type in a user's fair share; requests beyond max_queue are refused
+ADMISSION_CONTROL = {
+    "lanes": {
+        "text": int(os.getenv("ADMISSION_TEXT_CONCURRENT", 16)),
+        "image": int(os.getenv("ADMISSION_IMAGE_CONCURRENT", 4)),
+        "document": int(os.getenv("ADMISSION_DOCUMENT_CONCURRENT", 4)),
+        "media": int(os.getenv("ADMISSION_MEDIA_CONCURRENT", 2)),
+        "export": int(os.getenv("ADMISSION_EXPORT_CONCURRENT", 2))
+    },
+    "lane_of": {
+        "text": "text", "image": "image", "document": "document",
+        "audio": "media", "video": "media", "export": "export"
+    },
+    "max_queue": int(os.getenv("ADMISSION_MAX_QUEUE", 1000)),
+    "position_interval": float(os.getenv("ADMISSION_POSITION_INTERVAL", 1.0)),
+    "costs": {"text": 1.0, "image": 2.0, "document": 2.0, "audio": 4.0, "video": 4.0}
+}
+
+# Attachment downloads running at once; further media messages wait for a slot
+MAX_CONCURRENT_DOWNLOADS = int(os.getenv("MAX_CONCURRENT_DOWNLOADS", 4))
+
+# Seconds between log lines with a snapshot of every metric and per-key API usage; 0 disables them
+METRICS_LOG_INTERVAL = float(os.getenv("METRICS_LOG_INTERVAL", 300))
+
+# Load shedding (see load_shedding.py)
+# Under pressure (loop lag or total admission queue depth above the *_high marks) the bot steps
+# through skip_voice, reduce_tokens, fast_model, slow_edits and reject_media, at most one mode per
+# step_up_seconds; it steps back one mode per recover_seconds spent below the *_low marks
+DEGRADATION = {
+    "enabled": os.getenv("DEGRADATION_ENABLED", "true").lower() == "true",
+    "check_interval": float(os.getenv("DEGRADATION_CHECK_INTERVAL", 0.5)),
+    "queue_depth_high": int(os.getenv("DEGRADATION_QUEUE_HIGH", 50)),
+    "queue_depth_low": int(os.getenv("DEGRADATION_QUEUE_LOW", 10)),
+    "loop_lag_high": float(os.getenv("DEGRADATION_LAG_HIGH", 0.25)),
+    "loop_lag_low": float(os.getenv("DEGRADATION_LAG_LOW", 0.05)),
+    "step_up_seconds": float(os.getenv("DEGRADATION_STEP_UP_SECONDS", 5)),
+    "recover_seconds": float(os.getenv("DEGRADATION_RECOVER_SECONDS", 30)),
+    "reduced_max_tokens": int(os.getenv("DEGRADATION_MAX_TOKENS", 1024)),
+    # Cheaper version of the same provider used in fast_model mode
+    "fast_versions": {
+        "gemini-1.5-pro-002": "gemini-1.5-flash-002",
+        "gemini-2.0-flash-exp": "gemini-1.5-flash-002",
+        "claude-3.5-sonnet": "claude-3.5-haiku"
+    },
+    # Multiplier on STREAMING_EDITS min_interval in slow_edits mode
+    "edit_interval_factor": float(os.getenv("DEGRADATION_EDIT_FACTOR", 3.0))
+}
+
+# Chats shown per page of the chat list
+CHAT_LIST_PAGE_SIZE = int(os.getenv("CHAT_LIST_PAGE_SIZE", 8))
+
 # Parameter Configurations
 # Parameter Configurations
 PARAMETER_CONFIG = {
@@ -52,6 +52,14 @@ class DatabaseManager:
             )
             ''')
             self.conn.commit()  # Commit after creating chats table
+
+            # Index for paging through a user's chats, newest first
+            cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_chats_user_created
+            ON chats (user_id, created_at, chat_id)
+            WHERE is_deleted = 0
+            ''')
+            self.conn.commit()
             
             # Create messages table
             cursor.execute('''
@@ -183,6 +191,52 @@ class DatabaseManager:
             })
         return chats
 
+    def get_user_chats_page(self, user_id: int, limit: int, older_than: Optional[int] = None,
+                            newer_than: Optional[int] = None) -> Tuple[List[Dict], bool, bool]:
+        """Get one page of a user's chats, newest first, using the given chat as the keyset cursor
+
+        Returns (chats, has_newer, has_older).
+        """
+        cursor = self.conn.cursor()
+        query = '''SELECT chat_id, title, model, model_version, created_at
+               FROM chats
+               WHERE user_id = ? AND is_deleted = 0'''
+        params: list = [user_id]
+        if newer_than is not None:
+            query += ''' AND (created_at, chat_id) > (SELECT created_at, chat_id FROM chats WHERE chat_id = ?)
+               ORDER BY created_at ASC, chat_id ASC LIMIT ?'''
+            params += [newer_than, limit + 1]
+        else:
+            if older_than is not None:
+                query += ''' AND (created_at, chat_id) < (SELECT created_at, chat_id FROM chats WHERE chat_id = ?)'''
+                params.append(older_than)
+            query += '''
+               ORDER BY created_at DESC, chat_id DESC LIMIT ?'''
+            params.append(limit + 1)
+
+        cursor.execute(query, params)
+        rows = cursor.fetchall()
+        # The extra row only tells whether another page exists in the direction of travel
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if newer_than is not None:
+            rows.reverse()
+            has_newer, has_older = has_more, True
+        else:
+            has_newer, has_older = older_than is not None, has_more
+
+        chats = [
+            {
+                "chat_id": row[0],
+                "title": row[1],
+                "model": row[2],
+                "model_version": row[3],
+                "created_at": row[4]
+            }
+            for row in rows
+        ]
+        return chats, has_newer, has_older
+
     def update_chat_title(self, chat_id: int, new_title: str) -> bool:
         cursor = self.conn.cursor()
         try:
@@ -2,10 +2,6 @@
 import os
 from typing import List, Dict
 from datetime import datetime
-from fpdf import FPDF
-import docx
-from docx.shared import Pt
-import markdown
 import logging
 
 logger = logging.getLogger(__name__)
@@ -66,6 +62,8 @@ class ExportManager:
         """Export chat to PDF with robust space checking"""
         output_path = os.path.join(self.export_dir, f"{filename}.pdf")
         
+        from fpdf import FPDF
+
         try:
             # Initialize PDF with A4 format and margins
             pdf = FPDF(format='A4')
@@ -172,6 +170,9 @@ class ExportManager:
     
     async def _export_to_docx(self, filename: str, messages: List[Dict]) -> str:
         """Export chat to DOCX"""
+        import docx
+        from docx.shared import Pt
+
         output_path = os.path.join(self.export_dir, f"{filename}.docx")
         
         doc = docx.Document()
@@ -0,0 +1,349 @@
+# fake_telegram.py
+"""In-process stand-in for the Pyrogram Client, used by load_test.py"""
+from collections import defaultdict, deque
+from typing import Optional, Dict, List, Tuple, Callable, Any, Deque
+import asyncio
+import inspect
+import itertools
+import logging
+import os
+import time
+
+from pyrogram.enums import ChatType
+from pyrogram.errors import FloodWait, MessageNotModified, MessageTooLong, MessageEmpty
+
+logger = logging.getLogger(__name__)
+
+MESSAGE = "message"
+CALLBACK_QUERY = "callback_query"
+
+# Pyrogram's default number of update workers
+DEFAULT_WORKERS = min(32, (os.cpu_count() or 1) + 4)
+
+
+class FakeUser:
+    def __init__(self, user_id: int, first_name: str = "User", is_bot: bool = False, username: Optional[str] = None):
+        self.id = user_id
+        self.first_name = first_name
+        self.is_bot = is_bot
+        self.username = username
+
+
+class FakeChat:
+    def __init__(self, chat_id: int, chat_type: ChatType = ChatType.PRIVATE):
+        self.id = chat_id
+        self.type = chat_type
+
+
+class FakeMedia:
+    """Attachment metadata; `download` writes `file_size` bytes of filler"""
+
+    def __init__(
+        self,
+        file_size: int,
+        file_name: Optional[str] = None,
+        mime_type: Optional[str] = None,
+        duration: Optional[int] = None
+    ):
+        self.file_id = f"fake-{id(self):x}"
+        self.file_size = file_size
+        self.file_name = file_name
+        self.mime_type = mime_type
+        self.duration = duration
+
+
+class FakeMessage:
+    """Duck-typed pyrogram Message whose methods go through FakeClient"""
+
+    def __init__(
+        self,
+        client: "FakeClient",
+        chat: FakeChat,
+        message_id: int,
+        from_user: FakeUser,
+        text: Optional[str] = None,
+        caption: Optional[str] = None,
+        reply_markup=None,
+        reply_to_message: Optional["FakeMessage"] = None,
+        photo: Optional[FakeMedia] = None,
+        video: Optional[FakeMedia] = None,
+        audio: Optional[FakeMedia] = None,
+        voice: Optional[FakeMedia] = None,
+        document: Optional[FakeMedia] = None
+    ):
+        self._client = client
+        self.id = message_id
+        self.chat = chat
+        self.from_user = from_user
+        self.text = text
+        self.caption = caption
+        self.reply_markup = reply_markup
+        self.reply_to_message = reply_to_message
+        self.photo = photo
+        self.video = video
+        self.audio = audio
+        self.voice = voice
+        self.document = document
+        self.command = None
+
+    @property
+    def media(self) -> Optional[FakeMedia]:
+        return self.photo or self.video or self.audio or self.voice or self.document
+
+    async def reply_text(self, text: str, reply_markup=None, reply_to_message_id: Optional[int] = None, **kwargs):
+        return await self._client.send_message(
+            self.chat.id, text, reply_markup=reply_markup, reply_to_message_id=reply_to_message_id
+        )
+
+    async def edit_text(self, text: str, reply_markup=None, **kwargs):
+        return await self._client.edit_message_text(self.chat.id, self.id, text, reply_markup=reply_markup)
+
+    edit = edit_text
+
+    async def edit_reply_markup(self, reply_markup=None):
+        return await self._client.edit_message_reply_markup(self.chat.id, self.id, reply_markup)
+
+    async def delete(self, revoke: bool = True):
+        return await self._client.delete_messages(self.chat.id, self.id)
+
+    async def reply_voice(self, voice: str, reply_to_message_id: Optional[int] = None, **kwargs):
+        return await self._client.send_voice(self.chat.id, voice)
+
+    async def reply_document(self, document: str, caption: Optional[str] = None, **kwargs):
+        return await self._client.send_document(self.chat.id, document, caption=caption)
+
+    async def download(self, file_name: Optional[str] = None, **kwargs) -> Optional[str]:
+        media = self.media
+        if media is None:
+            raise ValueError("This message doesn't contain any downloadable media")
+        path = file_name or os.path.join("downloads", media.file_name or media.file_id)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(b"\0" * media.file_size)
+        return path
+
+
+class FakeCallbackQuery:
+    def __init__(self, client: "FakeClient", query_id: str, from_user: FakeUser, message: FakeMessage, data: str):
+        self._client = client
+        self.id = query_id
+        self.from_user = from_user
+        self.message = message
+        self.data = data
+        self.chat_instance = str(message.chat.id)
+
+    async def answer(self, text: Optional[str] = None, show_alert: bool = False, **kwargs):
+        self._client._record("answer", self.message.chat.id)
+        return True
+
+
+class FakeClient:
+    """Pyrogram Client replacement that dispatches synthetic updates in-process
+
+    Updates are handled by a pool of workers with Pyrogram's group/filter rules,
+    and every outbound call is recorded. Optional latency and per-chat flood
+    limits approximate the Telegram Bot API.
+    """
+
+    def __init__(
+        self,
+        workers: int = DEFAULT_WORKERS,
+        api_latency: float = 0.0,
+        flood_limit_per_chat: Optional[int] = None,
+        bot_username: str = "ai_bot"
+    ):
+        self.workers = workers
+        self.api_latency = api_latency
+        self.flood_limit_per_chat = flood_limit_per_chat  # Outbound calls per chat per second
+        self.me = FakeUser(0, "AI Bot", is_bot=True, username=bot_username)
+        self.handlers: Dict[int, List[Tuple[str, Callable, Any]]] = defaultdict(list)
+        self.messages: Dict[Tuple[int, int], FakeMessage] = {}
+        self.last_sent: Dict[int, FakeMessage] = {}  # Latest bot message per chat
+        self.counters: Dict[str, int] = defaultdict(int)
+        self.observers: List[Callable[[str, int], None]] = []
+        self._message_ids: Dict[int, itertools.count] = defaultdict(lambda: itertools.count(1))
+        self._recent_calls: Dict[int, Deque[float]] = defaultdict(deque)
+        self._updates: Optional[asyncio.Queue] = None
+        self._worker_tasks: List[asyncio.Task] = []
+        self._query_ids = itertools.count(1)
+
+    # Handler registration, mirroring pyrogram's decorators
+
+    def on_message(self, filters=None, group: int = 0):
+        def decorator(func):
+            self.handlers[group].append((MESSAGE, func, filters))
+            return func
+        return decorator
+
+    def on_callback_query(self, filters=None, group: int = 0):
+        def decorator(func):
+            self.handlers[group].append((CALLBACK_QUERY, func, filters))
+            return func
+        return decorator
+
+    # Lifecycle
+
+    async def start(self) -> None:
+        self._updates = asyncio.Queue()
+        self._worker_tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self) -> None:
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+
+    # Inbound updates
+
+    def new_message(self, user: FakeUser, **fields) -> FakeMessage:
+        """Build an incoming private message from `user`"""
+        chat = FakeChat(user.id)
+        message = FakeMessage(self, chat, next(self._message_ids[chat.id]), user, **fields)
+        self.messages[(chat.id, message.id)] = message
+        return message
+
+    def new_callback_query(self, user: FakeUser, message: FakeMessage, data: str) -> FakeCallbackQuery:
+        return FakeCallbackQuery(self, str(next(self._query_ids)), user, message, data)
+
+    def feed(self, update) -> asyncio.Future:
+        """Queue an update; the returned future resolves once its handler finishes"""
+        done = asyncio.get_running_loop().create_future()
+        self._updates.put_nowait((update, done))
+        self.counters["updates"] += 1
+        return done
+
+    async def _worker(self) -> None:
+        while True:
+            update, done = await self._updates.get()
+            try:
+                await self._dispatch(update)
+            finally:
+                if not done.done():
+                    done.set_result(None)
+
+    async def _dispatch(self, update) -> None:
+        kind = CALLBACK_QUERY if isinstance(update, FakeCallbackQuery) else MESSAGE
+        for group in sorted(self.handlers):
+            for handler_kind, callback, filters in self.handlers[group]:
+                if handler_kind != kind:
+                    continue
+                try:
+                    if filters is not None:
+                        if inspect.iscoroutinefunction(filters.__call__):
+                            matched = await filters(self, update)
+                        else:
+                            matched = filters(self, update)
+                        if not matched:
+                            continue
+                except Exception as e:
+                    logger.error(f"Filter error: {str(e)}")
+                    continue
+                try:
+                    await callback(self, update)
+                except Exception as e:
+                    self.counters["handler_errors"] += 1
+                    logger.error(f"Unhandled error in {callback.__name__}: {str(e)}")
+                break
+
+    # Outbound API
+
+    def _record(self, method: str, chat_id: int) -> None:
+        self.counters[method] += 1
+        for observer in self.observers:
+            observer(method, chat_id)
+
+    async def _call(self, method: str, chat_id: int) -> None:
+        """Apply simulated latency and flood limits to an outbound call"""
+        if self.flood_limit_per_chat:
+            now = time.monotonic()
+            recent = self._recent_calls[chat_id]
+            while recent and now - recent[0] > 1.0:
+                recent.popleft()
+            if len(recent) >= self.flood_limit_per_chat:
+                self.counters["flood_waits"] += 1
+                raise FloodWait(value=1)
+            recent.append(now)
+        if self.api_latency:
+            await asyncio.sleep(self.api_latency)
+
+    def _get_message(self, chat_id: int, message_id: int) -> FakeMessage:
+        message = self.messages.get((chat_id, message_id))
+        if message is None:
+            raise ValueError(f"Message {message_id} not found in chat {chat_id}")
+        return message
+
+    async def send_message(
+        self,
+        chat_id: int,
+        text: str,
+        reply_markup=None,
+        reply_to_message_id: Optional[int] = None,
+        **kwargs
+    ) -> FakeMessage:
+        if not text or not text.strip():
+            raise MessageEmpty()
+        if len(text) > 4096:
+            raise MessageTooLong()
+        await self._call("send_message", chat_id)
+        reply_to = self.messages.get((chat_id, reply_to_message_id)) if reply_to_message_id else None
+        message = FakeMessage(
+            self, FakeChat(chat_id), next(self._message_ids[chat_id]), self.me,
+            text=text, reply_markup=reply_markup, reply_to_message=reply_to
+        )
+        self.messages[(chat_id, message.id)] = message
+        self.last_sent[chat_id] = message
+        self._record("send_message", chat_id)
+        return message
+
+    async def edit_message_text(self, chat_id: int, message_id: int, text: str, reply_markup=None, **kwargs) -> FakeMessage:
+        message = self._get_message(chat_id, message_id)
+        if not text or not text.strip():
+            raise MessageEmpty()
+        if len(text) > 4096:
+            raise MessageTooLong()
+        if text == message.text and reply_markup == message.reply_markup:
+            self.counters["not_modified"] += 1
+            raise MessageNotModified()
+        await self._call("edit_message_text", chat_id)
+        message.text = text
+        message.reply_markup = reply_markup
+        self._record("edit_message_text", chat_id)
+        return message
+
+    async def edit_message_reply_markup(self, chat_id: int, message_id: int, reply_markup=None) -> FakeMessage:
+        message = self._get_message(chat_id, message_id)
+        if reply_markup == message.reply_markup:
+            self.counters["not_modified"] += 1
+            raise MessageNotModified()
+        await self._call("edit_message_reply_markup", chat_id)
+        message.reply_markup = reply_markup
+        self._record("edit_message_reply_markup", chat_id)
+        return message
+
+    async def delete_messages(self, chat_id: int, message_ids) -> int:
+        await self._call("delete_messages", chat_id)
+        ids = message_ids if isinstance(message_ids, (list, tuple)) else [message_ids]
+        for message_id in ids:
+            self.messages.pop((chat_id, message_id), None)
+        self._record("delete_messages", chat_id)
+        return len(ids)
+
+    async def send_voice(self, chat_id: int, voice: str, **kwargs) -> FakeMessage:
+        return await self._send_file(chat_id, "voice", voice)
+
+    async def send_document(self, chat_id: int, document: str, caption: Optional[str] = None, **kwargs) -> FakeMessage:
+        return await self._send_file(chat_id, "document", document, caption)
+
+    async def _send_file(self, chat_id: int, kind: str, path: str, caption: Optional[str] = None) -> FakeMessage:
+        """Record a voice or document upload; the file must exist like with the real API"""
+        if not os.path.exists(path):
+            raise ValueError(f"File not found: {path}")
+        await self._call(f"send_{kind}", chat_id)
+        message = FakeMessage(self, FakeChat(chat_id), next(self._message_ids[chat_id]), self.me, caption=caption)
+        self.messages[(chat_id, message.id)] = message
+        self._record(f"send_{kind}", chat_id)
+        return message
+
+    @property
+    def edits(self) -> int:
+        return self.counters["edit_message_text"] + self.counters["edit_message_reply_markup"]
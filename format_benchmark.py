@@ -0,0 +1,294 @@
+# format_benchmark.py
+"""Throughput benchmarks for MessageHandler formatting, splitting and streaming rendering.
+
+    python format_benchmark.py                   # compare against the stored baseline
+    python format_benchmark.py --update-baseline # record a new baseline
+
+Throughput is normalised by a fixed pure-Python calibration loop so a baseline
+recorded on one machine remains meaningful on another. Calibration samples are
+interleaved with each benchmark's samples and the median ratio is kept, so CPU
+frequency changes and noisy neighbours during a run affect both sides alike. The run fails when a
+benchmark is slower than the baseline by more than the tolerance, or when its
+output no longer matches the recorded digest.
+"""
+from typing import Callable, Dict, List, Tuple, Optional
+import argparse
+import gc
+import hashlib
+import json
+import os
+import platform
+import random
+import re
+import statistics
+import sys
+import time
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "format_benchmark_baseline.json")
+
+_PROSE = (
+    "The handler streams the answer into a single Telegram message and edits it as tokens arrive. "
+    "Long answers are split into several messages once they pass the length limit. "
+    "Formatting has to keep HTML valid after every edit, or Telegram rejects the update. "
+    "Lists, headings and inline code appear in most answers, and code blocks in many of them."
+).split(". ")
+
+_CODE = {
+    "python": [
+        "def merge(a: list, b: list) -> list:",
+        "    result = []",
+        "    while a and b:",
+        "        result.append(a.pop(0) if a[0] < b[0] else b.pop(0))",
+        "    return result + a + b",
+        "",
+        "if __name__ == \"__main__\" and len(sys.argv) > 1:",
+        "    print(merge([1, 4, 9], [2, 3, 10]))  # <-- prints & exits"
+    ],
+    "javascript": [
+        "const debounce = (fn, ms) => {",
+        "  let t;",
+        "  return (...args) => { clearTimeout(t); t = setTimeout(() => fn(...args), ms); };",
+        "};",
+        "document.querySelector('#q').addEventListener('input', debounce(e => render(e), 200));",
+        "if (a < b && b > c) { console.log(`<div>${a}</div>`); }"
+    ],
+    "bash": [
+        "for f in *.log; do",
+        "  grep -E '<error>|&&' \"$f\" > \"${f%.log}.err\" 2>&1",
+        "done"
+    ]
+}
+
+_RTL_CJK = [
+    "این یک پاسخ آزمایشی است که شامل متن فارسی طولانی می‌شود.",
+    "مدل باید متن راست به چپ را بدون خراب کردن برچسب‌ها نمایش دهد.",
+    "هذا نص عربي لاختبار التنسيق مع <b>خط عريض</b> وقوائم.",
+    "זהו טקסט בעברית עם `קוד` בתוכו.",
+    "这是一个用于测试格式化性能的中文段落，其中包含列表和代码。",
+    "日本語のテキストも含まれています。絵文字もあります 🎉🚀。",
+    "한국어 문장도 섞여 있습니다."
+]
+
+_TAG_NOISE = [
+    "<b>", "</b>", "<i>", "</i>", "</u>", "<code>", "<<", ">>", "a < b", "b > a",
+    "<div class='x'>", "</span>", "<br>", "<3", "<unknown attr=1>", "</pre>", "<pre>",
+    "&amp;", "&", "<a href='https://example.com'>", "</a>", "<", ">"
+]
+
+
+def _prose(rng: random.Random, sentences: int) -> str:
+    return ". ".join(rng.choice(_PROSE) for _ in range(sentences)) + "."
+
+
+def _code_block(rng: random.Random) -> str:
+    lang = rng.choice(list(_CODE))
+    lines = _CODE[lang] * rng.randint(1, 3)
+    return "```" + lang + "\n" + "\n".join(lines) + "\n```"
+
+
+def _markdown_section(rng: random.Random) -> str:
+    parts = [f"## {rng.choice(_PROSE)[:40]}", _prose(rng, rng.randint(2, 5))]
+    bullet = rng.choice(["* ", "- ", "• "])
+    parts.append("\n".join(f"{bullet}{rng.choice(_PROSE)} with `inline_{i}()`" for i in range(rng.randint(2, 6))))
+    parts.append("\n".join(f"{i}. **{rng.choice(_PROSE)[:30]}** step" for i in range(1, rng.randint(2, 5))))
+    if rng.random() < 0.5:
+        parts.append(_code_block(rng))
+    return "\n\n".join(parts)
+
+
+def _grow(rng: random.Random, size: int, piece: Callable[[random.Random], str]) -> str:
+    parts: List[str] = []
+    total = 0
+    while total < size:
+        part = piece(rng)
+        parts.append(part)
+        total += len(part) + 2
+    return "\n\n".join(parts)[:size]
+
+
+def build_corpora(seed: int = 1234) -> Dict[str, str]:
+    """Deterministic corpora that resemble real model answers"""
+    rng = random.Random(seed)
+    return {
+        "code_heavy": _grow(rng, 20000, lambda r: _code_block(r) if r.random() < 0.6 else _prose(r, 3)),
+        "rtl_cjk": _grow(rng, 20000, lambda r: "\n".join(
+            ("• " if r.random() < 0.3 else "") + r.choice(_RTL_CJK) for _ in range(r.randint(2, 6))
+        )),
+        "unbalanced_tags": _grow(rng, 20000, lambda r: " ".join(
+            r.choice(_TAG_NOISE) if r.random() < 0.4 else r.choice(_PROSE) for _ in range(8)
+        )),
+        "long_50k": _grow(rng, 50000, _markdown_section)
+    }
+
+
+_CALIBRATION_TEXT = "abc<def>ghi\n" * 5000
+
+
+def _calibration_loop() -> None:
+    """A fixed pure-Python string loop"""
+    out = []
+    for char in _CALIBRATION_TEXT:
+        if char == "<":
+            out.append("&lt;")
+        else:
+            out.append(char)
+    "".join(out)
+
+
+def _calls_per_sample(func: Callable[[], object], min_time: float) -> int:
+    """Number of calls that makes one sample measurable"""
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        if time.perf_counter() - start >= min_time or number >= 1 << 20:
+            return number
+        number *= 2
+
+
+def _sample(func: Callable[[], object], number: int) -> float:
+    """Seconds per call over `number` calls, with the garbage collector paused as timeit does"""
+    gc.collect()
+    gc.disable()
+    try:
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        return (time.perf_counter() - start) / number
+    finally:
+        gc.enable()
+
+
+def _measure(func: Callable[[], object], min_time: float = 0.05, repeat: int = 7) -> Tuple[float, float]:
+    """Median seconds per call of `func` and of the calibration loop, sampled alternately
+
+    The second value is the median of the per-pair ratios, expressed as the
+    calibration loop's time per call scaled to the benchmark's samples.
+    """
+    number = _calls_per_sample(func, min_time)
+    calibration_number = _calls_per_sample(_calibration_loop, min_time / 2)
+    times, ratios = [], []
+    for _ in range(repeat):
+        calibration = _sample(_calibration_loop, calibration_number)
+        seconds = _sample(func, number)
+        times.append(seconds)
+        ratios.append(calibration / seconds)
+    return statistics.median(times), statistics.median(ratios)
+
+
+def _digest(value) -> str:
+    return hashlib.sha256(json.dumps(value, ensure_ascii=False).encode("utf-8")).hexdigest()[:16]
+
+
+def build_cases(handler, corpora: Dict[str, str]) -> List[Tuple[str, int, Callable[[], object]]]:
+    """(name, characters processed per call, function) for every benchmark"""
+    cases = []
+    for name, text in corpora.items():
+        formatted = handler.format_content(text)
+        cleaned = handler._clean_and_validate_html(formatted)
+        cases.append((f"format_content/{name}", len(text), lambda t=text: handler.format_content(t)))
+        cases.append((f"clean_html/{name}", len(formatted), lambda t=formatted: handler._clean_and_validate_html(t)))
+        cases.append((f"split_message/{name}", len(cleaned), lambda t=cleaned: handler._split_message(t)))
+
+    # Streaming: the full pipeline re-run on every growing prefix, as edit_message_safely does
+    text = corpora["long_50k"]
+    step = 2000
+
+    def stream_render():
+        chunks = None
+        for end in range(step, len(text) + step, step):
+            formatted = handler.format_content(text[:end])
+            chunks = handler._split_message(handler._clean_and_validate_html(formatted))
+        return chunks
+
+    def stream_render_incremental():
+        # The same growing prefixes through the incremental renderer edit_message_safely uses
+        handler.renderers.pop("benchmark", None)
+        chunks = None
+        for end in range(step, len(text) + step, step):
+            chunks = handler.render_chunks("benchmark", text[:end])
+        return chunks
+
+    cases.append(("stream_render/long_50k", len(text), stream_render))
+    cases.append(("stream_render_incremental/long_50k", len(text), stream_render_incremental))
+    return cases
+
+
+def run(filter_pattern: Optional[str] = None) -> Dict:
+    from bot_handler import MessageHandler
+
+    handler = MessageHandler()
+    calibration_seconds = []
+    results = {}
+    for name, size, func in build_cases(handler, build_corpora()):
+        if filter_pattern and not re.search(filter_pattern, name):
+            continue
+        seconds, ratio = _measure(func)
+        calibration_seconds.append(seconds * ratio)
+        results[name] = {
+            "chars_per_second": size / seconds,
+            # Benchmark throughput divided by calibration throughput, from paired samples
+            "normalized": size * ratio / len(_CALIBRATION_TEXT),
+            "output": _digest(func())
+        }
+    calibration = len(_CALIBRATION_TEXT) / statistics.median(calibration_seconds) if calibration_seconds else None
+    return {
+        "calibration_chars_per_second": calibration,
+        "python": platform.python_version(),
+        "results": results
+    }
+
+
+def compare(current: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """Return a failure message for every regression against the baseline"""
+    failures = []
+    for name, result in current["results"].items():
+        expected = baseline.get("results", {}).get(name)
+        if expected is None:
+            continue
+        ratio = result["normalized"] / expected["normalized"]
+        if ratio < 1 - tolerance:
+            failures.append(f"{name}: {ratio:.0%} of baseline throughput")
+        if result["output"] != expected["output"]:
+            failures.append(f"{name}: output changed")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark MessageHandler formatting and splitting")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed slowdown, e.g. 0.25 for 25%%")
+    parser.add_argument("--filter", default=None, help="Only run benchmarks matching this regex")
+    args = parser.parse_args()
+
+    current = run(args.filter)
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    print(f"{'benchmark':<34} {'chars/s':>14} {'vs baseline':>12}")
+    for name, result in current["results"].items():
+        expected = baseline.get("results", {}).get(name)
+        change = f"{result['normalized'] / expected['normalized']:.0%}" if expected else "new"
+        print(f"{name:<34} {result['chars_per_second']:>14,.0f} {change:>12}")
+
+    if args.update_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(current, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Baseline written to {args.baseline}")
+        return
+
+    failures = compare(current, baseline, args.tolerance)
+    if failures:
+        print("\nRegressions:")
+        for failure in failures:
+            print(f"  {failure}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+# generation_registry.py
+"""Tracking and cancellation of in-flight generations.
+
+Every generation runs under a CancellationToken registered for its user. A new
+generation by the same user, or /cancel, cancels the previous token. The token
+is handed through ModelManager to the provider handlers. A firing token expires
+the timeout of whatever read is pending, and handlers check it between chunks
+and close their upstream connection, so the provider request and its limiter
+slot are released at once instead of when the answer would have ended.
+
+Generations are started with GenerationRegistry.spawn() as tasks of their own,
+so Pyrogram's update workers are free again at once: /cancel and other updates
+are never stuck behind running answers, and how many generations run is left
+to admission control.
+"""
+from contextlib import contextmanager
+from typing import Optional, Dict, List, Set, Callable, Awaitable, TypeVar
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class CancellationToken:
+    """Cooperative cancellation signal for one generation"""
+
+    def __init__(self):
+        self._event = asyncio.Event()
+        self._callbacks: List[Callable[[], None]] = []
+        self.reason: Optional[str] = None
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self, reason: str = "cancelled") -> None:
+        if not self._event.is_set():
+            self.reason = reason
+            self._event.set()
+            for callback in self._callbacks:
+                try:
+                    callback()
+                except Exception as e:
+                    logger.error(f"Error in cancellation callback: {str(e)}")
+
+    async def wait(self) -> None:
+        await self._event.wait()
+
+    def add_callback(self, callback: Callable[[], None]) -> None:
+        """Call `callback` when the token is cancelled"""
+        self._callbacks.append(callback)
+
+    def remove_callback(self, callback: Callable[[], None]) -> None:
+        if callback in self._callbacks:
+            self._callbacks.remove(callback)
+
+
+class CancellableWait:
+    """Awaits that end with TimeoutError as soon as a token fires
+
+    Every wait is a plain await under asyncio.timeout, so a stream read costs
+    no extra task; a firing token only reschedules the timeout in progress.
+    Call close() when done to unregister from the token.
+    """
+
+    def __init__(self, token: Optional[CancellationToken]):
+        self.token = token
+        self._scope: Optional[asyncio.Timeout] = None
+        if token is not None:
+            token.add_callback(self._interrupt)
+
+    @property
+    def cancelled(self) -> bool:
+        return self.token is not None and self.token.cancelled
+
+    def _interrupt(self) -> None:
+        if self._scope is not None:
+            self._scope.reschedule(asyncio.get_running_loop().time())
+
+    async def wait(self, awaitable: Awaitable[T], timeout: Optional[float] = None) -> T:
+        """Await `awaitable`; raises TimeoutError after `timeout` seconds or once the token fires"""
+        async with asyncio.timeout(timeout) as self._scope:
+            try:
+                if self.cancelled:
+                    self._interrupt()
+                return await awaitable
+            finally:
+                self._scope = None
+
+    def close(self) -> None:
+        if self.token is not None:
+            self.token.remove_callback(self._interrupt)
+
+
+class GenerationRegistry:
+    """The in-flight generation of every user"""
+
+    def __init__(self):
+        self._active: Dict[int, CancellationToken] = {}
+        self._tasks: Set[asyncio.Task] = set()  # Strong references to running tasks
+        self._latest: Dict[int, asyncio.Task] = {}
+
+    def is_active(self, user_id: int) -> bool:
+        return user_id in self._active
+
+    def spawn(self, user_id: int, coro: Awaitable) -> asyncio.Task:
+        """Run a generating handler as its own task instead of in the update worker"""
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        self._latest[user_id] = task
+        task.add_done_callback(lambda done: self._finished(user_id, done))
+        return task
+
+    def task_of(self, user_id: int) -> Optional[asyncio.Task]:
+        """The user's most recently spawned task, while it runs"""
+        return self._latest.get(user_id)
+
+    def _finished(self, user_id: int, task: asyncio.Task) -> None:
+        self._tasks.discard(task)
+        if self._latest.get(user_id) is task:
+            del self._latest[user_id]
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Unhandled error in generation for user {user_id}: {str(task.exception())}")
+
+    @contextmanager
+    def track(self, user_id: int):
+        """Register a generation for `user_id`, cancelling the one already running"""
+        self.cancel(user_id, "superseded")
+        token = self._active[user_id] = CancellationToken()
+        try:
+            yield token
+        finally:
+            if self._active.get(user_id) is token:
+                del self._active[user_id]
+
+    def cancel(self, user_id: int, reason: str = "cancelled") -> bool:
+        """Cancel the user's in-flight generation; returns whether there was one"""
+        token = self._active.pop(user_id, None)
+        if token is None:
+            return False
+        logger.info(f"Cancelling generation for user {user_id}: {reason}")
+        token.cancel(reason)
+        return True
+
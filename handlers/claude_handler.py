@@ -1,22 +1,37 @@
 # handlers/claude_handler.py
-from anthropic import Anthropic
-from typing import Optional, AsyncGenerator
+from anthropic import AsyncAnthropic
+from typing import Optional, AsyncGenerator, List, Union
 import base64
 import mimetypes
 import os
-import asyncio
 import logging
+from handlers.stream_events import EventStream, StreamEvent
+from retry_policy import parse_retry_after
+from config import PROVIDER_BASE_URLS
+from api_key_pool import ApiKey, ApiKeyPool
+from generation_registry import CancellationToken
 
 logger = logging.getLogger(__name__)
 
 class ClaudeHandler:
-    def __init__(self, api_key: str):
-        self.client = Anthropic(api_key=api_key)
+    def __init__(self, api_key: Union[str, List[str]], base_url: Optional[str] = None):
+        self.key_pool = ApiKeyPool("claude", api_key)
+        self.base_url = base_url or PROVIDER_BASE_URLS["claude"]
+        self.clients = {}  # One client per pooled key
         self.models = {
             "claude-3.5-haiku": "claude-3.5-haiku-20240307",
             "claude-3.5-sonnet": "claude-3.5-sonnet-20240307"
         }
     
+    def _get_client(self, api_key: ApiKey) -> AsyncAnthropic:
+        """Get or create the client bound to a pooled key"""
+        if api_key.key not in self.clients:
+            # Retries are left to ModelManager's RetryPolicy, which shares backoff and deadline
+            self.clients[api_key.key] = AsyncAnthropic(
+                api_key=api_key.key, base_url=self.base_url, max_retries=0
+            )
+        return self.clients[api_key.key]
+
     def _encode_image(self, file_path: str) -> str:
         """Encode image to base64"""
         with open(file_path, "rb") as image_file:
@@ -28,9 +43,31 @@ class ClaudeHandler:
         content_type: str,
         file_path: Optional[str] = None,
         model_version: str = "claude-3.5-sonnet",
+        cancel_token: Optional[CancellationToken] = None,
+        **kwargs
+    ) -> AsyncGenerator[StreamEvent, None]:
+        """Process content and stream response events"""
+        events = EventStream()
+        async for event in self.key_pool.stream(
+            events,
+            lambda api_key: self._process_with_key(
+                api_key, events, content, content_type, file_path, model_version, cancel_token, **kwargs
+            )
+        ):
+            yield event
+
+    async def _process_with_key(
+        self,
+        api_key: ApiKey,
+        events: EventStream,
+        content: str,
+        content_type: str,
+        file_path: Optional[str],
+        model_version: str,
+        cancel_token: Optional[CancellationToken],
         **kwargs
-    ) -> AsyncGenerator[str, None]:
-        """Process content and return response"""
+    ) -> AsyncGenerator[StreamEvent, None]:
+        """Stream one request using the given pooled key"""
         try:
             model = self.models.get(model_version)
             if not model:
@@ -70,23 +107,42 @@ class ClaudeHandler:
                     "content": content
                 })
 
-            response = await self.client.messages.create(
+            async with self._get_client(api_key).messages.stream(
                 model=model,
                 max_tokens=kwargs.get('max_tokens', 4096),
                 temperature=kwargs.get('temperature', 0.7),
                 messages=messages
-            )
+            ) as stream:
+                headers = getattr(getattr(stream, "response", None), "headers", None) or {}
+                self.key_pool.update_remaining(
+                    api_key, headers.get("anthropic-ratelimit-requests-remaining")
+                )
+                async for text in stream.text_stream:
+                    if cancel_token is not None and cancel_token.cancelled:
+                        # Drop the connection instead of reading the rest of the answer
+                        await stream.close()
+                        return
+                    if text:
+                        yield events.delta(text)
+                final_message = await stream.get_final_message()
 
-            full_response = response.content[0].text
-            chunk_size = 50
-            for i in range(0, len(full_response), chunk_size):
-                chunk = full_response[i:i + chunk_size]
-                yield chunk
-                await asyncio.sleep(0.05)
+            if final_message.usage:
+                yield events.usage(
+                    input_tokens=final_message.usage.input_tokens,
+                    output_tokens=final_message.usage.output_tokens
+                )
+            yield events.finish(final_message.stop_reason or "stop")
 
         except Exception as e:
             logger.error(f"Claude processing error: {str(e)}")
-            yield f"Error: {str(e)}"
+            status = getattr(e, "status_code", None) or 0
+            headers = getattr(getattr(e, "response", None), "headers", None) or {}
+            yield events.error(
+                str(e),
+                retryable=status in (408, 409, 429) or status >= 500,
+                retry_after=parse_retry_after(headers.get("retry-after")),
+                status=status or None
+            )
 
     def get_available_parameters(self, model_version: str) -> dict:
         """Get available parameters for the specified model version"""
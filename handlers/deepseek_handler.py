@@ -1,15 +1,21 @@
 # handlers/deepseek_handler.py
 import aiohttp
 import json
-from typing import Optional, AsyncGenerator
+from typing import Optional, AsyncGenerator, List, Union
 import logging
+from handlers.stream_events import EventStream, StreamEvent
+from retry_policy import parse_retry_after
+from config import PROVIDER_BASE_URLS
+from api_key_pool import ApiKey, ApiKeyPool
+from generation_registry import CancellationToken
 
 logger = logging.getLogger(__name__)
 
 class DeepSeekHandler:
-    def __init__(self, api_key: str):
-        self.api_key = api_key
-        self.api_base = "https://api.deepseek.com/v1/chat/completions"
+    def __init__(self, api_key: Union[str, List[str]], base_url: Optional[str] = None):
+        self.key_pool = ApiKeyPool("deepseek", api_key)
+        base_url = base_url or PROVIDER_BASE_URLS["deepseek"]
+        self.api_base = f"{base_url.rstrip('/')}/chat/completions"
         self.models = {
             "deepseek-v3": "deepseek-chat-v3"  # اصلاح نام مدل
         }
@@ -20,8 +26,29 @@ class DeepSeekHandler:
         content_type: str,
         file_path: Optional[str] = None,
         model_version: str = "deepseek-v3",
+        cancel_token: Optional[CancellationToken] = None,
         **kwargs
-    ) -> AsyncGenerator[str, None]:
+    ) -> AsyncGenerator[StreamEvent, None]:
+        events = EventStream()
+        async for event in self.key_pool.stream(
+            events,
+            lambda api_key: self._process_with_key(
+                api_key, events, content, content_type, model_version, cancel_token, **kwargs
+            )
+        ):
+            yield event
+
+    async def _process_with_key(
+        self,
+        api_key: ApiKey,
+        events: EventStream,
+        content: str,
+        content_type: str,
+        model_version: str,
+        cancel_token: Optional[CancellationToken],
+        **kwargs
+    ) -> AsyncGenerator[StreamEvent, None]:
+        """Stream one request using the given pooled key"""
         try:
             if content_type != "text":
                 raise ValueError("DeepSeek only supports text input")
@@ -31,7 +58,7 @@ class DeepSeekHandler:
                 raise ValueError(f"Model version {model_version} not supported")
             
             headers = {
-                "Authorization": f"Bearer {self.api_key}",
+                "Authorization": f"Bearer {api_key.key}",
                 "Content-Type": "application/json"
             }
             
@@ -40,7 +67,8 @@ class DeepSeekHandler:
                 "messages": [{"role": "user", "content": content}],
                 "temperature": kwargs.get("temperature", 0.7),
                 "max_tokens": kwargs.get("max_tokens", 2048),
-                "stream": True
+                "stream": True,
+                "stream_options": {"include_usage": True}
             }
             
             async with aiohttp.ClientSession() as session:
@@ -49,12 +77,32 @@ class DeepSeekHandler:
                     headers=headers,
                     json=data
                 ) as response:
+                    self.key_pool.update_remaining(
+                        api_key, response.headers.get("x-ratelimit-remaining-requests")
+                    )
                     if response.status != 200:
-                        error_data = await response.json()
-                        raise ValueError(f"API Error: {error_data.get('error', 'Unknown error')}")
+                        try:
+                            error_data = await response.json(content_type=None)
+                        except (aiohttp.ContentTypeError, json.JSONDecodeError):
+                            error_data = {}
+                        error = f"API Error ({response.status}): {error_data.get('error', 'Unknown error')}"
+                        logger.error(f"DeepSeek processing error: {error}")
+                        yield events.error(
+                            error,
+                            retryable=response.status == 429 or response.status >= 500,
+                            retry_after=parse_retry_after(response.headers.get("Retry-After")),
+                            status=response.status
+                        )
+                        return
                     
                     buffer = ""
+                    finish_reason = None
+                    usage = None
                     async for line in response.content:
+                        if cancel_token is not None and cancel_token.cancelled:
+                            # Drop the connection instead of reading the rest of the answer
+                            response.close()
+                            return
                         line = line.decode('utf-8').strip()
                         if not line or line == "data: [DONE]":
                             continue
@@ -62,22 +110,34 @@ class DeepSeekHandler:
                         if line.startswith("data: "):
                             try:
                                 chunk_data = json.loads(line[6:])
-                                if chunk_data.get("choices") and chunk_data["choices"][0].get("delta", {}).get("content"):
-                                    text = chunk_data["choices"][0]["delta"]["content"]
+                            except json.JSONDecodeError:
+                                continue
+
+                            choices = chunk_data.get("choices") or []
+                            if choices:
+                                finish_reason = choices[0].get("finish_reason") or finish_reason
+                                text = choices[0].get("delta", {}).get("content")
+                                if text:
                                     buffer += text
                                     
                                     if any(c in buffer for c in ['.', '!', '?', '\n']) or len(buffer) > 80:
-                                        yield buffer
+                                        yield events.delta(buffer)
                                         buffer = ""
-                            except json.JSONDecodeError:
-                                continue
+
+                            usage = chunk_data.get("usage") or usage
                     
                     if buffer:
-                        yield buffer
+                        yield events.delta(buffer)
+                    if usage:
+                        yield events.usage(
+                            input_tokens=usage.get("prompt_tokens", 0),
+                            output_tokens=usage.get("completion_tokens", 0)
+                        )
+                    yield events.finish(finish_reason or "stop")
         
         except Exception as e:
             logger.error(f"DeepSeek processing error: {str(e)}")
-            yield f"Error: {str(e)}"
+            yield events.error(str(e))
     
     def get_available_parameters(self, model_version: str) -> dict:
         return {
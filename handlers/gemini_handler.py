@@ -1,38 +1,47 @@
 # handlers/gemini_handler.py
-import google.generativeai as genai
-from typing import Optional, AsyncGenerator, List, Dict
+from google.ai import generativelanguage as glm
+from google.api_core import exceptions as google_exceptions
+from google.generativeai.types import content_types
+from typing import Optional, AsyncGenerator, List, Dict, Union
 import mimetypes
 import os
 import logging
-from PIL import Image
 import io
 import base64
-from config import MODELS
+from config import MODELS, PROVIDER_BASE_URLS
 import asyncio
+from handlers.stream_events import EventStream, StreamEvent
+from api_key_pool import ApiKey, ApiKeyPool
+from generation_registry import CancellationToken
 
 logger = logging.getLogger(__name__)
 
 class GeminiHandler:
-    def __init__(self, api_key: str):
-        genai.configure(api_key=api_key)
-        self.models = {}
-        self._initialize_models()
+    def __init__(self, api_key: Union[str, List[str]], base_url: Optional[str] = None):
+        self.key_pool = ApiKeyPool("gemini", api_key)
+        self.base_url = base_url or PROVIDER_BASE_URLS["gemini"]
+        self.clients = {}  # One API client per pooled key
+        self.models = MODELS["gemini"]["versions"]
         
         # Track active conversations
         self.active_chats = {}
+
+    def _transport_options(self) -> Dict:
+        """Custom endpoints such as mock_provider.py speak plain HTTP, so use REST"""
+        if not self.base_url:
+            return {}
+        return {"transport": "rest", "client_options": {"api_endpoint": self.base_url}}
     
-    def _initialize_models(self):
-        """Initialize different Gemini model versions"""
-        model_versions = [
-            "gemini-1.5-flash-002",
-            "gemini-1.5-pro-002",
-            "gemini-2.0-flash-exp"
-        ]
-        for version in model_versions:
-            try:
-                self.models[version] = genai.GenerativeModel(version)
-            except Exception as e:
-                logger.error(f"Failed to initialize {version}: {str(e)}")
+    def _get_client(self, api_key: ApiKey) -> glm.GenerativeServiceClient:
+        """API client bound to the leased key, so pooled keys never share global configuration"""
+        client = self.clients.get(api_key.key)
+        if client is None:
+            options = self._transport_options()
+            client = self.clients[api_key.key] = glm.GenerativeServiceClient(
+                client_options={"api_key": api_key.key, **options.get("client_options", {})},
+                transport=options.get("transport")
+            )
+        return client
 
     def _validate_file(self, file_path: str, content_type: str) -> bool:
         """Validate file format and size"""
@@ -62,6 +71,8 @@ class GeminiHandler:
 
     def _process_image(self, file_path: str) -> Dict:
         """Process image file for Gemini"""
+        from PIL import Image
+
         self._validate_file(file_path, "image")
         
         try:
@@ -194,25 +205,46 @@ class GeminiHandler:
         chat_history: List[Dict] = None,
         file_path: Optional[str] = None,
         model_version: str = "gemini-1.5-flash-002",
+        cancel_token: Optional[CancellationToken] = None,
         **kwargs
-    ) -> AsyncGenerator[str, None]:
+    ) -> AsyncGenerator[StreamEvent, None]:
+        events = EventStream()
+        async for event in self.key_pool.stream(
+            events,
+            lambda api_key: self._process_with_key(
+                api_key, events, content, content_type, chat_history,
+                file_path, model_version, cancel_token, **kwargs
+            )
+        ):
+            yield event
+
+    async def _process_with_key(
+        self,
+        api_key: ApiKey,
+        events: EventStream,
+        content: str,
+        content_type: str,
+        chat_history: Optional[List[Dict]],
+        file_path: Optional[str],
+        model_version: str,
+        cancel_token: Optional[CancellationToken],
+        **kwargs
+    ) -> AsyncGenerator[StreamEvent, None]:
+        """Stream one request using the given pooled key"""
         try:
             # Validate content
             if not content or not content.strip():
                 content = "Please help me analyze this" if file_path else "Hello"
             
-            model = self.models.get(model_version)
-            if not model:
-                raise ValueError(f"Model version {model_version} not initialized")
+            if model_version not in self.models:
+                raise ValueError(f"Unsupported model version: {model_version}")
                 
-            generation_config = {
-                "temperature": float(kwargs.get("temperature", 0.7)),
-                "top_p": float(kwargs.get("top_p", 0.95)),
-                "top_k": int(kwargs.get("top_k", 40)),
-                "max_output_tokens": int(kwargs.get("max_tokens", 2048)),
-            }
-            
-            model.generation_config = generation_config
+            generation_config = glm.GenerationConfig(
+                temperature=float(kwargs.get("temperature", 0.7)),
+                top_p=float(kwargs.get("top_p", 0.95)),
+                top_k=int(kwargs.get("top_k", 40)),
+                max_output_tokens=int(kwargs.get("max_tokens", 2048)),
+            )
             
             # Format chat history
             formatted_history = []
@@ -224,22 +256,21 @@ class GeminiHandler:
                             "parts": [msg["content"]]
                         })
             
-            chat = model.start_chat(history=formatted_history)
             prompt_parts = [content.strip()]
             
             # Handle non-text content
             if content_type != "text" and file_path:
                 try:
-                    if content_type == "image":
-                        media_data = self._process_image(file_path)
-                    elif content_type == "video":
-                        media_data = self._process_video(file_path)
-                    elif content_type == "audio":
-                        media_data = self._process_audio(file_path)
-                    elif content_type == "document":
-                        media_data = self._process_document(file_path)
-                    else:
+                    processors = {
+                        "image": self._process_image,
+                        "video": self._process_video,
+                        "audio": self._process_audio,
+                        "document": self._process_document
+                    }
+                    if content_type not in processors:
                         raise ValueError(f"Unsupported content type: {content_type}")
+                    # Reading and converting large files would block the event loop
+                    media_data = await asyncio.to_thread(processors[content_type], file_path)
                         
                     prompt_parts.append({
                         "mime_type": media_data["mime_type"],
@@ -247,60 +278,114 @@ class GeminiHandler:
                     })
                 except Exception as e:
                     logger.error(f"Error processing {content_type}: {str(e)}")
-                    yield f"Error processing {content_type}: {str(e)}"
+                    yield events.error(
+                        str(e),
+                        text=f"Error processing {content_type}: {str(e)}"
+                    )
                     return
             
+            request = glm.GenerateContentRequest(
+                model=f"models/{model_version}",
+                contents=content_types.to_contents(
+                    formatted_history + [{"role": "user", "parts": prompt_parts}]
+                ),
+                generation_config=generation_config
+            )
             try:
                 response = await asyncio.to_thread(
-                    chat.send_message,
-                    prompt_parts,
-                    stream=True
+                    self._get_client(api_key).stream_generate_content,
+                    request
                 )
                 
-                async for chunk in self._process_response_stream(response):
-                    yield chunk
+                async for event in self._process_response_stream(response, events, cancel_token):
+                    yield event
                     
             except Exception as e:
                 error_msg = str(e).lower()
                 if "empty text parameter" in error_msg:
-                    yield "I apologize, but I couldn't process an empty message. Please provide some text or context."
+                    yield events.error(
+                        str(e),
+                        text="I apologize, but I couldn't process an empty message. Please provide some text or context."
+                    )
                 else:
                     logger.error(f"Gemini processing error: {str(e)}")
-                    yield f"Error: {str(e)}"
+                    yield events.error(str(e), status=self._error_status(e))
                     
         except Exception as e:
             logger.error(f"Gemini processing error: {str(e)}")
-            yield f"Error: {str(e)}"
+            yield events.error(str(e))
+
+    @staticmethod
+    def _error_status(error: Exception) -> Optional[int]:
+        """HTTP status of a failed API call, if the error came from the API"""
+        if isinstance(error, google_exceptions.GoogleAPICallError):
+            return error.code
+        return None
 
-    async def _process_response_stream(self, response, max_retries=3):
-        """Process streaming response from Gemini with retry logic"""
-        retry_count = 0
-        while retry_count < max_retries:
+    @staticmethod
+    def _chunk_text(chunk: glm.GenerateContentResponse) -> str:
+        """Return chunk text, or an empty string for chunks without parts"""
+        if not chunk.candidates:
+            return ""
+        return "".join(part.text for part in chunk.candidates[0].content.parts)
+
+    @staticmethod
+    def _chunk_finish_reason(chunk: glm.GenerateContentResponse) -> Optional[str]:
+        """Return the finish reason name of the first candidate, if set"""
+        if not chunk.candidates or not chunk.candidates[0].finish_reason:
+            return None
+        return chunk.candidates[0].finish_reason.name.lower()
+
+    async def _process_response_stream(
+        self,
+        response,
+        events: EventStream,
+        cancel_token: Optional[CancellationToken] = None
+    ):
+        """Process streaming response from Gemini; retries are handled by ModelManager"""
+        try:
+            finish_reason = None
+            usage_metadata = None
+            # Each chunk is a blocking network read, so it is fetched in a worker thread
+            chunks = iter(response)
             try:
-                for chunk in response:
-                    if hasattr(chunk, 'text'):
-                        yield chunk.text
-                        await asyncio.sleep(0.02)  # Prevent flooding
-                break  # Success, exit loop
-                
-            except Exception as e:
-                error_message = str(e).lower()
-                retry_count += 1
-                
-                if "503" in error_message or "overloaded" in error_message:
-                    if retry_count < max_retries:
-                        wait_time = 2 ** retry_count  # Exponential backoff
-                        logger.warning(f"Model overloaded, retrying in {wait_time} seconds...")
-                        await asyncio.sleep(wait_time)
-                        continue
-                    else:
-                        logger.error("Max retries reached for model overload")
-                        yield "\n\n⚠️ The model is currently experiencing high load. Please try regenerating the response."
+                while True:
+                    if cancel_token is not None and cancel_token.cancelled:
+                        return
+                    chunk = await asyncio.to_thread(next, chunks, None)
+                    if chunk is None:
                         break
-                else:
-                    logger.error(f"Error in response streaming: {str(e)}")
-                    yield f"\n\nError: {str(e)}"
-                    break
+                    text = self._chunk_text(chunk)
+                    if text:
+                        yield events.delta(text)
+                    finish_reason = self._chunk_finish_reason(chunk) or finish_reason
+                    if "usage_metadata" in chunk:
+                        usage_metadata = chunk.usage_metadata
+            finally:
+                # Close the HTTP stream now; a read abandoned on cancellation would
+                # otherwise keep it open in its worker thread until the answer ends
+                response.cancel()
+
+            if usage_metadata:
+                yield events.usage(
+                    input_tokens=usage_metadata.prompt_token_count,
+                    output_tokens=usage_metadata.candidates_token_count
+                )
+            yield events.finish(finish_reason or "stop")
+
+        except Exception as e:
+            error_message = str(e).lower()
+            if "503" in error_message or "overloaded" in error_message:
+                logger.warning(f"Model overloaded: {str(e)}")
+                yield events.error(
+                    str(e),
+                    text="\n\n⚠️ The model is currently experiencing high load. Please try regenerating the response.",
+                    retryable=True,
+                    status=self._error_status(e)
+                )
+            else:
+                logger.error(f"Error in response streaming: {str(e)}")
+                yield events.error(str(e), text=f"\n\nError: {str(e)}", status=self._error_status(e))
     
     def get_available_parameters(self, model_version: str) -> dict:
         """Get available parameters for the specified model version"""
@@ -0,0 +1,121 @@
+# handlers/stream_events.py
+from dataclasses import dataclass, field
+from typing import Optional, Dict
+import time
+
+DELTA = "delta"
+USAGE = "usage"
+FINISH = "finish"
+ERROR = "error"
+
+
+@dataclass(frozen=True)
+class StreamEvent:
+    """Single event emitted by a model handler stream"""
+    kind: str
+    text: str = ""
+    usage: Optional[Dict[str, int]] = None
+    finish_reason: Optional[str] = None
+    error: Optional[str] = None
+    retryable: bool = False
+    retry_after: Optional[float] = None
+    status: Optional[int] = None  # HTTP status of a failed provider call
+    started_at: float = 0.0
+    timestamp: float = field(default_factory=time.monotonic)
+
+    @property
+    def is_delta(self) -> bool:
+        return self.kind == DELTA
+
+    @property
+    def is_error(self) -> bool:
+        return self.kind == ERROR
+
+    @property
+    def elapsed(self) -> float:
+        """Seconds between the start of the request and this event"""
+        return self.timestamp - self.started_at
+
+
+class EventStream:
+    """Factory for events belonging to one request, sharing its start time"""
+
+    def __init__(self, started_at: Optional[float] = None):
+        self.started_at = started_at if started_at is not None else time.monotonic()
+
+    def delta(self, text: str) -> StreamEvent:
+        return StreamEvent(kind=DELTA, text=text, started_at=self.started_at)
+
+    def usage(self, input_tokens: int = 0, output_tokens: int = 0) -> StreamEvent:
+        return StreamEvent(
+            kind=USAGE,
+            usage={"input_tokens": input_tokens, "output_tokens": output_tokens},
+            started_at=self.started_at
+        )
+
+    def finish(self, reason: str = "stop") -> StreamEvent:
+        return StreamEvent(kind=FINISH, finish_reason=reason, started_at=self.started_at)
+
+    def error(
+        self,
+        error: str,
+        text: Optional[str] = None,
+        retryable: bool = False,
+        retry_after: Optional[float] = None,
+        status: Optional[int] = None
+    ) -> StreamEvent:
+        """Create an error event; `text` is the user-facing message"""
+        return StreamEvent(
+            kind=ERROR,
+            text=text if text is not None else f"Error: {error}",
+            error=error,
+            retryable=retryable,
+            retry_after=retry_after,
+            status=status,
+            started_at=self.started_at
+        )
+
+
+class StreamStats:
+    """Accumulate timing statistics from a stream of events"""
+
+    def __init__(self):
+        self.started_at: Optional[float] = None
+        self.first_delta_at: Optional[float] = None
+        self.last_event_at: Optional[float] = None
+        self.delta_count = 0
+        self.output_tokens: Optional[int] = None
+        self.finish_reason: Optional[str] = None
+        self.error: Optional[str] = None
+
+    def observe(self, event: StreamEvent) -> None:
+        if self.started_at is None:
+            self.started_at = event.started_at
+        self.last_event_at = event.timestamp
+        if event.kind == DELTA:
+            self.delta_count += 1
+            if self.first_delta_at is None:
+                self.first_delta_at = event.timestamp
+        elif event.kind == USAGE and event.usage:
+            self.output_tokens = event.usage.get("output_tokens")
+        elif event.kind == FINISH:
+            self.finish_reason = event.finish_reason
+        elif event.kind == ERROR:
+            self.error = event.error
+
+    @property
+    def time_to_first_token(self) -> Optional[float]:
+        if self.first_delta_at is None or self.started_at is None:
+            return None
+        return self.first_delta_at - self.started_at
+
+    @property
+    def tokens_per_second(self) -> Optional[float]:
+        """Output rate after the first token; falls back to delta count without usage"""
+        if self.first_delta_at is None or self.last_event_at is None:
+            return None
+        duration = self.last_event_at - self.first_delta_at
+        if duration <= 0:
+            return None
+        tokens = self.output_tokens if self.output_tokens else self.delta_count
+        return tokens / duration
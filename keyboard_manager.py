@@ -1,9 +1,20 @@
 # keyboard_manager.py
 from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-from typing import List, Dict, Optional, Union
+from typing import List, Dict, Optional, Union, Tuple
+from functools import lru_cache
 from config import MODELS, DEFAULT_PARAMS, PARAMETER_CONFIG
 from config import SUPPORTED_LANGUAGES
 
+# Keyboards are cached by their inputs; parameterized ones keep this many entries
+KEYBOARD_CACHE_SIZE = 256
+
+
+def _frozen(markup: InlineKeyboardMarkup) -> InlineKeyboardMarkup:
+    """Store rows as tuples so a shared cached markup can't be changed by a caller"""
+    markup.inline_keyboard = tuple(tuple(row) for row in markup.inline_keyboard)
+    return markup
+
+
 class KeyboardManager:
     @staticmethod
     def format_param_value(value: Union[float, int], precision: int = 1) -> str:
@@ -16,6 +27,7 @@ class KeyboardManager:
             return str(value)
 
     @staticmethod
+    @lru_cache(maxsize=1)
     def get_model_selection_keyboard() -> InlineKeyboardMarkup:
         """Get keyboard for initial model selection"""
         keyboard = [
@@ -24,11 +36,16 @@ class KeyboardManager:
             [InlineKeyboardButton("🐳 DeepSeek", callback_data="select_model:deepseek")],
             [InlineKeyboardButton("🔙 Back", callback_data="back_to_options")] 
         ]
-        return InlineKeyboardMarkup(keyboard)
+        return _frozen(InlineKeyboardMarkup(keyboard))
 
     @staticmethod
     def get_model_version_keyboard(model: str, versions: List[str]) -> InlineKeyboardMarkup:
         """Get keyboard for model version selection"""
+        return KeyboardManager._model_version_keyboard(model, tuple(versions))
+
+    @staticmethod
+    @lru_cache(maxsize=KEYBOARD_CACHE_SIZE)
+    def _model_version_keyboard(model: str, versions: Tuple[str, ...]) -> InlineKeyboardMarkup:
         version_icons = {
             "gemini-1.5-flash-002": "⚡",
             "gemini-1.5-pro-002": "⭐️",
@@ -51,9 +68,10 @@ class KeyboardManager:
             InlineKeyboardButton("🔙 Back", callback_data="back_to_models")
         ])
         
-        return InlineKeyboardMarkup(keyboard)
+        return _frozen(InlineKeyboardMarkup(keyboard))
 
     @staticmethod
+    @lru_cache(maxsize=1)
     def get_chat_options_keyboard() -> InlineKeyboardMarkup:
         """Get keyboard for chat options"""
         keyboard = [
@@ -69,9 +87,10 @@ class KeyboardManager:
                 InlineKeyboardButton("🔙 Back", callback_data="back_to_models")
             ]
         ]
-        return InlineKeyboardMarkup(keyboard)
+        return _frozen(InlineKeyboardMarkup(keyboard))
 
     @staticmethod
+    @lru_cache(maxsize=KEYBOARD_CACHE_SIZE)
     def get_chat_management_keyboard(chat_id: int) -> InlineKeyboardMarkup:
         """Get keyboard for managing a specific chat"""
         keyboard = [
@@ -104,31 +123,50 @@ class KeyboardManager:
                 )
             ]
         ]
-        return InlineKeyboardMarkup(keyboard)
+        return _frozen(InlineKeyboardMarkup(keyboard))
 
     @staticmethod
-    def get_chat_list_keyboard(chats: List[Dict]) -> InlineKeyboardMarkup:
-        """Get keyboard for chat list"""
+    def get_chat_list_keyboard(chats: List[Dict], has_newer: bool = False,
+                               has_older: bool = False) -> InlineKeyboardMarkup:
+        """Get keyboard for one page of the chat list"""
+        return KeyboardManager._chat_list_keyboard(
+            tuple((chat['chat_id'], chat['title']) for chat in chats), has_newer, has_older
+        )
+
+    @staticmethod
+    @lru_cache(maxsize=KEYBOARD_CACHE_SIZE)
+    def _chat_list_keyboard(chats: Tuple[Tuple[int, str], ...], has_newer: bool,
+                            has_older: bool) -> InlineKeyboardMarkup:
         keyboard = []
-        for chat in chats:
+        for chat_id, title in chats:
             keyboard.append([
                 InlineKeyboardButton(
-                    f"💬 {chat['title']}",
-                    callback_data=f"select_chat:{chat['chat_id']}"
+                    f"💬 {title}",
+                    callback_data=f"select_chat:{chat_id}"
                 ),
                 InlineKeyboardButton(
                     "⚙️",
-                    callback_data=f"manage_chat:{chat['chat_id']}"
+                    callback_data=f"manage_chat:{chat_id}"
                 )
             ])
-        
+
+        # Page buttons carry the first or last chat shown as the keyset cursor
+        navigation = []
+        if has_newer and chats:
+            navigation.append(InlineKeyboardButton("⬅️ Newer", callback_data=f"chats_page:newer:{chats[0][0]}"))
+        if has_older and chats:
+            navigation.append(InlineKeyboardButton("Older ➡️", callback_data=f"chats_page:older:{chats[-1][0]}"))
+        if navigation:
+            keyboard.append(navigation)
+
         keyboard.extend([
             [InlineKeyboardButton("➕ New Chat", callback_data="new_chat")],
             [InlineKeyboardButton("🔙 Back", callback_data="back_to_options")]
         ])
-        return InlineKeyboardMarkup(keyboard)
+        return _frozen(InlineKeyboardMarkup(keyboard))
 
     @staticmethod
+    @lru_cache(maxsize=KEYBOARD_CACHE_SIZE)
     def get_message_actions_keyboard(message_id: int) -> InlineKeyboardMarkup:
         """Get keyboard for message actions"""
         keyboard = [
@@ -149,11 +187,17 @@ class KeyboardManager:
                     )
             ]
         ]
-        return InlineKeyboardMarkup(keyboard)
+        return _frozen(InlineKeyboardMarkup(keyboard))
 
     @staticmethod
     def get_settings_keyboard(model: str, current_params: Dict) -> InlineKeyboardMarkup:
         """Get keyboard for model settings"""
+        return KeyboardManager._settings_keyboard(model, tuple(sorted(current_params.items())))
+
+    @staticmethod
+    @lru_cache(maxsize=KEYBOARD_CACHE_SIZE)
+    def _settings_keyboard(model: str, params: Tuple) -> InlineKeyboardMarkup:
+        current_params = dict(params)
         keyboard = []
         
         # Make sure we have all parameters with default values
@@ -195,7 +239,7 @@ class KeyboardManager:
             )
         ])
         
-        return InlineKeyboardMarkup(keyboard)
+        return _frozen(InlineKeyboardMarkup(keyboard))
 
     @staticmethod
     def _get_param_icon(param: str) -> str:
@@ -211,6 +255,17 @@ class KeyboardManager:
     @staticmethod
     def get_parameter_adjustment_keyboard(param: str, current_value: float, param_info: dict) -> InlineKeyboardMarkup:
         """Get keyboard for parameter adjustment"""
+        return KeyboardManager._parameter_adjustment_keyboard(
+            param, current_value,
+            param_info["min"], param_info["max"], param_info["step"], param_info["precision"]
+        )
+
+    @staticmethod
+    @lru_cache(maxsize=KEYBOARD_CACHE_SIZE)
+    def _parameter_adjustment_keyboard(
+        param: str, current_value: float, minimum: float, maximum: float, step: float, precision: int
+    ) -> InlineKeyboardMarkup:
+        param_info = {"min": minimum, "max": maximum, "step": step, "precision": precision}
         formatted_value = KeyboardManager.format_param_value(
             current_value,
             param_info["precision"]
@@ -231,16 +286,18 @@ class KeyboardManager:
             [InlineKeyboardButton("🔙 Back to Settings", callback_data="back_to_settings")]
         ]
         
-        return InlineKeyboardMarkup(keyboard)
+        return _frozen(InlineKeyboardMarkup(keyboard))
 
     @staticmethod
+    @lru_cache(maxsize=1)
     def get_settings_help_keyboard() -> InlineKeyboardMarkup:
         """Get keyboard for settings help"""
-        return InlineKeyboardMarkup([
+        return _frozen(InlineKeyboardMarkup([
             [InlineKeyboardButton("🔙 Back to Settings", callback_data="back_to_settings")]
-        ])
+        ]))
 
     @staticmethod
+    @lru_cache(maxsize=KEYBOARD_CACHE_SIZE)
     def get_confirmation_keyboard(action: str, chat_id: int) -> InlineKeyboardMarkup:
         """Get keyboard for confirmation dialogs"""
         keyboard = [
@@ -255,16 +312,18 @@ class KeyboardManager:
                 )
             ]
         ]
-        return InlineKeyboardMarkup(keyboard)
+        return _frozen(InlineKeyboardMarkup(keyboard))
 
     @staticmethod
+    @lru_cache(maxsize=KEYBOARD_CACHE_SIZE)
     def get_general_back_keyboard(callback_data: str) -> InlineKeyboardMarkup:
         """Get a general back button keyboard"""
-        return InlineKeyboardMarkup([
+        return _frozen(InlineKeyboardMarkup([
             [InlineKeyboardButton("🔙 Back", callback_data=callback_data)]
-        ])
+        ]))
 
     @staticmethod
+    @lru_cache(maxsize=KEYBOARD_CACHE_SIZE)
     def get_export_format_keyboard(chat_id: int) -> InlineKeyboardMarkup:
         """Get keyboard for selecting export format"""
         keyboard = [
@@ -295,9 +354,10 @@ class KeyboardManager:
                 )
             ]
         ]
-        return InlineKeyboardMarkup(keyboard)
+        return _frozen(InlineKeyboardMarkup(keyboard))
     
     @staticmethod
+    @lru_cache(maxsize=KEYBOARD_CACHE_SIZE)
     def get_language_selection_keyboard(chat_id:int) -> InlineKeyboardMarkup:
         """Get keyboard for language selection"""
         keyboard = []
@@ -309,4 +369,4 @@ class KeyboardManager:
                 )
             ])
         keyboard.append([InlineKeyboardButton("🔙 Back", callback_data=f"manage_chat:{chat_id}")])
-        return InlineKeyboardMarkup(keyboard)
+        return _frozen(InlineKeyboardMarkup(keyboard))
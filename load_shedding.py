@@ -0,0 +1,108 @@
+# load_shedding.py
+"""Automatic degradation of answer quality under pressure.
+
+DegradationController samples event loop lag and the admission queue depth.
+While either is above its high threshold it steps up one mode at a time, each
+mode adding a cheaper behaviour on top of the previous ones; once both are
+below their low thresholds for `recover_seconds` it steps back down one mode
+at a time. Every transition is counted in degradation_transitions_total and
+the current mode is exported as the degradation_level gauge.
+"""
+from typing import Optional, Dict, List, Callable, Any
+import asyncio
+import logging
+import time
+
+from config import DEGRADATION
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Each mode includes the behaviours of the modes before it
+MODES = ("normal", "skip_voice", "reduce_tokens", "fast_model", "slow_edits", "reject_media")
+NORMAL, SKIP_VOICE, REDUCE_TOKENS, FAST_MODEL, SLOW_EDITS, REJECT_MEDIA = range(len(MODES))
+
+
+class DegradationController:
+    """Step through cheaper behaviours while the bot is overloaded, and back when it recovers"""
+
+    def __init__(self, queue_depth: Callable[[], int], settings: Optional[Dict] = None):
+        settings = settings if settings is not None else DEGRADATION
+        self.enabled = settings["enabled"]
+        self.settings = settings
+        self.queue_depth = queue_depth
+        self.level = NORMAL
+        self.loop_lag = 0.0  # Smoothed, in seconds
+        self.listeners: List[Callable[[int, int], None]] = []
+        self._changed_at = time.monotonic()
+        self._calm_since: Optional[float] = None
+        metrics.set_gauge("degradation_level", self.level)
+
+    @property
+    def mode(self) -> str:
+        return MODES[self.level]
+
+    @property
+    def skip_voice(self) -> bool:
+        return self.level >= SKIP_VOICE
+
+    @property
+    def reject_media(self) -> bool:
+        return self.level >= REJECT_MEDIA
+
+    def adjust_request(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        """Apply the token cap and model downgrade of the current mode to a generation request"""
+        if self.level >= REDUCE_TOKENS:
+            limit = self.settings["reduced_max_tokens"]
+            request["max_tokens"] = min(int(request.get("max_tokens") or limit), limit)
+        if self.level >= FAST_MODEL:
+            fast_version = self.settings["fast_versions"].get(request.get("model_version"))
+            if fast_version:
+                metrics.inc("degraded_requests_total", source=request["model_version"], target=fast_version)
+                request["model_version"] = fast_version
+        return request
+
+    async def run(self) -> None:
+        """Sample pressure signals until cancelled"""
+        loop = asyncio.get_running_loop()
+        interval = self.settings["check_interval"]
+        while True:
+            started = loop.time()
+            await asyncio.sleep(interval)
+            lag = max(0.0, loop.time() - started - interval)
+            self.loop_lag = 0.7 * self.loop_lag + 0.3 * lag
+            if self.enabled:
+                self.evaluate(self.loop_lag, self.queue_depth())
+
+    def evaluate(self, loop_lag: float, queue_depth: int) -> None:
+        """Move at most one mode up or down for the given readings"""
+        metrics.set_gauge("event_loop_lag_seconds", loop_lag)
+        settings = self.settings
+        now = time.monotonic()
+
+        if loop_lag > settings["loop_lag_high"] or queue_depth > settings["queue_depth_high"]:
+            self._calm_since = None
+            if self.level < REJECT_MEDIA and now - self._changed_at >= settings["step_up_seconds"]:
+                self._transition(self.level + 1, f"lag={loop_lag * 1000:.0f}ms queue={queue_depth}")
+        elif loop_lag < settings["loop_lag_low"] and queue_depth < settings["queue_depth_low"]:
+            if self._calm_since is None:
+                self._calm_since = now
+            if self.level > NORMAL and now - self._calm_since >= settings["recover_seconds"]:
+                self._transition(self.level - 1, "recovered")
+                # Each further step down needs another calm period
+                self._calm_since = now
+        else:
+            self._calm_since = None
+
+    def _transition(self, level: int, reason: str) -> None:
+        previous, self.level = self.level, level
+        self._changed_at = time.monotonic()
+        log = logger.warning if level > previous else logger.info
+        log(f"Degradation mode {MODES[previous]} -> {MODES[level]} ({reason})")
+        metrics.inc("degradation_transitions_total", source=MODES[previous], target=MODES[level])
+        metrics.set_gauge("degradation_level", level)
+        for listener in self.listeners:
+            try:
+                listener(previous, level)
+            except Exception as e:
+                logger.error(f"Error in degradation listener: {str(e)}")
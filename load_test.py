@@ -0,0 +1,422 @@
+# load_test.py
+"""Drive AIBot with simulated users against the mock provider and report latency.
+
+    python load_test.py --users 50 --messages 5 --model gemini --version gemini-1.5-flash-002
+    python load_test.py --replay traces/updates.jsonl.gz --speed 10
+
+Telegram is replaced by fake_telegram.FakeClient and the model APIs by
+mock_provider.MockProviderServer, so no network access or API quota is used.
+"""
+from collections import defaultdict
+from pathlib import Path
+from typing import Optional, Dict, Any, List
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+from config import MOCK_PROVIDER
+from fake_telegram import FakeClient, FakeUser, FakeMedia, DEFAULT_WORKERS
+from metrics import Histogram
+from mock_provider import MockProviderServer
+from update_trace import TraceEvent, load_trace, MEDIA_KINDS
+
+logger = logging.getLogger(__name__)
+
+_PROMPTS = [
+    "Explain how a hash map works",
+    "Write a short poem about the sea",
+    "What are the pros and cons of microservices?",
+    "Summarize the causes of the French Revolution",
+    "How do I reverse a linked list in Python?",
+    "Give me three ideas for a birthday party",
+    "What is the difference between TCP and UDP?",
+    "Translate 'good morning' into Spanish and French"
+]
+
+
+class FakeTTS:
+    """Writes a placeholder audio file instead of calling the TTS service"""
+
+    def __init__(self, output_dir: str, latency: float = 0.0):
+        self.output_dir = Path(output_dir)
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.latency = latency
+        self._ids = itertools.count(1)
+
+    def text_to_speech(self, text: str, lang_code: str) -> bool:
+        if self.latency:
+            time.sleep(self.latency)  # The real client is synchronous and blocks the loop too
+        path = self.output_dir / f"tts_{lang_code}_{next(self._ids)}.mp3"
+        path.write_bytes(b"ID3")
+        return True
+
+
+class LoopLagMonitor:
+    """Measure how late the event loop wakes up from short sleeps"""
+
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.lag = Histogram(window=100000)
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            self.lag.observe(max(0.0, loop.time() - start - self.interval))
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+
+def _memory_mb() -> Dict[str, Optional[float]]:
+    """Current and peak resident set size of this process"""
+    current = peak = None
+    try:
+        with open("/proc/self/statm") as f:
+            current = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, ValueError):
+        pass
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # KiB on Linux
+    except ImportError:
+        pass
+    return {"rss_mb": current, "peak_rss_mb": peak}
+
+
+class LoadTest:
+    """N simulated users chatting with one AIBot through FakeClient"""
+
+    def __init__(
+        self,
+        workdir: str,
+        model: str = "gemini",
+        version: str = "gemini-1.5-flash-002",
+        workers: int = DEFAULT_WORKERS,
+        api_latency: float = 0.0,
+        flood_limit_per_chat: Optional[int] = None,
+        tts_latency: float = 0.0,
+        mock_settings: Optional[Dict[str, Any]] = None
+    ):
+        self.workdir = workdir
+        self.model = model
+        self.version = version
+        self.server = MockProviderServer(**{**MOCK_PROVIDER, "port": 0, **(mock_settings or {})})
+        self.client = FakeClient(workers, api_latency, flood_limit_per_chat)
+        self.client.observers.append(self._observe)
+        self.tts_latency = tts_latency
+        self.bot = None
+        self._degradation_task: Optional[asyncio.Task] = None
+        self.lag_monitor = LoopLagMonitor()
+        self.latency = Histogram(window=100000)
+        self.latency_by_kind: Dict[str, Histogram] = defaultdict(lambda: Histogram(window=100000))
+        self.first_edit_latency = Histogram(window=100000)
+        self._awaiting_first_edit: Dict[int, float] = {}
+        self._edits_per_chat_second: Dict[tuple, int] = defaultdict(int)
+        self._started = 0.0
+        self._finished = 0.0
+
+    def _observe(self, method: str, chat_id: int) -> None:
+        if method not in ("edit_message_text", "edit_message_reply_markup"):
+            return
+        now = time.monotonic()
+        self._edits_per_chat_second[(chat_id, int(now))] += 1
+        sent_at = self._awaiting_first_edit.pop(chat_id, None)
+        if sent_at is not None:
+            self.first_edit_latency.observe(now - sent_at)
+
+    async def setup(self) -> None:
+        # Imported here so the bot picks up a fully configured environment
+        from bot_handler import AIBot
+        from model_manager import ModelManager
+
+        # In a thread because GeminiHandler reads its stream synchronously
+        self.server.start_in_thread()
+        model_manager = ModelManager(
+            "mock-gemini-key", "mock-claude-key", "mock-deepseek-key",
+            base_urls=self.server.base_urls()
+        )
+        self.bot = AIBot(
+            client=self.client,
+            db_path=os.path.join(self.workdir, "load_test.db"),
+            model_manager=model_manager
+        )
+        self.bot.tts_handler = FakeTTS(os.path.join(self.workdir, "tts"), self.tts_latency)
+        self._degradation_task = asyncio.create_task(self.bot.degradation.run())
+        await self.client.start()
+
+    async def teardown(self) -> None:
+        if self.bot is not None:
+            if self._degradation_task is not None:
+                self._degradation_task.cancel()
+                await asyncio.gather(self._degradation_task, return_exceptions=True)
+            await self.bot.outbound.close()
+        await self.client.stop()
+        self.server.stop_thread()
+        if self.bot is not None and self.bot.trace_recorder:
+            self.bot.trace_recorder.close()
+
+    async def send(self, update) -> float:
+        """Deliver an update and wait until the bot has finished handling it"""
+        start = time.monotonic()
+        await self.client.feed(update)
+        # Generations run as tasks of their own; wait for the answer as well
+        task = self.bot.generations.task_of(update.from_user.id)
+        if task is not None:
+            await asyncio.gather(task, return_exceptions=True)
+        return time.monotonic() - start
+
+    async def onboard(self, user: FakeUser) -> None:
+        """/start, pick the model and version, then open a new chat"""
+        await self.send(self.client.new_message(user, text="/start"))
+        menu = self.client.last_sent[user.id]
+        for data in (
+            f"select_model:{self.model}",
+            f"select_version:{self.model}:{self.version}",
+            "new_chat"
+        ):
+            await self.send(self.client.new_callback_query(user, menu, data))
+
+    async def send_text(self, user: FakeUser, text: str) -> None:
+        """Send a prompt and record response and first-edit latency"""
+        message = self.client.new_message(user, text=text)
+        self._awaiting_first_edit[user.id] = time.monotonic()
+        elapsed = await self.send(message)
+        self._awaiting_first_edit.pop(user.id, None)
+        self.latency.observe(elapsed)
+        self.latency_by_kind["text"].observe(elapsed)
+
+    async def simulate_user(self, index: int, messages: int, think_time: float, ramp_up: float, unique_prompts: bool) -> None:
+        user = FakeUser(100000 + index, f"User {index}")
+        await asyncio.sleep(random.uniform(0, ramp_up))
+        await self.onboard(user)
+        for i in range(messages):
+            prompt = random.choice(_PROMPTS)
+            if unique_prompts:
+                prompt += f" (user {index}, message {i})"  # Defeat the response caches
+            await self.send_text(user, prompt)
+            if think_time:
+                await asyncio.sleep(random.uniform(0.5, 1.5) * think_time)
+
+    async def run(
+        self,
+        users: int,
+        messages: int,
+        think_time: float = 1.0,
+        ramp_up: float = 1.0,
+        unique_prompts: bool = True
+    ) -> Dict[str, Any]:
+        await self.setup()
+        self.lag_monitor.start()
+        self._started = time.monotonic()
+        try:
+            await asyncio.gather(*[
+                self.simulate_user(index, messages, think_time, ramp_up, unique_prompts)
+                for index in range(users)
+            ])
+        finally:
+            self._finished = time.monotonic()
+            await self.lag_monitor.stop()
+            await self.teardown()
+        return self.report(users, users * messages)
+
+    def _synthetic_text(self, length: int) -> str:
+        words = " ".join(_PROMPTS)
+        return (words * (length // len(words) + 1))[:max(length, 1)]
+
+    def _build_update(self, user: FakeUser, event: TraceEvent):
+        """Turn a trace record into an update for `user` in the bot's current state"""
+        if event.kind == "command":
+            return self.client.new_message(user, text=f"/{event.extra or 'start'}")
+        if event.kind == "text":
+            return self.client.new_message(user, text=self._synthetic_text(event.size))
+        if event.kind in MEDIA_KINDS:
+            extension = event.extra or {"photo": ".jpg", "video": ".mp4", "voice": ".ogg"}.get(event.kind, "")
+            media = FakeMedia(event.size, file_name=f"{event.kind}{extension}")
+            return self.client.new_message(user, **{event.kind: media})
+        if event.kind == "callback" and event.extra:
+            message = self.client.last_sent.get(user.id)
+            if message is None:
+                return None
+            # Fill anonymized ids from the replaying bot's own state
+            if event.extra.startswith("regenerate:"):
+                value = message.id
+            else:
+                value = self.bot.active_chats.get(user.id, 0)
+            return self.client.new_callback_query(user, message, event.extra.replace("#", str(value)))
+        return None
+
+    async def _replay_event(self, user: FakeUser, event: TraceEvent) -> None:
+        update = self._build_update(user, event)
+        if update is None:
+            return
+        if event.kind == "text":
+            self._awaiting_first_edit[user.id] = time.monotonic()
+        elapsed = await self.send(update)
+        self._awaiting_first_edit.pop(user.id, None)
+        self.latency.observe(elapsed)
+        self.latency_by_kind[event.kind].observe(elapsed)
+
+    async def replay(self, events: List[TraceEvent], speed: float = 1.0) -> Dict[str, Any]:
+        """Feed a recorded trace to the bot, `speed` times faster than it was recorded"""
+        await self.setup()
+        users = {index: FakeUser(200000 + index, f"Traced {index}") for index in {e.user for e in events}}
+        # Traced users may have set up their chats before the recording started
+        await asyncio.gather(*[self.onboard(user) for user in users.values()])
+
+        self.lag_monitor.start()
+        self._started = time.monotonic()
+        tasks = []
+        try:
+            for event in events:
+                delay = self._started + event.t / speed - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                tasks.append(asyncio.create_task(self._replay_event(users[event.user], event)))
+            await asyncio.gather(*tasks)
+        finally:
+            self._finished = time.monotonic()
+            await self.lag_monitor.stop()
+            await self.teardown()
+        return self.report(len(users), len(events))
+
+    def report(self, users: int, messages: int) -> Dict[str, Any]:
+        duration = max(self._finished - self._started, 1e-9)
+        counters = dict(self.client.counters)
+        report = {
+            "users": users,
+            "messages": messages,
+            "duration_seconds": duration,
+            "messages_per_second": self.latency.count / duration,
+            "response_latency": self.latency.summary(),
+            "response_latency_by_kind": {
+                kind: histogram.summary() for kind, histogram in self.latency_by_kind.items()
+            },
+            "first_edit_latency": self.first_edit_latency.summary(),
+            "edits": self.client.edits,
+            "edits_per_second": self.client.edits / duration,
+            "max_edits_per_chat_second": max(self._edits_per_chat_second.values(), default=0),
+            "event_loop_lag": self.lag_monitor.lag.summary(),
+            "memory": _memory_mb(),
+            "telegram_calls": counters,
+            "outbound": dict(self.bot.outbound.stats),
+            "degradation_mode": self.bot.degradation.mode,
+            "provider": dict(self.server.stats)
+        }
+        if tracemalloc.is_tracing():
+            report["memory"]["traced_peak_mb"] = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        return report
+
+
+def format_report(report: Dict[str, Any]) -> str:
+    def seconds(summary: Dict[str, Any]) -> str:
+        values = {key: summary[key] for key in ("p50", "p99", "max")}
+        return "  ".join(
+            f"{key}={value * 1000:.0f}ms" if value is not None else f"{key}=-"
+            for key, value in values.items()
+        )
+
+    memory = report["memory"]
+    lines = [
+        f"Users: {report['users']}  messages: {report['messages']}  "
+        f"duration: {report['duration_seconds']:.1f}s  ({report['messages_per_second']:.2f} msg/s)",
+        f"Response latency:   {seconds(report['response_latency'])}",
+        *[
+            f"  {kind:<16}  {seconds(summary)}"
+            for kind, summary in sorted(report["response_latency_by_kind"].items())
+        ],
+        f"First edit latency: {seconds(report['first_edit_latency'])}",
+        f"Edits: {report['edits']}  ({report['edits_per_second']:.1f}/s, "
+        f"max {report['max_edits_per_chat_second']}/s in one chat)",
+        f"Event loop lag:     {seconds(report['event_loop_lag'])}",
+        "Memory: " + "  ".join(f"{key}={value:.1f}" for key, value in memory.items() if value is not None),
+        f"Telegram calls: {json.dumps(report['telegram_calls'], sort_keys=True)}",
+        f"Outbound queue: {json.dumps(report['outbound'], sort_keys=True)}",
+        f"Degradation mode at end: {report['degradation_mode']}",
+        f"Provider: {json.dumps(report['provider'], sort_keys=True)}"
+    ]
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test AIBot with simulated users")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--messages", type=int, default=3, help="Prompts per user")
+    parser.add_argument("--model", default="gemini")
+    parser.add_argument("--version", default="gemini-1.5-flash-002")
+    parser.add_argument("--think-time", type=float, default=1.0, help="Mean pause between prompts")
+    parser.add_argument("--ramp-up", type=float, default=2.0, help="Spread user arrivals over this many seconds")
+    parser.add_argument("--repeat-prompts", action="store_true", help="Allow cache hits across users")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="Update workers, as in Pyrogram")
+    parser.add_argument("--api-latency", type=float, default=0.03, help="Simulated Telegram API latency")
+    parser.add_argument("--flood-limit", type=int, default=None, help="Outbound calls per chat per second")
+    parser.add_argument("--tts-latency", type=float, default=0.0)
+    parser.add_argument("--ttft", type=float, default=MOCK_PROVIDER["ttft_seconds"])
+    parser.add_argument("--tokens-per-second", type=float, default=MOCK_PROVIDER["tokens_per_second"])
+    parser.add_argument("--response-tokens", type=int, default=MOCK_PROVIDER["response_tokens"])
+    parser.add_argument("--rate-limit-rate", type=float, default=MOCK_PROVIDER["rate_limit_rate"])
+    parser.add_argument("--overload-rate", type=float, default=MOCK_PROVIDER["overload_rate"])
+    parser.add_argument("--stall-rate", type=float, default=MOCK_PROVIDER["stall_rate"])
+    parser.add_argument("--replay", default=None, help="Replay an update trace instead of synthetic users")
+    parser.add_argument("--speed", type=float, default=1.0, help="Replay speed-up factor")
+    parser.add_argument("--tracemalloc", action="store_true", help="Also report traced Python heap peak")
+    parser.add_argument("--workdir", default=None, help="Directory for the database and temp files")
+    parser.add_argument("--json", dest="json_path", default=None, help="Write the report to this file")
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args()
+
+    json_path = os.path.abspath(args.json_path) if args.json_path else None
+    trace = load_trace(args.replay) if args.replay else None
+    workdir = args.workdir or tempfile.mkdtemp(prefix="ai_bot_load_")
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)  # The bot writes temp/ and downloads relative to the working directory
+    logging.basicConfig(level=args.log_level)
+    if args.tracemalloc:
+        tracemalloc.start()
+
+    load_test = LoadTest(
+        workdir,
+        model=args.model,
+        version=args.version,
+        workers=args.workers,
+        api_latency=args.api_latency,
+        flood_limit_per_chat=args.flood_limit,
+        tts_latency=args.tts_latency,
+        mock_settings={
+            "ttft_seconds": args.ttft,
+            "tokens_per_second": args.tokens_per_second,
+            "response_tokens": args.response_tokens,
+            "rate_limit_rate": args.rate_limit_rate,
+            "overload_rate": args.overload_rate,
+            "stall_rate": args.stall_rate
+        }
+    )
+    if trace is not None:
+        report = asyncio.run(load_test.replay(trace, args.speed))
+    else:
+        report = asyncio.run(load_test.run(
+            args.users, args.messages, args.think_time, args.ramp_up, not args.repeat_prompts
+        ))
+    print(format_report(report))
+    if json_path:
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    logger.info(f"Work directory: {workdir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,9 @@
 # main.py
 import logging
-from bot_handler import AIBot
 import os
 import sqlite3
+import sys
+import time
 
 
 # Configure logging
@@ -26,7 +27,24 @@ def init_database(db_path: str):
         logger.error(f"Error initializing database: {str(e)}")
         return False
 
+def profile_startup():
+    """Print an import-time breakdown of bot startup without connecting to Telegram"""
+    from startup_profiler import StartupProfiler
+
+    with StartupProfiler() as profiler:
+        start = time.perf_counter()
+        from bot_handler import AIBot
+        profiler.phase("import bot_handler", start)
+
+        start = time.perf_counter()
+        AIBot()
+        profiler.phase("construct AIBot", start)
+
+    print(profiler.report())
+
 def main():
+    from bot_handler import AIBot
+
     try:
         # Initialize database
         db_path = "ai_chat.db"
@@ -45,4 +63,7 @@ def main():
         raise
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    if "--profile-startup" in sys.argv:
+        profile_startup()
+    else:
+        main()
\ No newline at end of file
@@ -0,0 +1,232 @@
+# message_renderer.py
+"""Incremental rendering of streamed answers into Telegram HTML chunks.
+
+The renderer is fed only the new part of the answer on every update. Complete
+lines are rendered once and appended to the current chunk, carrying open tag
+and code block state from line to line; a chunk that reaches the length limit
+is closed and frozen. Only the trailing partial line and the still-growing last
+chunk are rebuilt on each render, so the cost per update is bounded by the
+chunk size rather than by the length of the answer.
+"""
+from typing import Optional, List, Tuple
+import html
+import re
+
+# Tags Telegram accepts in HTML parse mode; anything else is shown as text
+TELEGRAM_TAGS = {
+    "b", "strong", "i", "em", "u", "ins", "s", "strike", "del",
+    "code", "pre", "a", "span", "tg-spoiler", "blockquote"
+}
+# Tags whose attributes carry meaning (href, language, spoiler class)
+_ATTRIBUTE_TAGS = {"a", "code", "pre", "span", "blockquote"}
+# Deeper nesting is escaped, so reopened tags always fit in a chunk
+MAX_TAG_DEPTH = 8
+
+TYPE_INDICATORS = {
+    "image": "🖼️",
+    "video": "🎥",
+    "audio": "🎵",
+    "document": "📄"
+}
+
+_TAG = re.compile(r'<(/?)([a-zA-Z][a-zA-Z0-9-]*)([^<>]*)>')
+_INLINE_CODE = re.compile(r'`([^`]+)`')
+_FENCE_LANG = re.compile(r'\w+')
+_BULLETS = ('• ', '* ', '- ')
+
+# Open tags as (name, opening tag) pairs, and the open code block's language
+_State = Tuple[Tuple[Tuple[str, str], ...], Optional[str]]
+_EMPTY_STATE: _State = ((), None)
+
+
+def _opening(state: _State) -> str:
+    tags, code_lang = state
+    if code_lang is not None:
+        return f'<pre><code class="language-{code_lang}">'
+    return "".join(tag for _, tag in tags)
+
+
+def _closing(state: _State) -> str:
+    tags, code_lang = state
+    if code_lang is not None:
+        return "</code></pre>"
+    return "".join(f"</{name}>" for name, _ in reversed(tags))
+
+
+def _render_tags(text: str, tags: List[Tuple[str, str]]) -> str:
+    """Escape text and pass through balanced Telegram tags, updating `tags`"""
+    result = []
+    position = 0
+    for match in _TAG.finditer(text):
+        result.append(html.escape(text[position:match.start()], quote=False))
+        position = match.end()
+        closing, name = match.group(1), match.group(2).lower()
+        if name not in TELEGRAM_TAGS or (not closing and len(tags) >= MAX_TAG_DEPTH):
+            result.append(html.escape(match.group(0), quote=False))
+        elif closing:
+            if tags and tags[-1][0] == name:
+                tags.pop()
+                result.append(f"</{name}>")
+            else:
+                # Invalid closing tag - escape it
+                result.append(html.escape(match.group(0), quote=False))
+        else:
+            tag = match.group(0) if name in _ATTRIBUTE_TAGS else f"<{name}>"
+            tags.append((name, tag))
+            result.append(tag)
+    result.append(html.escape(text[position:], quote=False))
+    return "".join(result)
+
+
+def _render_text(text: str, tags: List[Tuple[str, str]]) -> str:
+    """Render prose: inline code spans are escaped, the rest goes through tag validation"""
+    result = []
+    position = 0
+    for match in _INLINE_CODE.finditer(text):
+        result.append(_render_tags(text[position:match.start()], tags))
+        result.append(f"<code>{html.escape(match.group(1), quote=False)}</code>")
+        position = match.end()
+    result.append(_render_tags(text[position:], tags))
+    return "".join(result)
+
+
+class StreamingRenderer:
+    """Render a growing answer into Telegram-sized HTML chunks, one delta at a time"""
+
+    def __init__(self, max_length: int = 4096, content_type: str = "text", piece_length: Optional[int] = None):
+        self.max_length = max_length
+        self.content_type = content_type
+        # Lines longer than this are rendered in pieces so one line never outgrows a chunk,
+        # even when escaping grows it five-fold
+        self.piece_length = piece_length or max_length // 8
+        self.source_length = 0
+        self.chunks: List[str] = []  # Frozen chunks; never rendered again
+        self._tail_check = ""  # Last consumed characters, to detect a rewritten source
+        self._partial = ""  # Raw text after the last committed piece
+        self._continues_line = False  # Whether _partial continues a line already partly committed
+        self._segments: List[str] = []  # Rendered pieces of the current chunk
+        self._length = 0
+        self._has_content = False
+        self._state: _State = _EMPTY_STATE
+        self._frozen_at_render = 0
+        self.stable_chunks = 0  # Leading chunks unchanged since the previous render()
+
+        indicator = TYPE_INDICATORS.get(content_type, "") if content_type != "text" else ""
+        self._indicator = f"{indicator} " if indicator else ""
+
+    def accepts(self, text: str) -> bool:
+        """Whether `text` extends what has been consumed so far"""
+        if len(text) < self.source_length:
+            return False
+        return text.startswith(self._tail_check, self.source_length - len(self._tail_check))
+
+    def feed(self, delta: str) -> None:
+        """Consume the next part of the answer"""
+        if not delta:
+            return
+        self.source_length += len(delta)
+        self._tail_check = (self._tail_check + delta)[-64:]
+
+        *lines, partial = (self._partial + delta).split("\n")
+        for line in lines:
+            self._commit(self._commit_pieces(line), line_end=True)
+        # Keep the uncommitted tail short even when a line never ends
+        self._partial = self._commit_pieces(partial)
+
+    def _commit_pieces(self, text: str) -> str:
+        """Commit leading pieces of an over-long line, cut at a space where possible"""
+        while len(text) > self.piece_length:
+            cut = text.rfind(" ", 0, self.piece_length) + 1 or self.piece_length
+            self._commit(text[:cut], line_end=False)
+            text = text[cut:]
+        return text
+
+    def _render_piece(self, raw: str, state: _State, starts_line: bool, line_end: bool) -> Tuple[str, _State, bool]:
+        """Render one line or line piece; returns (html, new state, joins previous piece)"""
+        tags, code_lang = state
+        stripped = raw.strip() if starts_line else ""
+
+        if starts_line and stripped.startswith("```"):
+            if code_lang is not None:
+                # The fence closes the block right after its last line
+                return "</code></pre>", (tags, None), True
+            lang = stripped[3:].strip()
+            lang = lang if _FENCE_LANG.fullmatch(lang) else "text"
+            # Code blocks can't nest inside inline tags, so those are closed first
+            return _closing(state) + f'<pre><code class="language-{lang}">', ((), lang), False
+
+        if code_lang is not None:
+            rendered = html.escape(raw.rstrip("\r"), quote=False)
+            # The first line of a block follows its opening tag directly
+            joins = not starts_line
+            if starts_line and self._segments and self._segments[-1].endswith(f'class="language-{code_lang}">'):
+                joins = True
+            return rendered, state, joins
+
+        text = raw
+        if starts_line:
+            text = text.lstrip()
+            if text.startswith(_BULLETS):
+                text = f"• {text[2:].lstrip()}"
+        if line_end:
+            text = text.rstrip()
+        open_tags = list(tags)
+        rendered = _render_text(text, open_tags)
+        return rendered, (tuple(open_tags), code_lang), not starts_line
+
+    def _commit(self, raw: str, line_end: bool) -> None:
+        starts_line = not self._continues_line
+        self._continues_line = not line_end
+
+        rendered, state, joins = self._render_piece(raw, self._state, starts_line, line_end)
+        if self._indicator and not self.chunks and not self._has_content:
+            rendered = self._indicator + rendered
+
+        separator = "" if joins or not self._has_content else "\n"
+        projected = self._length + len(separator) + len(rendered) + len(_closing(state))
+        if projected > self.max_length and self._has_content:
+            self._freeze()
+            separator = ""
+
+        self._segments.append(separator + rendered)
+        self._length += len(separator) + len(rendered)
+        self._has_content = True
+        self._state = state
+
+    def _freeze(self) -> None:
+        """Close the current chunk and start the next one with the open tags reopened"""
+        self.chunks.append("".join(self._segments) + _closing(self._state))
+        opening = _opening(self._state)
+        self._segments = [opening] if opening else []
+        self._length = len(opening)
+        self._has_content = False
+
+    def _render_tail(self) -> Tuple[str, _State]:
+        """The uncommitted partial line as it would be appended to the current chunk"""
+        if not self._partial:
+            return "", self._state
+        tail, state, joins = self._render_piece(
+            self._partial, self._state, not self._continues_line, line_end=True
+        )
+        if self._indicator and not self.chunks and not self._has_content:
+            tail = self._indicator + tail
+        if tail and self._has_content and not joins:
+            tail = "\n" + tail
+        return tail, state
+
+    def render(self) -> List[str]:
+        """All chunks for the text consumed so far; only the last one is rebuilt"""
+        tail, state = self._render_tail()
+        if self._has_content and self._length + len(tail) + len(_closing(state)) > self.max_length:
+            # Freeze now rather than show a chunk that a later commit might take back
+            self._freeze()
+            tail, state = self._render_tail()
+
+        self.stable_chunks = self._frozen_at_render
+        self._frozen_at_render = len(self.chunks)
+        return self.chunks + ["".join(self._segments) + tail + _closing(state)]
+
+    def render_all(self, text: str) -> List[str]:
+        """Render a complete text in one go"""
+        self.feed(text)
+        return self.render()
@@ -0,0 +1,385 @@
+# mock_provider.py
+"""Local mock of the Gemini, Anthropic and DeepSeek/OpenAI streaming APIs.
+
+Run `python mock_provider.py --tokens-per-second 80 --rate-limit-rate 0.05` and
+point the handlers at it with GEMINI_BASE_URL, CLAUDE_BASE_URL and
+DEEPSEEK_BASE_URL (see `MockProviderServer.base_urls`).
+"""
+from typing import Optional, Dict, Any, List, Tuple
+import argparse
+import asyncio
+import json
+import logging
+import random
+import threading
+import time
+
+from aiohttp import web
+
+from config import MOCK_PROVIDER
+
+logger = logging.getLogger(__name__)
+
+_WORDS = (
+    "the model streams tokens to the client while the bot edits its message "
+    "every request carries a prompt and a history that the provider turns into "
+    "an answer with code lists and short paragraphs for the user to read"
+).split()
+
+# Per-provider error payloads: (status, body) for rate limit and overload faults
+_ERRORS = {
+    "gemini": {
+        "rate_limit": (429, {"error": {
+            "code": 429, "message": "Resource has been exhausted (e.g. check quota).",
+            "status": "RESOURCE_EXHAUSTED"
+        }}),
+        "overload": (503, {"error": {
+            "code": 503, "message": "The model is overloaded. Please try again later.",
+            "status": "UNAVAILABLE"
+        }})
+    },
+    "claude": {
+        "rate_limit": (429, {"type": "error", "error": {
+            "type": "rate_limit_error", "message": "Number of requests has exceeded your rate limit"
+        }}),
+        "overload": (529, {"type": "error", "error": {
+            "type": "overloaded_error", "message": "Overloaded"
+        }})
+    },
+    "deepseek": {
+        "rate_limit": (429, {"error": {
+            "message": "Rate limit reached for requests", "type": "rate_limit_error",
+            "code": "rate_limit_exceeded"
+        }}),
+        "overload": (503, {"error": {
+            "message": "Service is too busy, please try again later", "type": "server_error",
+            "code": "server_busy"
+        }})
+    }
+}
+
+
+class MockProviderServer:
+    """aiohttp server that streams synthetic answers in each provider's wire format"""
+
+    def __init__(self, settings: Optional[Dict] = None, **overrides):
+        self.settings = dict(settings if settings is not None else MOCK_PROVIDER)
+        self.settings.update(overrides)
+        seed = self.settings.get("seed")
+        self.random = random.Random(int(seed) if seed not in (None, "") else None)
+        self.stats: Dict[str, int] = {}
+        self.active_streams = 0
+        self._runner: Optional[web.AppRunner] = None
+        self._thread_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._port = self.settings["port"]
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.settings['host']}:{self._port}"
+
+    def base_urls(self) -> Dict[str, str]:
+        """Base URLs in the shape of config.PROVIDER_BASE_URLS"""
+        return {
+            "gemini": self.base_url,
+            "claude": self.base_url,
+            "deepseek": f"{self.base_url}/v1"
+        }
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/v1beta/models/{model}:{method}", self._gemini)
+        app.router.add_post("/v1/messages", self._claude)
+        app.router.add_post("/v1/chat/completions", self._deepseek)
+        app.router.add_get("/_mock/stats", self._get_stats)
+        app.router.add_post("/_mock/config", self._update_config)
+        return app
+
+    async def start(self) -> str:
+        """Start serving in the current event loop and return the base URL"""
+        self._runner = web.AppRunner(self.make_app())
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.settings["host"], self.settings["port"])
+        await site.start()
+        # Port 0 asks the OS for a free port
+        self._port = self._runner.addresses[0][1]
+        logger.info(f"Mock provider listening on {self.base_url}")
+        return self.base_url
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def start_in_thread(self) -> str:
+        """Serve from a background thread so callers that block their loop can still be fed
+
+        GeminiHandler iterates the SDK stream synchronously, which would starve a
+        server sharing its event loop.
+        """
+        self._thread_loop = asyncio.new_event_loop()
+        threading.Thread(target=self._thread_loop.run_forever, name="mock-provider", daemon=True).start()
+        return asyncio.run_coroutine_threadsafe(self.start(), self._thread_loop).result()
+
+    def stop_thread(self) -> None:
+        if self._thread_loop is not None:
+            asyncio.run_coroutine_threadsafe(self.stop(), self._thread_loop).result()
+            self._thread_loop.call_soon_threadsafe(self._thread_loop.stop)
+            self._thread_loop = None
+
+    def _count(self, name: str) -> None:
+        self.stats[name] = self.stats.get(name, 0) + 1
+
+    async def _get_stats(self, request: web.Request) -> web.Response:
+        return web.json_response({**self.stats, "active_streams": self.active_streams})
+
+    async def _update_config(self, request: web.Request) -> web.Response:
+        """Change fault injection settings at runtime, e.g. mid-way through a load test"""
+        updates = await request.json()
+        unknown = set(updates) - set(self.settings)
+        if unknown:
+            return web.json_response({"error": f"Unknown settings: {sorted(unknown)}"}, status=400)
+        self.settings.update(updates)
+        return web.json_response(self.settings)
+
+    def _pick_fault(self, request: web.Request) -> Optional[str]:
+        """Choose a fault from the X-Mock-Fault header or the configured rates"""
+        forced = request.headers.get("X-Mock-Fault")
+        if forced:
+            return {"429": "rate_limit", "503": "overload", "529": "overload"}.get(forced, forced)
+        roll = self.random.random()
+        if roll < self.settings["rate_limit_rate"]:
+            return "rate_limit"
+        if roll < self.settings["rate_limit_rate"] + self.settings["overload_rate"]:
+            return "overload"
+        if self.random.random() < self.settings["stall_rate"]:
+            return "stall"
+        return None
+
+    def _error_response(self, provider: str, fault: str) -> web.Response:
+        status, body = _ERRORS[provider][fault]
+        self._count(f"{provider}_{fault}")
+        headers = {"Retry-After": f"{self.settings['retry_after']:g}"}
+        return web.json_response(body, status=status, headers=headers)
+
+    def _answer(self, max_tokens: Optional[int]) -> Tuple[List[str], bool]:
+        """Synthetic answer split into chunks, and whether it was cut at max_tokens"""
+        length = self.settings["response_tokens"]
+        truncated = bool(max_tokens) and max_tokens < length
+        if truncated:
+            length = max_tokens
+
+        tokens = []
+        for i in range(length):
+            word = self.random.choice(_WORDS)
+            if i % 12 == 11:
+                word += "." + ("\n\n" if i % 48 == 47 else "")
+            tokens.append(word if word.endswith("\n") else word + " ")
+
+        size = max(1, self.settings["chunk_tokens"])
+        return ["".join(tokens[i:i + size]) for i in range(0, len(tokens), size)], truncated
+
+    async def _pace(self, chunks: List[str], stall: bool):
+        """Yield (index, chunk) honouring time-to-first-token, token rate and stalls"""
+        stall_at = self.random.randrange(len(chunks)) if stall and chunks else -1
+        chunk_delay = self.settings["chunk_tokens"] / max(self.settings["tokens_per_second"], 1e-6)
+        await asyncio.sleep(self.settings["ttft_seconds"])
+        for index, chunk in enumerate(chunks):
+            if index:
+                await asyncio.sleep(chunk_delay)
+            if index == stall_at:
+                self._count("stalls")
+                await asyncio.sleep(self.settings["stall_seconds"])
+            yield index, chunk
+
+    async def _stream(self, request: web.Request, provider: str, content_type: str, writer) -> web.StreamResponse:
+        """Run `writer` against a prepared streaming response, tracking disconnects"""
+        response = web.StreamResponse(headers={"Content-Type": content_type, "Cache-Control": "no-cache"})
+        await response.prepare(request)
+        self.active_streams += 1
+        try:
+            await writer(response)
+            await response.write_eof()
+            self._count(f"{provider}_completed")
+        except ConnectionResetError:
+            # The client went away (cancelled or lost a hedge); nothing left to send
+            self._count(f"{provider}_disconnected")
+        except asyncio.CancelledError:
+            self._count(f"{provider}_disconnected")
+            raise
+        finally:
+            self.active_streams -= 1
+        return response
+
+    @staticmethod
+    def _input_tokens(body: Dict[str, Any]) -> int:
+        return max(1, len(json.dumps(body, ensure_ascii=False)) // 4)
+
+    async def _gemini(self, request: web.Request) -> web.StreamResponse:
+        self._count("gemini_requests")
+        body = await request.json()
+        fault = self._pick_fault(request)
+        if fault in ("rate_limit", "overload"):
+            return self._error_response("gemini", fault)
+
+        generation_config = body.get("generationConfig") or body.get("generation_config") or {}
+        max_tokens = generation_config.get("maxOutputTokens") or generation_config.get("max_output_tokens")
+        chunks, truncated = self._answer(max_tokens)
+        input_tokens = self._input_tokens(body)
+
+        def payload(index: int, text: str) -> Dict:
+            candidate = {"content": {"parts": [{"text": text}], "role": "model"}, "index": 0}
+            data = {"candidates": [candidate]}
+            if index == len(chunks) - 1:
+                candidate["finishReason"] = "MAX_TOKENS" if truncated else "STOP"
+                output_tokens = sum(len(chunk.split()) for chunk in chunks)
+                data["usageMetadata"] = {
+                    "promptTokenCount": input_tokens,
+                    "candidatesTokenCount": output_tokens,
+                    "totalTokenCount": input_tokens + output_tokens
+                }
+            return data
+
+        stall = fault == "stall"
+        if request.match_info["method"] == "generateContent":
+            text = "".join([chunk async for _, chunk in self._pace(chunks, stall)])
+            self._count("gemini_completed")
+            return web.json_response(payload(len(chunks) - 1, text))
+
+        if request.query.get("alt") == "sse":
+            async def write_sse(response):
+                async for index, chunk in self._pace(chunks, stall):
+                    await response.write(f"data: {json.dumps(payload(index, chunk))}\r\n\r\n".encode())
+            return await self._stream(request, "gemini", "text/event-stream", write_sse)
+
+        # The REST transport of google-generativeai reads a streamed JSON array
+        async def write_array(response):
+            await response.write(b"[")
+            async for index, chunk in self._pace(chunks, stall):
+                separator = ",\r\n" if index else ""
+                await response.write(f"{separator}{json.dumps(payload(index, chunk))}".encode())
+            await response.write(b"]")
+        return await self._stream(request, "gemini", "application/json", write_array)
+
+    async def _claude(self, request: web.Request) -> web.StreamResponse:
+        self._count("claude_requests")
+        body = await request.json()
+        fault = self._pick_fault(request)
+        if fault in ("rate_limit", "overload"):
+            return self._error_response("claude", fault)
+
+        chunks, truncated = self._answer(body.get("max_tokens"))
+        input_tokens = self._input_tokens(body)
+        message_id = f"msg_mock_{self.random.getrandbits(48):012x}"
+
+        def sse(event: str, data: Dict) -> bytes:
+            return f"event: {event}\ndata: {json.dumps(data)}\n\n".encode()
+
+        async def write(response):
+            await response.write(sse("message_start", {"type": "message_start", "message": {
+                "id": message_id, "type": "message", "role": "assistant", "content": [],
+                "model": body.get("model", "mock"), "stop_reason": None, "stop_sequence": None,
+                "usage": {"input_tokens": input_tokens, "output_tokens": 1}
+            }}))
+            await response.write(sse("content_block_start", {
+                "type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""}
+            }))
+            await response.write(sse("ping", {"type": "ping"}))
+            output_tokens = 0
+            async for _, chunk in self._pace(chunks, fault == "stall"):
+                output_tokens += len(chunk.split())
+                await response.write(sse("content_block_delta", {
+                    "type": "content_block_delta", "index": 0,
+                    "delta": {"type": "text_delta", "text": chunk}
+                }))
+            await response.write(sse("content_block_stop", {"type": "content_block_stop", "index": 0}))
+            await response.write(sse("message_delta", {
+                "type": "message_delta",
+                "delta": {"stop_reason": "max_tokens" if truncated else "end_turn", "stop_sequence": None},
+                "usage": {"output_tokens": output_tokens}
+            }))
+            await response.write(sse("message_stop", {"type": "message_stop"}))
+
+        return await self._stream(request, "claude", "text/event-stream", write)
+
+    async def _deepseek(self, request: web.Request) -> web.StreamResponse:
+        self._count("deepseek_requests")
+        body = await request.json()
+        fault = self._pick_fault(request)
+        if fault in ("rate_limit", "overload"):
+            return self._error_response("deepseek", fault)
+
+        chunks, truncated = self._answer(body.get("max_tokens"))
+        input_tokens = self._input_tokens(body)
+        completion_id = f"chatcmpl-mock-{self.random.getrandbits(48):012x}"
+        created = int(time.time())
+
+        def chunk_payload(delta: Dict, finish_reason: Optional[str] = None, usage: Optional[Dict] = None) -> bytes:
+            data = {
+                "id": completion_id, "object": "chat.completion.chunk", "created": created,
+                "model": body.get("model", "mock"),
+                "choices": [] if usage else [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+            }
+            if usage:
+                data["usage"] = usage
+            return f"data: {json.dumps(data)}\n\n".encode()
+
+        async def write(response):
+            output_tokens = 0
+            async for index, chunk in self._pace(chunks, fault == "stall"):
+                output_tokens += len(chunk.split())
+                delta = {"role": "assistant", "content": chunk} if index == 0 else {"content": chunk}
+                await response.write(chunk_payload(delta))
+            await response.write(chunk_payload({}, "length" if truncated else "stop"))
+            if (body.get("stream_options") or {}).get("include_usage"):
+                await response.write(chunk_payload({}, usage={
+                    "prompt_tokens": input_tokens,
+                    "completion_tokens": output_tokens,
+                    "total_tokens": input_tokens + output_tokens
+                }))
+            await response.write(b"data: [DONE]\n\n")
+
+        return await self._stream(request, "deepseek", "text/event-stream", write)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock LLM provider server for load testing")
+    parser.add_argument("--host", default=MOCK_PROVIDER["host"])
+    parser.add_argument("--port", type=int, default=MOCK_PROVIDER["port"])
+    parser.add_argument("--ttft", type=float, default=MOCK_PROVIDER["ttft_seconds"],
+                        help="Seconds before the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=MOCK_PROVIDER["tokens_per_second"])
+    parser.add_argument("--response-tokens", type=int, default=MOCK_PROVIDER["response_tokens"])
+    parser.add_argument("--chunk-tokens", type=int, default=MOCK_PROVIDER["chunk_tokens"])
+    parser.add_argument("--rate-limit-rate", type=float, default=MOCK_PROVIDER["rate_limit_rate"],
+                        help="Fraction of requests answered with 429")
+    parser.add_argument("--overload-rate", type=float, default=MOCK_PROVIDER["overload_rate"],
+                        help="Fraction of requests answered with 503 (529 for Anthropic)")
+    parser.add_argument("--retry-after", type=float, default=MOCK_PROVIDER["retry_after"])
+    parser.add_argument("--stall-rate", type=float, default=MOCK_PROVIDER["stall_rate"],
+                        help="Fraction of streams that pause mid-way")
+    parser.add_argument("--stall-seconds", type=float, default=MOCK_PROVIDER["stall_seconds"])
+    parser.add_argument("--seed", default=MOCK_PROVIDER["seed"])
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    server = MockProviderServer(
+        host=args.host,
+        port=args.port,
+        ttft_seconds=args.ttft,
+        tokens_per_second=args.tokens_per_second,
+        response_tokens=args.response_tokens,
+        chunk_tokens=args.chunk_tokens,
+        rate_limit_rate=args.rate_limit_rate,
+        overload_rate=args.overload_rate,
+        retry_after=args.retry_after,
+        stall_rate=args.stall_rate,
+        stall_seconds=args.stall_seconds,
+        seed=args.seed
+    )
+    for provider, url in server.base_urls().items():
+        print(f"{provider.upper()}_BASE_URL={url}")
+    web.run_app(server.make_app(), host=args.host, port=args.port, print=None)
+
+
+if __name__ == "__main__":
+    main()
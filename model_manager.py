@@ -1,22 +1,98 @@
 # model_manager.py
-from typing import Optional, Dict, Any, AsyncGenerator
-from handlers.gemini_handler import GeminiHandler
-from handlers.claude_handler import ClaudeHandler
-from handlers.deepseek_handler import DeepSeekHandler
+from typing import Optional, Dict, Any, AsyncGenerator, List, Tuple, Union
+from handlers.stream_events import EventStream, StreamEvent, StreamStats
 from config import MODELS
+import asyncio
+import contextlib
+import importlib
 import logging
-from config import DEFAULT_PARAMS
+import threading
+import time
+from config import DEFAULT_PARAMS, FAILOVER_POLICY, REQUEST_COALESCING_ENABLED
+from rate_limiter import ProviderLimiter
+from circuit_breaker import CircuitBreakerRegistry
+from retry_policy import RetryPolicy
+from response_cache import ResponseCache, CachedResponse, request_digest
+from semantic_cache import SemanticCache
+from single_flight import SingleFlight
+from generation_registry import CancellationToken, CancellableWait
+from metrics import metrics
 
 logger = logging.getLogger(__name__)
 
+_STREAM_DONE = object()
+
+# Handler modules pull in the provider SDKs, so they are imported on first use
+_HANDLER_CLASSES = {
+    "gemini": ("handlers.gemini_handler", "GeminiHandler"),
+    "claude": ("handlers.claude_handler", "ClaudeHandler"),
+    "deepseek": ("handlers.deepseek_handler", "DeepSeekHandler")
+}
+
+class LazyHandlers:
+    """Provider handlers that are constructed the first time they are requested"""
+
+    def __init__(
+        self,
+        api_keys: Dict[str, Union[str, List[str]]],
+        base_urls: Optional[Dict[str, str]] = None
+    ):
+        self._api_keys = api_keys
+        self._base_urls = base_urls or {}
+        self._handlers: Dict[str, Any] = {}
+        # warm_up() builds handlers in a worker thread while the loop may ask for them too
+        self._lock = threading.Lock()
+
+    def __contains__(self, model_name: str) -> bool:
+        return model_name in self._handlers or model_name in self._api_keys
+
+    def __getitem__(self, model_name: str):
+        handler = self._handlers.get(model_name)
+        if handler is not None:
+            return handler
+        if model_name not in self._api_keys:
+            raise KeyError(model_name)
+        with self._lock:
+            handler = self._handlers.get(model_name)
+            if handler is not None:
+                return handler
+            start = time.perf_counter()
+            module_name, class_name = _HANDLER_CLASSES[model_name]
+            handler_class = getattr(importlib.import_module(module_name), class_name)
+            handler = self._handlers[model_name] = handler_class(
+                self._api_keys[model_name], base_url=self._base_urls.get(model_name)
+            )
+            logger.info(f"Initialized {model_name} handler in {time.perf_counter() - start:.2f}s")
+        return handler
+
+    def __setitem__(self, model_name: str, handler) -> None:
+        self._handlers[model_name] = handler
+
+    def items(self):
+        """Handlers that have been initialized so far"""
+        return self._handlers.items()
+
 class ModelManager:
-    def __init__(self, gemini_api_key: str, claude_api_key: str, deepseek_api_key: str):
-        self.handlers = {
-            "gemini": GeminiHandler(gemini_api_key),
-            "claude": ClaudeHandler(claude_api_key),
-            "deepseek": DeepSeekHandler(deepseek_api_key)
-        }
+    def __init__(
+        self,
+        gemini_api_key: Union[str, List[str]],
+        claude_api_key: Union[str, List[str]],
+        deepseek_api_key: Union[str, List[str]],
+        base_urls: Optional[Dict[str, str]] = None
+    ):
+        self.handlers = LazyHandlers({
+            "gemini": gemini_api_key,
+            "claude": claude_api_key,
+            "deepseek": deepseek_api_key
+        }, base_urls)
         self._model_params = {}  # Store model parameters
+        self.limiter = ProviderLimiter()
+        self.breakers = CircuitBreakerRegistry()
+        self.retry_policy = RetryPolicy()
+        self.response_cache = ResponseCache()
+        self.single_flight = SingleFlight(REQUEST_COALESCING_ENABLED)
+        self.semantic_cache = SemanticCache()
+        self.failover_policy = FAILOVER_POLICY
 
     def get_available_models(self) -> Dict[str, list]:
         """Get all available models and their versions"""
@@ -26,6 +102,21 @@ class ModelManager:
         }
     
 
+    async def warm_up(self, model_names: Optional[List[str]] = None) -> None:
+        """Initialize handlers in a worker thread so SDK imports don't block the event loop"""
+        for model_name in model_names or list(MODELS):
+            try:
+                await asyncio.to_thread(self.handlers.__getitem__, model_name)
+            except Exception as e:
+                logger.error(f"Error initializing {model_name} handler: {str(e)}")
+
+    def get_key_usage(self) -> Dict[str, Dict]:
+        """Get per-key usage and quarantine status for every provider"""
+        return {
+            model_name: handler.key_pool.stats()
+            for model_name, handler in self.handlers.items()
+        }
+
     def get_supported_inputs(self, model_name: str) -> list:
         """Get supported input types for a model"""
         return MODELS[model_name]["supported_inputs"]
@@ -81,6 +172,14 @@ class ModelManager:
             logger.error(f"Error updating model parameters: {str(e)}", exc_info=True)
             return False
 
+    @staticmethod
+    def _estimate_input_tokens(content: str, chat_history: Optional[list] = None) -> int:
+        """Rough prompt size estimate (~4 characters per token)"""
+        characters = len(content or "")
+        for msg in chat_history or []:
+            characters += len(msg.get("content") or "")
+        return max(1, characters // 4)
+
     def get_current_params(self, model_name: str, model_version: str) -> Dict[str, Any]:
         """Get current parameters for a specific model and version"""
         key = f"{model_name}_{model_version}"
@@ -93,9 +192,16 @@ class ModelManager:
         content: str,
         content_type: str = "text",
         file_path: Optional[str] = None,
+        use_cache: bool = True,
+        cancel_token: Optional[CancellationToken] = None,
         **kwargs
-    ) -> AsyncGenerator[str, None]:
-        """Process content with specified model"""
+    ) -> AsyncGenerator[StreamEvent, None]:
+        """Process content with specified model and stream typed events
+
+        Set use_cache=False to skip cached answers and request a fresh sample.
+        When `cancel_token` fires the stream ends early and the upstream request is closed.
+        """
+        events = EventStream()
         try:
             if model_name not in self.handlers:
                 raise ValueError(f"Unknown model: {model_name}")
@@ -103,19 +209,341 @@ class ModelManager:
             if content_type not in MODELS[model_name]["supported_inputs"]:
                 raise ValueError(f"Input type {content_type} not supported by {model_name}")
 
-            handler = self.handlers[model_name]
-            async for chunk in handler.process_content(
-                content=content,
-                content_type=content_type,
-                file_path=file_path,
-                model_version=model_version,
-                **kwargs
-            ):
-                yield chunk
+            cache_key = None
+            if self.response_cache.enabled or self.single_flight.enabled:
+                digest_args = (model_name, model_version, content, content_type, file_path, kwargs)
+                if file_path:
+                    cache_key = await asyncio.to_thread(request_digest, *digest_args)
+                else:
+                    cache_key = request_digest(*digest_args)
+
+            if use_cache and cache_key and self.response_cache.enabled:
+                cached = self.response_cache.get(cache_key)
+                if cached is not None:
+                    async for event in cached.replay():
+                        yield event
+                    return
+
+            semantic = use_cache and self.semantic_cache.is_eligible(
+                content, content_type, kwargs.get("chat_history")
+            )
+            if semantic:
+                cached = self.semantic_cache.lookup(content, model_name, model_version)
+                if cached is not None:
+                    async for event in cached.replay():
+                        yield event
+                    return
+
+            request = dict(content=content, content_type=content_type, file_path=file_path, **kwargs)
+
+            def upstream(token: Optional[CancellationToken] = None):
+                return self._upstream(model_name, model_version, request, cache_key, token)
+
+            # Identical requests already in flight share one upstream stream, which
+            # one subscriber's token must not stop; it only ends that subscription
+            if use_cache and cache_key and self.single_flight.enabled:
+                source = self.single_flight.stream(cache_key, upstream, cancel_token)
+            else:
+                source = upstream(cancel_token)
+
+            started = time.monotonic()
+            collected = []
+            async for event in source:
+                if semantic:
+                    collected.append(event)
+                yield event
+
+            # A cancelled answer is incomplete and must not be reused
+            if semantic and not (cancel_token and cancel_token.cancelled):
+                response = CachedResponse.from_events(collected)
+                if response is not None:
+                    self.semantic_cache.add(
+                        content, model_name, model_version, response, time.monotonic() - started
+                    )
 
         except Exception as e:
             logger.error(f"Error processing content with {model_name}: {str(e)}")
-            yield f"Error: {str(e)}"
+            yield events.error(str(e))
+
+    async def _upstream(
+        self,
+        model_name: str,
+        model_version: str,
+        request: Dict[str, Any],
+        cache_key: Optional[str],
+        cancel_token: Optional[CancellationToken] = None
+    ) -> AsyncGenerator[StreamEvent, None]:
+        """Route a request through circuit breakers and failover, caching the result"""
+        primary = (model_name, model_version)
+        fallback = self._get_fallback(model_name, model_version, request["content_type"])
+
+        if not self.breakers.get(*primary).allow():
+            if fallback and self.breakers.get(*fallback).allow():
+                logger.warning(f"Circuit open for {model_name} ({model_version}), failing over to {fallback[1]}")
+                metrics.inc("failover_total", source=model_version, target=fallback[1], reason="circuit_open")
+                primary, fallback = fallback, None
+            else:
+                yield EventStream().error(
+                    f"{model_name} ({model_version}) circuit open",
+                    text="⚠️ This model is temporarily unavailable. Please try again shortly or switch models.",
+                    retryable=True
+                )
+                return
+
+        if fallback is None:
+            stream = self._attempt(*primary, request, cancel_token=cancel_token)
+        else:
+            stream = self._failover_stream(primary, fallback, request, cancel_token)
+
+        collected = []
+        async for event in stream:
+            if cache_key and self.response_cache.enabled:
+                collected.append(event)
+            yield event
+
+        # A cancelled answer is incomplete and must not be reused
+        if collected and not (cancel_token and cancel_token.cancelled):
+            self.response_cache.put(cache_key, collected)
+
+    def _get_fallback(self, model_name: str, model_version: str, content_type: str) -> Optional[Tuple[str, str]]:
+        """Return the configured fallback target if failover is enabled and it accepts the input"""
+        if not self.failover_policy.get("enabled"):
+            return None
+        fallback = self.failover_policy.get("fallbacks", {}).get(model_version)
+        if not fallback or tuple(fallback) == (model_name, model_version):
+            return None
+        fallback_model, _ = fallback
+        if fallback_model not in self.handlers:
+            return None
+        if content_type not in MODELS[fallback_model]["supported_inputs"]:
+            return None
+        return tuple(fallback)
+
+    async def _attempt(
+        self,
+        model_name: str,
+        model_version: str,
+        request: Dict[str, Any],
+        max_attempts: Optional[int] = None,
+        cancel_token: Optional[CancellationToken] = None
+    ) -> AsyncGenerator[StreamEvent, None]:
+        """Run one upstream request with retries, under the provider limiter, recording its health
+
+        When `cancel_token` fires, the pending wait is interrupted and the stream
+        ends without an error.
+        """
+        max_attempts = max_attempts or self.retry_policy.max_attempts
+        handler = self.handlers[model_name]
+        breaker = self.breakers.get(model_name, model_version)
+        deadline = time.monotonic() + self.retry_policy.deadline_seconds
+        stats = StreamStats()
+        waits = CancellableWait(cancel_token)
+        attempt = 0
+
+        try:
+            while True:
+                attempt += 1
+                failure: Optional[StreamEvent] = None
+                emitted = False
+                completed = False
+                try:
+                    estimated_tokens = self._estimate_input_tokens(request["content"], request.get("chat_history"))
+                    async with contextlib.AsyncExitStack() as slot:
+                        try:
+                            await waits.wait(slot.enter_async_context(self.limiter.acquire(
+                                model_name, model_version, estimated_tokens, request["content_type"]
+                            )))
+                        except TimeoutError:
+                            return  # Cancelled while queued for a slot
+                        stream = handler.process_content(
+                            model_version=model_version, cancel_token=cancel_token, **request
+                        )
+                        try:
+                            while not waits.cancelled:
+                                # The deadline covers the whole request, so a stalled stream can't outlive it
+                                try:
+                                    event = await waits.wait(stream.__anext__(), deadline - time.monotonic())
+                                except StopAsyncIteration:
+                                    break
+                                except TimeoutError:
+                                    if waits.cancelled:
+                                        break
+                                    failure = EventStream().error(
+                                        f"{model_name} ({model_version}) timed out after "
+                                        f"{self.retry_policy.deadline_seconds:.0f}s",
+                                        text="⚠️ The model took too long to answer. Please try again.",
+                                        retryable=True
+                                    )
+                                    metrics.inc("provider_timeouts_total", provider=model_name)
+                                    if emitted:
+                                        yield failure
+                                    break
+                                stats.observe(event)
+                                if event.is_error and self.retry_policy.is_retryable(
+                                    model_name, event.error, event.retryable
+                                ):
+                                    failure = event
+                                    if not emitted:
+                                        # Hold the error back; the request may still be retried
+                                        break
+                                emitted = emitted or event.is_delta
+                                yield event
+                        finally:
+                            await stream.aclose()
+                    completed = not waits.cancelled
+                finally:
+                    if failure is not None:
+                        breaker.record_failure()
+                    elif completed:
+                        breaker.record_success()
+                    else:
+                        breaker.record_cancelled()
+
+                if failure is None or emitted:
+                    break
+
+                delay = self.retry_policy.backoff(attempt, failure.retry_after)
+                if (
+                    attempt >= max_attempts
+                    or time.monotonic() + delay > deadline
+                    or not breaker.allow()
+                ):
+                    logger.error(f"Giving up on {model_name} ({model_version}) after {attempt} attempt(s): {failure.error}")
+                    yield failure
+                    break
+
+                logger.warning(
+                    f"Transient error from {model_name} ({model_version}), "
+                    f"retry {attempt}/{max_attempts - 1} in {delay:.1f}s: {failure.error}"
+                )
+                metrics.inc("provider_retries_total", provider=model_name)
+                try:
+                    await waits.wait(asyncio.sleep(delay))
+                except TimeoutError:
+                    break
+        finally:
+            waits.close()
+
+        # Charge generated tokens against the per-minute budget
+        token_bucket = self.limiter.token_bucket(model_name)
+        if token_bucket and stats.output_tokens:
+            token_bucket.charge(stats.output_tokens)
+
+        if stats.time_to_first_token is not None:
+            logger.debug(
+                f"{model_name} ({model_version}) ttft={stats.time_to_first_token:.3f}s "
+                f"rate={stats.tokens_per_second or 0:.1f} tok/s"
+            )
+
+    async def _failover_stream(
+        self,
+        primary: Tuple[str, str],
+        fallback: Tuple[str, str],
+        request: Dict[str, Any],
+        cancel_token: Optional[CancellationToken] = None
+    ) -> AsyncGenerator[StreamEvent, None]:
+        """Stream from the primary, switching to the fallback on early failure or slow first token
+
+        The primary gets a single attempt, so its first retryable error before any
+        output moves the request to the fallback at once. Only when the fallback's
+        circuit is open is the primary retried under the full retry policy.
+        """
+        queue: asyncio.Queue = asyncio.Queue()
+        tasks: Dict[Tuple[str, str], asyncio.Task] = {}
+        buffered: Dict[Tuple[str, str], List[StreamEvent]] = {}
+        errors: Dict[Tuple[str, str], StreamEvent] = {}
+        finished = set()
+
+        async def pump(target: Tuple[str, str], max_attempts: Optional[int]):
+            try:
+                async for event in self._attempt(*target, request, max_attempts, cancel_token):
+                    await queue.put((target, event))
+            finally:
+                await queue.put((target, _STREAM_DONE))
+
+        def launch(target: Tuple[str, str], reason: str, max_attempts: Optional[int] = None) -> bool:
+            if target != primary:
+                if not self.breakers.get(*target).allow():
+                    return False
+                metrics.inc("failover_total", source=primary[1], target=target[1], reason=reason)
+            buffered[target] = []
+            errors.pop(target, None)
+            finished.discard(target)
+            tasks[target] = asyncio.create_task(pump(target, max_attempts))
+            return True
+
+        def commit(target: Tuple[str, str]) -> List[StreamEvent]:
+            for other, task in tasks.items():
+                if other != target:
+                    task.cancel()
+            if target == fallback and hedged:
+                metrics.inc("hedge_wins_total", target=fallback[1])
+            return buffered.pop(target)
+
+        hedge_after = self.failover_policy.get("hedge_after_seconds")
+        hedge_deadline = time.monotonic() + hedge_after if hedge_after else None
+        launch(primary, "primary", max_attempts=1)
+        primary_retried = False
+        hedged = False
+        winner = None
+
+        try:
+            while True:
+                timeout = None
+                if winner is None and hedge_deadline is not None and fallback not in tasks:
+                    timeout = max(0.0, hedge_deadline - time.monotonic())
+                try:
+                    target, event = await asyncio.wait_for(queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    logger.info(f"No first token from {primary[1]} after {hedge_after}s, hedging to {fallback[1]}")
+                    hedged = launch(fallback, "hedge")
+                    hedge_deadline = None
+                    continue
+
+                if winner is not None:
+                    if target != winner:
+                        continue
+                    if event is _STREAM_DONE:
+                        return
+                    yield event
+                    continue
+
+                if event is _STREAM_DONE:
+                    finished.add(target)
+                    if target not in errors:
+                        # Completed without output or error; accept it as the answer
+                        winner = target
+                        for pending in commit(target):
+                            yield pending
+                        return
+                    if fallback not in tasks:
+                        if launch(fallback, "error"):
+                            continue
+                        if target == primary and not primary_retried:
+                            # Nowhere to fail over to; give the primary its usual retries
+                            primary_retried = True
+                            await asyncio.sleep(self.retry_policy.backoff(1, errors[target].retry_after))
+                            launch(primary, "primary")
+                            continue
+                        yield errors[target]
+                        return
+                    elif finished >= set(tasks):
+                        yield errors[target]
+                        return
+                    continue
+
+                if event.is_error and self.retry_policy.is_retryable(target[0], event.error, event.retryable):
+                    errors[target] = event
+                    continue
+
+                buffered[target].append(event)
+                if event.is_delta or event.is_error:
+                    winner = target
+                    for pending in commit(target):
+                        yield pending
+        finally:
+            for task in tasks.values():
+                task.cancel()
 
     def get_param_info(self, model_name: str, param: str) -> dict:
         """Get parameter info for a specific model"""
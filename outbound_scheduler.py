@@ -0,0 +1,309 @@
+# outbound_scheduler.py
+"""Central scheduling of outbound Telegram requests.
+
+OutboundScheduler.install() routes the client's send, edit and delete methods
+through per-chat queues. Every chat has its own send budget and worker, and
+all chats share a global budget that is handed out in priority order, so final
+answers and menu replies go ahead of intermediate streaming edits. An edit of
+a message that is still queued replaces the queued one instead of adding
+another request. A FloodWait pauses only the chat it was raised for; the
+request is retried once the pause is over.
+"""
+from collections import OrderedDict, defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional, Dict, List, Callable, Any
+import asyncio
+import functools
+import heapq
+import itertools
+import logging
+import time
+
+from pyrogram.errors import FloodWait
+
+logger = logging.getLogger(__name__)
+
+# Lower values are sent first
+PRIORITY_FINAL = 0
+PRIORITY_STREAMING = 1
+
+SCHEDULED_METHODS = (
+    "send_message", "edit_message_text", "edit_message_reply_markup",
+    "send_voice", "send_document", "send_photo", "delete_messages"
+)
+# Only the latest queued edit of a message needs to be sent
+SUPERSEDABLE_METHODS = ("edit_message_text", "edit_message_reply_markup")
+
+_priority: ContextVar[int] = ContextVar("outbound_priority", default=PRIORITY_FINAL)
+# Set in chat workers, whose calls must raise FloodWait instead of sleeping through it
+_in_worker: ContextVar[bool] = ContextVar("outbound_in_worker", default=False)
+
+
+@contextmanager
+def outbound_priority(priority: int):
+    """Send the requests made inside the block with `priority`"""
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class _TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def wait_time(self) -> float:
+        """Seconds until a token is available"""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1 - 1e-9:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self) -> None:
+        self.tokens -= 1
+
+
+class _Request:
+    __slots__ = ("priority", "seq", "func", "args", "kwargs", "futures", "key")
+
+    def __init__(self, priority: int, seq: int, func: Callable, args, kwargs, key):
+        self.priority = priority
+        self.seq = seq
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.futures: List[asyncio.Future] = []
+        self.key = key
+
+    def __lt__(self, other: "_Request") -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class _Chat:
+    def __init__(self, rate: float, burst: float):
+        self.queue: List[_Request] = []  # Heap ordered by priority, then arrival
+        self.pending: Dict[Any, _Request] = {}  # Queued supersedable edits by (method, message id)
+        self.bucket = _TokenBucket(rate, burst)
+        self.paused_until = 0.0
+        self.worker: Optional[asyncio.Task] = None
+
+
+class _GlobalGate:
+    """Global token bucket whose waiters are served in priority order"""
+
+    def __init__(self, rate: float, burst: float):
+        self.bucket = _TokenBucket(rate, burst)
+        self._waiters: List = []
+        self._seq = itertools.count()
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    async def acquire(self, priority: int) -> None:
+        if not self._waiters and self.bucket.wait_time() == 0:
+            self.bucket.take()
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+        self._schedule()
+        await future
+
+    def _schedule(self) -> None:
+        if self._timer is None and self._waiters:
+            self._timer = asyncio.get_running_loop().call_later(self.bucket.wait_time(), self._grant)
+
+    def _grant(self) -> None:
+        self._timer = None
+        while self._waiters and self.bucket.wait_time() == 0:
+            _, _, future = heapq.heappop(self._waiters)
+            if future.done():  # Waiter was cancelled
+                continue
+            self.bucket.take()
+            future.set_result(None)
+        self._schedule()
+
+
+class OutboundScheduler:
+    """Per-chat and global pacing of outbound Telegram requests"""
+
+    def __init__(
+        self,
+        global_per_second: float = 30.0,
+        global_burst: float = 30.0,
+        chat_per_second: float = 1.5,
+        chat_burst: float = 5.0,
+        max_flood_wait: float = 60.0,
+        max_chats: int = 10000
+    ):
+        self.chat_per_second = chat_per_second
+        self.chat_burst = chat_burst
+        self.max_flood_wait = max_flood_wait
+        self.max_chats = max_chats
+        self.flood_listeners: List[Callable[[Any, float], None]] = []
+        self.stats: Dict[str, int] = defaultdict(int)
+        self._gate = _GlobalGate(global_per_second, global_burst)
+        self._chats: Dict[Any, _Chat] = OrderedDict()
+        self._seq = itertools.count()
+
+    def install(self, client) -> None:
+        """Route the client's outbound methods through the scheduler"""
+        # FloodWaits of scheduled calls are handled here per chat instead of sleeping
+        # inside the call; every other method keeps the client's sleep_threshold
+        invoke = getattr(client, "invoke", None)
+        if invoke is not None:
+            setattr(client, "invoke", self._wrap_invoke(invoke))
+        for name in SCHEDULED_METHODS:
+            func = getattr(client, name, None)
+            if func is not None:
+                setattr(client, name, self._wrap(name, func))
+
+    @staticmethod
+    def _wrap_invoke(invoke: Callable) -> Callable:
+        @functools.wraps(invoke)
+        async def scheduled_invoke(query, *args, **kwargs):
+            if _in_worker.get() and not args:
+                kwargs.setdefault("sleep_threshold", 0)
+            return await invoke(query, *args, **kwargs)
+        return scheduled_invoke
+
+    def _wrap(self, method: str, func: Callable) -> Callable:
+        @functools.wraps(func)
+        async def scheduled(*args, **kwargs):
+            chat_id = kwargs["chat_id"] if "chat_id" in kwargs else args[0]
+            key = None
+            if method in SUPERSEDABLE_METHODS:
+                key = (method, kwargs["message_id"] if "message_id" in kwargs else args[1])
+            return await self.submit(chat_id, func, args, kwargs, key)
+        return scheduled
+
+    def _chat(self, chat_id) -> _Chat:
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            chat = self._chats[chat_id] = _Chat(self.chat_per_second, self.chat_burst)
+            if len(self._chats) > self.max_chats:
+                # Forget the least recently used idle chat
+                for old_id, old_chat in self._chats.items():
+                    idle = not old_chat.queue and (old_chat.worker is None or old_chat.worker.done())
+                    if idle and old_id != chat_id:
+                        del self._chats[old_id]
+                        break
+        else:
+            self._chats.move_to_end(chat_id)
+        return chat
+
+    async def submit(self, chat_id, func: Callable, args=(), kwargs=None, key=None):
+        """Queue a call for `chat_id` and wait for its result"""
+        chat = self._chat(chat_id)
+        future = asyncio.get_running_loop().create_future()
+        priority = _priority.get()
+        self.stats["requests"] += 1
+
+        queued = chat.pending.get(key) if key is not None else None
+        if queued is not None:
+            # The newer edit carries the latest content; every caller gets its result
+            queued.args, queued.kwargs = args, kwargs or {}
+            queued.futures.append(future)
+            if priority < queued.priority:
+                queued.priority = priority
+                heapq.heapify(chat.queue)
+            self.stats["superseded"] += 1
+        else:
+            request = _Request(priority, next(self._seq), func, args, kwargs or {}, key)
+            request.futures.append(future)
+            heapq.heappush(chat.queue, request)
+            if key is not None:
+                chat.pending[key] = request
+
+        if chat.worker is None or chat.worker.done():
+            chat.worker = asyncio.create_task(self._work(chat_id, chat))
+        return await future
+
+    async def _work(self, chat_id, chat: _Chat) -> None:
+        _in_worker.set(True)  # Local to this task's context
+        try:
+            await self._drain(chat_id, chat)
+        except asyncio.CancelledError:
+            # Don't leave callers waiting on requests that will never be sent
+            for request in chat.queue:
+                for future in request.futures:
+                    future.cancel()
+            chat.queue.clear()
+            chat.pending.clear()
+            raise
+
+    async def _drain(self, chat_id, chat: _Chat) -> None:
+        while chat.queue:
+            delay = max(chat.paused_until - time.monotonic(), chat.bucket.wait_time())
+            if delay > 0:
+                # Wait before dequeuing, so edits arriving meanwhile can still supersede
+                await asyncio.sleep(delay)
+                continue
+
+            request = heapq.heappop(chat.queue)
+            if request.key is not None:
+                chat.pending.pop(request.key, None)
+            if all(future.done() for future in request.futures):
+                # Every caller gave up, e.g. a cancelled stream
+                self.stats["dropped"] += 1
+                continue
+
+            await self._gate.acquire(request.priority)
+            chat.bucket.take()
+            self.stats["calls"] += 1
+            try:
+                result = await request.func(*request.args, **request.kwargs)
+            except asyncio.CancelledError:
+                for future in request.futures:
+                    future.cancel()
+                raise
+            except FloodWait as e:
+                self._pause(chat_id, chat, e.value)
+                if e.value <= self.max_flood_wait:
+                    self._requeue(chat, request)
+                else:
+                    self._resolve(request, error=e)
+            except Exception as e:
+                self._resolve(request, error=e)
+            else:
+                self._resolve(request, result=result)
+
+    def _pause(self, chat_id, chat: _Chat, seconds: float) -> None:
+        chat.paused_until = max(chat.paused_until, time.monotonic() + seconds)
+        self.stats["flood_waits"] += 1
+        logger.warning(f"FloodWait of {seconds}s, pausing chat {chat_id}")
+        for listener in self.flood_listeners:
+            try:
+                listener(chat_id, seconds)
+            except Exception as e:
+                logger.error(f"Error in FloodWait listener: {str(e)}")
+
+    def _requeue(self, chat: _Chat, request: _Request) -> None:
+        newer = chat.pending.get(request.key) if request.key is not None else None
+        if newer is not None:
+            # A newer edit of the same message was queued during the call
+            newer.futures.extend(request.futures)
+            return
+        heapq.heappush(chat.queue, request)
+        if request.key is not None:
+            chat.pending[request.key] = request
+
+    @staticmethod
+    def _resolve(request: _Request, result=None, error: Optional[BaseException] = None) -> None:
+        for future in request.futures:
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    async def close(self) -> None:
+        workers = [chat.worker for chat in self._chats.values() if chat.worker and not chat.worker.done()]
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
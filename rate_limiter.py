@@ -0,0 +1,224 @@
+# rate_limiter.py
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Dict, Optional, AsyncIterator
+import asyncio
+import logging
+import time
+
+from config import PROVIDER_LIMITS, USER_RATE_LIMITS
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Async token bucket refilled continuously at `rate` tokens per second"""
+
+    def __init__(self, capacity: float, rate: float):
+        self.capacity = float(capacity)
+        self.rate = float(rate)
+        self.tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    @classmethod
+    def per_minute(cls, limit: float) -> "TokenBucket":
+        return cls(capacity=limit, rate=limit / 60.0)
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, amount: float = 1) -> float:
+        """Wait until `amount` tokens are available, return seconds waited"""
+        amount = min(float(amount), self.capacity)
+        started = time.monotonic()
+        # Holding the lock while sleeping keeps waiters in FIFO order
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return time.monotonic() - started
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+
+    def try_acquire(self, amount: float = 1) -> float:
+        """Take `amount` tokens without waiting; returns 0, or the seconds until they are available"""
+        self._refill()
+        if self.tokens >= amount:
+            self.tokens -= amount
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def charge(self, amount: float) -> None:
+        """Consume tokens after the fact; the balance may go negative"""
+        self._refill()
+        self.tokens -= amount
+
+    def refund(self, amount: float) -> None:
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class ProviderLimiter:
+    """Per-provider and per-model concurrency and request/token rate limits"""
+
+    def __init__(self, limits: Optional[Dict[str, Dict]] = None):
+        self.limits = limits if limits is not None else PROVIDER_LIMITS
+        self._provider_semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._model_semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._media_semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._request_buckets: Dict[str, TokenBucket] = {}
+        self._token_buckets: Dict[str, TokenBucket] = {}
+        self._waiting: Dict[str, int] = {}
+
+    def _provider_semaphore(self, provider: str) -> Optional[asyncio.Semaphore]:
+        limit = self.limits.get(provider, {}).get("max_concurrency")
+        if not limit:
+            return None
+        if provider not in self._provider_semaphores:
+            self._provider_semaphores[provider] = asyncio.Semaphore(limit)
+        return self._provider_semaphores[provider]
+
+    def _media_semaphore(self, provider: str) -> Optional[asyncio.Semaphore]:
+        """Provider slots open to non-text requests; the rest are kept for text"""
+        settings = self.limits.get(provider, {})
+        limit, reserved = settings.get("max_concurrency"), settings.get("text_reserved", 0)
+        if not limit or not reserved:
+            return None
+        if provider not in self._media_semaphores:
+            self._media_semaphores[provider] = asyncio.Semaphore(max(1, limit - reserved))
+        return self._media_semaphores[provider]
+
+    def _model_semaphore(self, provider: str, model_version: str) -> Optional[asyncio.Semaphore]:
+        limit = self.limits.get(provider, {}).get("model_concurrency", {}).get(model_version)
+        if not limit:
+            return None
+        if model_version not in self._model_semaphores:
+            self._model_semaphores[model_version] = asyncio.Semaphore(limit)
+        return self._model_semaphores[model_version]
+
+    def _request_bucket(self, provider: str) -> Optional[TokenBucket]:
+        limit = self.limits.get(provider, {}).get("requests_per_minute")
+        if not limit:
+            return None
+        if provider not in self._request_buckets:
+            self._request_buckets[provider] = TokenBucket.per_minute(limit)
+        return self._request_buckets[provider]
+
+    def token_bucket(self, provider: str) -> Optional[TokenBucket]:
+        limit = self.limits.get(provider, {}).get("tokens_per_minute")
+        if not limit:
+            return None
+        if provider not in self._token_buckets:
+            self._token_buckets[provider] = TokenBucket.per_minute(limit)
+        return self._token_buckets[provider]
+
+    def queue_depth(self, provider: str) -> int:
+        return self._waiting.get(provider, 0)
+
+    @asynccontextmanager
+    async def acquire(
+        self,
+        provider: str,
+        model_version: str,
+        estimated_tokens: int = 0,
+        content_type: str = "text"
+    ) -> AsyncIterator[None]:
+        """Hold a provider slot for the duration of one upstream call
+
+        Media requests only compete for the slots not reserved for text, so a
+        burst of image or video work can't keep short text answers waiting.
+        """
+        started = time.monotonic()
+        self._waiting[provider] = self._waiting.get(provider, 0) + 1
+        metrics.set_gauge("provider_queue_depth", self._waiting[provider], provider=provider)
+
+        provider_semaphore = self._provider_semaphore(provider)
+        model_semaphore = self._model_semaphore(provider, model_version)
+        media_semaphore = self._media_semaphore(provider) if content_type != "text" else None
+        acquired = []
+        try:
+            # Model slot first, so requests waiting on a busy model don't hold provider slots
+            if media_semaphore:
+                await media_semaphore.acquire()
+                acquired.append(media_semaphore)
+            if model_semaphore:
+                await model_semaphore.acquire()
+                acquired.append(model_semaphore)
+            if provider_semaphore:
+                await provider_semaphore.acquire()
+                acquired.append(provider_semaphore)
+
+            request_bucket = self._request_bucket(provider)
+            if request_bucket:
+                await request_bucket.acquire(1)
+            token_bucket = self.token_bucket(provider)
+            if token_bucket and estimated_tokens:
+                await token_bucket.acquire(estimated_tokens)
+        except BaseException:
+            for semaphore in reversed(acquired):
+                semaphore.release()
+            raise
+        finally:
+            self._waiting[provider] -= 1
+            metrics.set_gauge("provider_queue_depth", self._waiting[provider], provider=provider)
+
+        wait_time = time.monotonic() - started
+        metrics.observe("provider_queue_wait_seconds", wait_time, provider=provider)
+        if wait_time > 1:
+            logger.info(f"Queued {wait_time:.2f}s for {provider} ({model_version})")
+
+        try:
+            yield
+        finally:
+            for semaphore in reversed(acquired):
+                semaphore.release()
+
+
+class UserRateLimiter:
+    """Per-user token buckets for each kind of update, kept for the most recent users only"""
+
+    def __init__(self, settings: Optional[Dict] = None):
+        settings = settings if settings is not None else USER_RATE_LIMITS
+        self.enabled = settings["enabled"]
+        self.limits: Dict[str, Dict[str, float]] = settings["limits"]
+        self.max_users = settings["max_users"]
+        self.notice_interval = settings["notice_interval"]
+        self._buckets: Dict[int, Dict[str, TokenBucket]] = OrderedDict()
+        self._notified: Dict[int, float] = OrderedDict()
+
+    def check(self, user_id: int, kind: str) -> float:
+        """Count an update; returns 0 if allowed, else seconds until the user may retry"""
+        limit = self.limits.get(kind)
+        if not self.enabled or not limit:
+            return 0.0
+
+        buckets = self._buckets.get(user_id)
+        if buckets is None:
+            buckets = self._buckets[user_id] = {}
+            if len(self._buckets) > self.max_users:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(user_id)
+        bucket = buckets.get(kind)
+        if bucket is None:
+            bucket = buckets[kind] = TokenBucket(limit["capacity"], limit["per_minute"] / 60.0)
+
+        retry_after = bucket.try_acquire(1)
+        if retry_after:
+            metrics.inc("user_rate_limited_total", kind=kind)
+        return retry_after
+
+    def should_notify(self, user_id: int) -> bool:
+        """Whether a cool-down notice is due; at most one per notice_interval per user"""
+        now = time.monotonic()
+        if now - self._notified.get(user_id, float("-inf")) < self.notice_interval:
+            return False
+        self._notified[user_id] = now
+        self._notified.move_to_end(user_id)
+        if len(self._notified) > self.max_users:
+            self._notified.popitem(last=False)
+        return True
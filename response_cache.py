@@ -0,0 +1,132 @@
+# response_cache.py
+from collections import OrderedDict
+from typing import Optional, Dict, Any, List, AsyncGenerator
+import hashlib
+import json
+import logging
+import os
+import time
+
+from config import RESPONSE_CACHE
+from metrics import metrics
+from handlers.stream_events import EventStream, StreamEvent, DELTA, USAGE, FINISH
+
+logger = logging.getLogger(__name__)
+
+
+def _file_digest(file_path: Optional[str]) -> Optional[str]:
+    """Hash file contents so renamed copies of the same upload share a key"""
+    if not file_path or not os.path.exists(file_path):
+        return None
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def request_digest(
+    model_name: str,
+    model_version: str,
+    content: str,
+    content_type: str,
+    file_path: Optional[str],
+    options: Dict[str, Any]
+) -> str:
+    """Digest of the fully assembled request: model, params, history and content"""
+    payload = {
+        "model": model_name,
+        "version": model_version,
+        "content": content,
+        "content_type": content_type,
+        "file": _file_digest(file_path),
+        "options": options
+    }
+    encoded = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+class CachedResponse:
+    """Replayable record of a successful stream"""
+
+    def __init__(self, deltas: List[str], usage: Optional[Dict[str, int]], finish_reason: Optional[str]):
+        self.deltas = deltas
+        self.usage = usage
+        self.finish_reason = finish_reason
+        self.created_at = time.monotonic()
+
+    @classmethod
+    def from_events(cls, events: List[StreamEvent]) -> Optional["CachedResponse"]:
+        """Build a record, or None if the stream failed or was incomplete"""
+        deltas, usage, finish_reason = [], None, None
+        for event in events:
+            if event.is_error:
+                return None
+            if event.kind == DELTA:
+                deltas.append(event.text)
+            elif event.kind == USAGE:
+                usage = event.usage
+            elif event.kind == FINISH:
+                finish_reason = event.finish_reason
+        if not deltas or finish_reason is None:
+            return None
+        return cls(deltas, usage, finish_reason)
+
+    async def replay(self) -> AsyncGenerator[StreamEvent, None]:
+        events = EventStream()
+        for text in self.deltas:
+            yield events.delta(text)
+        if self.usage:
+            yield events.usage(**self.usage)
+        yield events.finish(self.finish_reason)
+
+
+class ResponseCache:
+    """LRU cache with per-entry TTL for complete model responses"""
+
+    def __init__(self, settings: Optional[Dict] = None):
+        settings = settings if settings is not None else RESPONSE_CACHE
+        self.enabled = settings["enabled"]
+        self.max_entries = settings["max_entries"]
+        self.ttl = settings["ttl_seconds"]
+        self._entries: "OrderedDict[str, CachedResponse]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def hit_ratio(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        entry = self._entries.get(key)
+        if entry is not None and time.monotonic() - entry.created_at > self.ttl:
+            del self._entries[key]
+            entry = None
+
+        if entry is None:
+            self.misses += 1
+            metrics.inc("response_cache_requests_total", result="miss")
+        else:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            metrics.inc("response_cache_requests_total", result="hit")
+        metrics.set_gauge("response_cache_hit_ratio", self.hit_ratio)
+        return entry
+
+    def put(self, key: str, events: List[StreamEvent]) -> bool:
+        entry = CachedResponse.from_events(events)
+        if entry is None:
+            return False
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        metrics.set_gauge("response_cache_entries", len(self._entries))
+        return True
+
+    def clear(self) -> None:
+        self._entries.clear()
@@ -0,0 +1,55 @@
+# retry_policy.py
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from typing import Optional, Dict, Tuple
+import random
+
+from config import RETRY_POLICY
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Parse a Retry-After header given in seconds or as an HTTP date"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+class RetryPolicy:
+    """Jittered exponential backoff with per-provider error classification"""
+
+    def __init__(self, settings: Optional[Dict] = None):
+        settings = settings if settings is not None else RETRY_POLICY
+        self.max_attempts: int = settings["max_attempts"]
+        self.base_delay: float = settings["base_delay"]
+        self.max_delay: float = settings["max_delay"]
+        self.deadline_seconds: float = settings["deadline_seconds"]
+        self.retryable_errors: Dict[str, Tuple[str, ...]] = settings["retryable_errors"]
+
+    def is_retryable(self, provider: str, error: Optional[str], retryable: bool = False) -> bool:
+        """Return True for transient provider errors worth retrying"""
+        if retryable:
+            return True
+        if not error:
+            return False
+        error = error.lower()
+        markers = self.retryable_errors.get(provider) or self.retryable_errors.get("default", ())
+        return any(marker in error for marker in markers)
+
+    def backoff(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """Delay before retry number `attempt` (1-based), honouring Retry-After"""
+        ceiling = min(self.max_delay, self.base_delay * (2 ** (attempt - 1)))
+        # Full jitter spreads retries so clients don't resynchronise
+        delay = random.uniform(0, ceiling)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
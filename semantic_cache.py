@@ -0,0 +1,158 @@
+# semantic_cache.py
+from typing import Optional, Dict, List, Tuple
+import logging
+import math
+import re
+import zlib
+
+from config import SEMANTIC_CACHE
+from metrics import metrics
+from response_cache import CachedResponse
+
+np = None  # numpy is optional and only imported when the cache is enabled
+
+logger = logging.getLogger(__name__)
+
+_TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+
+def _load_numpy():
+    global np
+    if np is None:
+        try:
+            import numpy
+        except ImportError:
+            return None
+        np = numpy
+    return np
+
+
+class HashingVectorizer:
+    """Map text to a fixed-size term-frequency vector with the hashing trick"""
+
+    def __init__(self, n_features: int = 2048):
+        self.n_features = n_features
+
+    def _features(self, text: str) -> List[str]:
+        words = _TOKEN_PATTERN.findall(text.lower())
+        bigrams = [f"{a} {b}" for a, b in zip(words, words[1:])]
+        return words + bigrams
+
+    def transform(self, text: str):
+        vector = np.zeros(self.n_features, dtype=np.float32)
+        for feature in self._features(text):
+            vector[zlib.crc32(feature.encode("utf-8")) % self.n_features] += 1.0
+        # Sublinear term frequency keeps repeated words from dominating
+        np.log1p(vector, out=vector)
+        return vector
+
+
+class SemanticCache:
+    """Reuse answers to near-duplicate first-turn prompts via TF-IDF cosine search"""
+
+    def __init__(self, settings: Optional[Dict] = None):
+        settings = settings if settings is not None else SEMANTIC_CACHE
+        self.enabled = settings["enabled"] and _load_numpy() is not None
+        if settings["enabled"] and not self.enabled:
+            logger.warning("Semantic cache requested but numpy is not installed; disabling it")
+        self.threshold = settings["threshold"]
+        self.max_entries = settings["max_entries"]
+        self.max_prompt_chars = settings["max_prompt_chars"]
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+        if not self.enabled:
+            return
+
+        self.vectorizer = HashingVectorizer(settings["n_features"])
+        self._matrix = np.zeros((self.max_entries, self.vectorizer.n_features), dtype=np.float32)
+        self._document_frequency = np.zeros(self.vectorizer.n_features, dtype=np.float32)
+        self._model_ids = np.full(self.max_entries, -1, dtype=np.int32)
+        self._models: Dict[Tuple[str, str], int] = {}
+        self._entries: List[Optional[Tuple[CachedResponse, float]]] = [None] * self.max_entries
+        self._size = 0
+        self._next_row = 0
+
+    def __len__(self) -> int:
+        return self._size if self.enabled else 0
+
+    @property
+    def hit_ratio(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def is_eligible(self, content: str, content_type: str, chat_history: Optional[list]) -> bool:
+        """Only short, text-only first-turn prompts are matched semantically"""
+        return (
+            self.enabled
+            and content_type == "text"
+            and not chat_history
+            and bool(content and content.strip())
+            and len(content) <= self.max_prompt_chars
+        )
+
+    def _idf(self):
+        return np.log((1.0 + self._size) / (1.0 + self._document_frequency)) + 1.0
+
+    def _search(self, vector, model_id: int) -> Tuple[int, float]:
+        """Return the best matching row and its cosine similarity"""
+        rows = np.flatnonzero(self._model_ids[:self._size] == model_id)
+        if rows.size == 0:
+            return -1, 0.0
+        idf = self._idf()
+        query = vector * idf
+        query_norm = float(np.linalg.norm(query))
+        if query_norm == 0.0:
+            return -1, 0.0
+        candidates = self._matrix[rows] * idf
+        norms = np.linalg.norm(candidates, axis=1) * query_norm
+        norms[norms == 0.0] = math.inf
+        similarities = (candidates @ query) / norms
+        best = int(np.argmax(similarities))
+        return int(rows[best]), float(similarities[best])
+
+    def lookup(self, content: str, model_name: str, model_version: str) -> Optional[CachedResponse]:
+        model_id = self._models.get((model_name, model_version))
+        row, similarity = (-1, 0.0)
+        if model_id is not None:
+            row, similarity = self._search(self.vectorizer.transform(content), model_id)
+
+        if row < 0 or similarity < self.threshold:
+            self.misses += 1
+            metrics.inc("semantic_cache_requests_total", result="miss")
+            metrics.set_gauge("semantic_cache_hit_ratio", self.hit_ratio)
+            return None
+
+        response, latency = self._entries[row]
+        self.hits += 1
+        self.saved_seconds += latency
+        metrics.inc("semantic_cache_requests_total", result="hit")
+        metrics.inc("semantic_cache_saved_seconds_total", latency)
+        metrics.set_gauge("semantic_cache_hit_ratio", self.hit_ratio)
+        logger.info(f"Semantic cache hit for {model_version} (similarity {similarity:.3f})")
+        return response
+
+    def add(
+        self,
+        content: str,
+        model_name: str,
+        model_version: str,
+        response: CachedResponse,
+        latency: float
+    ) -> None:
+        """Store an answer; the oldest entry is overwritten once the matrix is full"""
+        model_id = self._models.setdefault((model_name, model_version), len(self._models))
+        vector = self.vectorizer.transform(content)
+        if self._size and self._search(vector, model_id)[1] >= self.threshold:
+            return  # An equivalent prompt is already stored
+
+        row = self._next_row
+        if self._entries[row] is not None:
+            self._document_frequency -= self._matrix[row] > 0
+        self._matrix[row] = vector
+        self._document_frequency += vector > 0
+        self._model_ids[row] = model_id
+        self._entries[row] = (response, latency)
+        self._next_row = (row + 1) % self.max_entries
+        self._size = min(self._size + 1, self.max_entries)
+        metrics.set_gauge("semantic_cache_entries", self._size)
@@ -0,0 +1,110 @@
+# single_flight.py
+from typing import Dict, List, Set, Callable, AsyncGenerator, Optional
+import asyncio
+import logging
+
+from metrics import metrics
+from generation_registry import CancellationToken
+from handlers.stream_events import EventStream, StreamEvent
+
+logger = logging.getLogger(__name__)
+
+_DONE = object()
+
+
+class _Flight:
+    """One upstream stream shared by every subscriber with the same digest"""
+
+    def __init__(self):
+        self.events: List[StreamEvent] = []
+        self.subscribers: Set[asyncio.Queue] = set()
+        self.done = False
+        self.task: Optional[asyncio.Task] = None
+
+
+class SingleFlight:
+    """Coalesce concurrent identical requests into a single upstream call"""
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._flights: Dict[str, _Flight] = {}
+
+    def in_flight(self, key: str) -> bool:
+        return key in self._flights
+
+    async def stream(
+        self,
+        key: str,
+        factory: Callable[[], AsyncGenerator[StreamEvent, None]],
+        cancel_token: Optional[CancellationToken] = None
+    ) -> AsyncGenerator[StreamEvent, None]:
+        """Subscribe to the flight for `key`, starting it with `factory` if needed
+
+        `cancel_token` ends this subscription only; the shared upstream call is
+        stopped once its last subscriber has gone.
+        """
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = self._flights[key] = _Flight()
+            flight.task = asyncio.create_task(self._run(key, flight, factory))
+            metrics.inc("single_flight_requests_total", role="leader")
+        else:
+            metrics.inc("single_flight_requests_total", role="follower")
+
+        # Late subscribers first receive everything produced so far
+        queue: asyncio.Queue = asyncio.Queue()
+        for event in flight.events:
+            queue.put_nowait(event)
+        if flight.done:
+            queue.put_nowait(_DONE)
+        flight.subscribers.add(queue)
+
+        def unsubscribe():
+            queue.put_nowait(_DONE)
+
+        if cancel_token is not None:
+            if cancel_token.cancelled:
+                unsubscribe()
+            cancel_token.add_callback(unsubscribe)
+        try:
+            while True:
+                event = await queue.get()
+                if event is _DONE or (cancel_token is not None and cancel_token.cancelled):
+                    return
+                yield event
+        finally:
+            if cancel_token is not None:
+                cancel_token.remove_callback(unsubscribe)
+            flight.subscribers.discard(queue)
+            if not flight.subscribers and not flight.done:
+                # Nobody is listening any more; stop the upstream call. Unlist it
+                # first so a caller arriving meanwhile starts a fresh flight
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+                flight.task.cancel()
+
+    async def _run(
+        self,
+        key: str,
+        flight: _Flight,
+        factory: Callable[[], AsyncGenerator[StreamEvent, None]]
+    ) -> None:
+        try:
+            async for event in factory():
+                flight.events.append(event)
+                for queue in flight.subscribers:
+                    queue.put_nowait(event)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error in shared upstream request: {str(e)}")
+            event = EventStream().error(str(e))
+            flight.events.append(event)
+            for queue in flight.subscribers:
+                queue.put_nowait(event)
+        finally:
+            flight.done = True
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+            for queue in flight.subscribers:
+                queue.put_nowait(_DONE)
@@ -0,0 +1,64 @@
+# startup_profiler.py
+from typing import List, Tuple
+import builtins
+import sys
+import time
+
+
+def _module_name(name: str, globals, fromlist, level: int) -> str:
+    """Readable absolute name for a possibly relative import"""
+    if not level:
+        return name
+    package = (globals or {}).get("__package__") or ""
+    base = package.rsplit(".", level - 1)[0] if level > 1 else package
+    if name:
+        return f"{base}.{name}"
+    return f"{base} ({', '.join(fromlist)})" if fromlist else base
+
+
+class StartupProfiler:
+    """Time module imports and startup phases, like `python -X importtime`"""
+
+    def __init__(self):
+        self.imports: List[Tuple[str, float, float]] = []  # (module, cumulative, self)
+        self.phases: List[Tuple[str, float]] = []
+        self._stack: List[float] = []
+        self._original_import = builtins.__import__
+        self._started = time.perf_counter()
+
+    def __enter__(self) -> "StartupProfiler":
+        builtins.__import__ = self._import
+        return self
+
+    def __exit__(self, *exc) -> None:
+        builtins.__import__ = self._original_import
+
+    def _import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        if level == 0 and name in sys.modules:
+            return self._original_import(name, globals, locals, fromlist, level)
+
+        start = time.perf_counter()
+        self._stack.append(0.0)
+        try:
+            return self._original_import(name, globals, locals, fromlist, level)
+        finally:
+            elapsed = time.perf_counter() - start
+            children = self._stack.pop()
+            if self._stack:
+                self._stack[-1] += elapsed
+            self.imports.append((_module_name(name, globals, fromlist, level), elapsed, elapsed - children))
+
+    def phase(self, name: str, start: float) -> None:
+        self.phases.append((name, time.perf_counter() - start))
+
+    def report(self, limit: int = 25) -> str:
+        total = time.perf_counter() - self._started
+        lines = [f"Startup took {total * 1000:.1f} ms", "", "Phases:"]
+        for name, elapsed in self.phases:
+            lines.append(f"  {elapsed * 1000:9.1f} ms  {name}")
+
+        lines += ["", f"Slowest imports (top {limit} by self time):", "    self ms   cumul ms  module"]
+        slowest = sorted(self.imports, key=lambda record: record[2], reverse=True)[:limit]
+        for name, cumulative, own in slowest:
+            lines.append(f"  {own * 1000:9.1f}  {cumulative * 1000:9.1f}  {name}")
+        return "\n".join(lines)
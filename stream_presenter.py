@@ -0,0 +1,146 @@
+# stream_presenter.py
+"""Pacing of streamed answers into Telegram message edits.
+
+A StreamPresenter collects deltas from the model without waiting on Telegram.
+A background task shows the first text at once and then edits the message at
+most once per chat interval, always with the latest text. The interval is kept
+per chat by EditThrottle, which backs off when Telegram answers with FloodWait
+and recovers gradually after successful edits.
+"""
+from collections import OrderedDict
+from typing import Optional, List
+import asyncio
+import logging
+import time
+
+from outbound_scheduler import outbound_priority, PRIORITY_STREAMING, PRIORITY_FINAL
+
+logger = logging.getLogger(__name__)
+
+
+class EditThrottle:
+    """Per-chat edit interval that adapts to FloodWait"""
+
+    def __init__(
+        self,
+        min_interval: float = 1.0,
+        max_interval: float = 10.0,
+        backoff: float = 2.0,
+        recovery: float = 0.9,
+        max_chats: int = 10000
+    ):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.recovery = recovery
+        self.max_chats = max_chats
+        self._chats = OrderedDict()  # chat_id -> [interval, earliest next edit]
+
+    def _chat(self, chat_id) -> List[float]:
+        state = self._chats.get(chat_id)
+        if state is None:
+            state = self._chats[chat_id] = [self.min_interval, 0.0]
+            if len(self._chats) > self.max_chats:
+                self._chats.popitem(last=False)
+        else:
+            self._chats.move_to_end(chat_id)
+        return state
+
+    def interval(self, chat_id) -> float:
+        return self._chat(chat_id)[0]
+
+    def delay(self, chat_id) -> float:
+        """Seconds until the chat may be edited again"""
+        return max(0.0, self._chat(chat_id)[1] - time.monotonic())
+
+    def record_edit(self, chat_id) -> None:
+        state = self._chat(chat_id)
+        state[1] = time.monotonic() + state[0]
+        state[0] = max(self.min_interval, state[0] * self.recovery)
+
+    def record_flood_wait(self, chat_id, seconds: float) -> None:
+        state = self._chat(chat_id)
+        state[0] = min(self.max_interval, max(state[0] * self.backoff, self.min_interval))
+        state[1] = max(state[1], time.monotonic() + seconds)
+        logger.warning(f"FloodWait of {seconds}s in chat {chat_id}, edit interval now {state[0]:.1f}s")
+
+
+class StreamPresenter:
+    """Show a streamed answer in a message, coalescing deltas between paced edits
+
+    Use as an async context manager around the stream: leaving it normally
+    flushes the final text, leaving it with an error cancels pending edits so
+    they can't overwrite an error message.
+    """
+
+    def __init__(self, message_handler, message, reply_markup=None, content_type: str = "text"):
+        self.message_handler = message_handler
+        self.throttle: EditThrottle = message_handler.edit_throttle
+        self.message = message
+        self.reply_markup = reply_markup
+        self.content_type = content_type
+        self.chat_id = message.chat.id
+        self._parts: List[str] = []
+        self._text = ""
+        self._length = 0
+        self._shown_length = 0
+        self._task: Optional[asyncio.Task] = None
+        self._finishing = False
+
+    @property
+    def text(self) -> str:
+        if len(self._text) != self._length:
+            self._text = "".join(self._parts)
+            self._parts = [self._text]
+        return self._text
+
+    def push(self, delta: str) -> None:
+        """Add a delta; never waits on Telegram"""
+        if not delta:
+            return
+        self._parts.append(delta)
+        self._length += len(delta)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        while self._shown_length < self._length:
+            # The first text is shown at once; later edits wait for the chat's interval
+            delay = self.throttle.delay(self.chat_id) if self._shown_length else 0
+            if delay:
+                await asyncio.sleep(delay)
+            # Once the stream has ended, the edit carries the final answer
+            with outbound_priority(PRIORITY_FINAL if self._finishing else PRIORITY_STREAMING):
+                await self._show()
+
+    async def _show(self) -> None:
+        text = self.text
+        self._shown_length = len(text)
+        await self.message_handler.edit_message_safely(
+            self.message,
+            text,
+            reply_markup=self.reply_markup,
+            content_type=self.content_type
+        )
+
+    async def finish(self) -> str:
+        """Wait until the complete text is shown and return it"""
+        self._finishing = True
+        if self._task is not None:
+            await self._task
+        if self._shown_length < self._length:
+            await self._run()
+        return self.text
+
+    def cancel(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+
+    async def __aenter__(self) -> "StreamPresenter":
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            await self.finish()
+        else:
+            self.cancel()
@@ -0,0 +1,121 @@
+# update_trace.py
+"""Anonymized traces of incoming Telegram updates for replay in load_test.py.
+
+A trace is gzip-compressed JSON lines: a header object followed by one
+`[t_ms, user, kind, size, extra]` array per update. Users are renumbered per
+recording, text is reduced to its length and numeric ids in callback data are
+replaced with "#".
+"""
+from typing import Optional, Dict, List, NamedTuple
+import gzip
+import json
+import logging
+import os
+import re
+import time
+
+logger = logging.getLogger(__name__)
+
+TRACE_VERSION = 1
+MEDIA_KINDS = ("photo", "video", "audio", "voice", "document")
+
+_NUMERIC_SEGMENT = re.compile(r"(?<=:)-?\d+(?=:|$)")
+
+
+class TraceEvent(NamedTuple):
+    t: float  # Seconds since the start of the recording
+    user: int
+    kind: str  # text, command, callback, other or one of MEDIA_KINDS
+    size: int  # Characters for text, bytes for media
+    extra: Optional[str]  # Command name, callback pattern or file extension
+
+
+def anonymize_callback_data(data: str) -> str:
+    """Keep the callback's shape (action, model, format) but drop chat and message ids"""
+    return _NUMERIC_SEGMENT.sub("#", data or "")
+
+
+class UpdateRecorder:
+    """Append anonymized update records to a trace file"""
+
+    def __init__(self, path: str, max_events: int = 1000000, flush_every: int = 50):
+        self.path = path
+        self.max_events = max_events
+        self.flush_every = flush_every
+        self.events = 0
+        self._users: Dict[int, int] = {}  # Real user id -> index; never written out
+        self._started = time.monotonic()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._file = gzip.open(path, "at", encoding="utf-8")
+        self._write({"version": TRACE_VERSION, "format": "[t_ms, user, kind, size, extra]"})
+        logger.info(f"Recording update trace to {path}")
+
+    def _write(self, record) -> None:
+        self._file.write(json.dumps(record, separators=(",", ":"), ensure_ascii=False) + "\n")
+
+    def _user_index(self, user) -> int:
+        user_id = user.id if user else 0
+        return self._users.setdefault(user_id, len(self._users))
+
+    def _append(self, user, kind: str, size: int = 0, extra: Optional[str] = None) -> None:
+        if self._file is None or self.events >= self.max_events:
+            return
+        t_ms = int((time.monotonic() - self._started) * 1000)
+        try:
+            self._write([t_ms, self._user_index(user), kind, size, extra])
+            self.events += 1
+            if self.events % self.flush_every == 0:
+                self._file.flush()
+        except Exception as e:
+            logger.error(f"Error writing update trace: {str(e)}")
+
+    def record_message(self, message) -> None:
+        text = message.text or ""
+        if text.startswith("/"):
+            command = text[1:].split(maxsplit=1)[0].split("@")[0] if len(text) > 1 else ""
+            self._append(message.from_user, "command", len(text), command.lower())
+            return
+        if text:
+            self._append(message.from_user, "text", len(text))
+            return
+
+        for kind in MEDIA_KINDS:
+            media = getattr(message, kind, None)
+            if media is not None:
+                file_name = getattr(media, "file_name", None) or ""
+                extension = os.path.splitext(file_name)[1].lower() or None
+                self._append(message.from_user, kind, getattr(media, "file_size", 0) or 0, extension)
+                return
+        self._append(message.from_user, "other")
+
+    def record_callback(self, callback_query) -> None:
+        self._append(
+            callback_query.from_user, "callback", 0, anonymize_callback_data(callback_query.data)
+        )
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def load_trace(path: str) -> List[TraceEvent]:
+    """Read a trace, tolerating a truncated tail from an unclean shutdown"""
+    events: List[TraceEvent] = []
+    offset, last = 0.0, 0.0
+    user_base, users = 0, 0
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        try:
+            for line in f:
+                record = json.loads(line)
+                if isinstance(record, dict):
+                    # Each header starts a recording session appended to the same file
+                    offset, user_base = last, users
+                    continue
+                t_ms, user, kind, size, extra = record
+                last = offset + t_ms / 1000
+                users = max(users, user_base + user + 1)
+                events.append(TraceEvent(last, user_base + user, kind, size, extra))
+        except (EOFError, json.JSONDecodeError):
+            logger.warning(f"Trace {path} ends with an incomplete record")
+    return events